@@ -9,3 +9,10 @@ vex --python=python3 -m test pip install --quiet -U setuptools wheel pip
 vex test pip install --quiet -U -r requirements.dev.txt
 vex test pip install -U git+ssh://git@github.com/edgedb/edgedb.git#eggname=edgedb
 vex test python setup.py test
+
+vex test python -m edgedb.sphinxext.xrefcheck -v doc
+
+DOCS_CACHE_OPTS="--cache-dir $HOME/.cache/edgedb-docs -d _build/doctrees doc"
+vex test python -m edgedb.sphinxext.cicache import $DOCS_CACHE_OPTS
+vex test make html
+vex test python -m edgedb.sphinxext.cicache export $DOCS_CACHE_OPTS
@@ -0,0 +1,102 @@
+"""Measure peak RSS of HTML builds as the corpus grows.
+
+Builds generated projects with a growing number of pages, each in a
+separate sphinx-build process, and reports the peak RSS of the build
+with and without "edgedb_low_memory".
+
+    $ python bench/bench_lowmem.py -n 250 -n 500 -n 1000 -n 2000
+"""
+
+
+import argparse
+import os
+import os.path
+import subprocess
+import sys
+import tempfile
+
+
+CONF = '''
+extensions = ['edgedb.sphinxext']
+master_doc = 'index'
+'''
+
+PAGE = '''\
+{title}
+{underline}
+
+{paragraphs}
+
+.. code-block:: python
+
+{code}
+
+{table}
+'''
+
+
+def make_page(n):
+    title = f'Page {n}'
+    paragraphs = '\n\n'.join(
+        f'Paragraph {i} of page {n} with *emphasis*, **strong** text and '
+        f'``inline code`` that refers to :ref:`page-{(n + i) % 7}`.'
+        for i in range(40))
+    code = '\n'.join(
+        f'    def function_{i}(arg):\n        return arg * {i}\n'
+        for i in range(30))
+    rows = '\n'.join(
+        f'   * - row {i}\n     - value {i * n}' for i in range(30))
+    table = f'.. list-table::\n\n{rows}'
+    return PAGE.format(
+        title=title, underline='=' * len(title),
+        paragraphs=paragraphs, code=code, table=table)
+
+
+def make_project(srcdir, n):
+    with open(os.path.join(srcdir, 'conf.py'), 'wt') as f:
+        f.write(CONF)
+
+    with open(os.path.join(srcdir, 'index.rst'), 'wt') as f:
+        f.write('Index\n=====\n\n.. toctree::\n   :glob:\n\n   page*\n')
+
+    for i in range(n):
+        with open(os.path.join(srcdir, f'page{i}.rst'), 'wt') as f:
+            if i < 7:
+                f.write(f'.. _page-{i}:\n\n')
+            f.write(make_page(i))
+
+
+def peak_rss(srcdir, outdir, low_memory):
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'sphinx', '-q', '-E', '-b', 'html',
+         '-D', f'edgedb_low_memory={int(low_memory)}',
+         srcdir, outdir],
+        stdout=subprocess.DEVNULL)
+    _, status, rusage = os.wait4(proc.pid, 0)
+    if status != 0:
+        raise RuntimeError(f'sphinx-build failed with status {status}')
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    rss = rusage.ru_maxrss
+    return rss / 2**20 if sys.platform == 'darwin' else rss / 2**10
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, action='append', dest='sizes')
+    args = parser.parse_args()
+
+    print(f'{"pages":>8} {"default (MiB)":>14} {"low memory (MiB)":>17}')
+    for n in args.sizes or [250, 500, 1000, 2000]:
+        with tempfile.TemporaryDirectory() as td:
+            srcdir = os.path.join(td, 'src')
+            os.mkdir(srcdir)
+            make_project(srcdir, n)
+
+            default = peak_rss(srcdir, os.path.join(td, 'default'), False)
+            low = peak_rss(srcdir, os.path.join(td, 'low'), True)
+
+        print(f'{n:>8} {default:>14.1f} {low:>17.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Benchmark the write phase with a global toctree in every sidebar.
+
+Builds projects with a growing number of pages (in sections of 20
+pages each) and the "globaltoc.html" sidebar, and reports the time
+spent in the write phase with and without the cached toctree renderer.
+
+    $ python bench/bench_toctree.py -n 100 -n 200 -n 400
+"""
+
+
+import argparse
+import os
+import os.path
+import tempfile
+import time
+
+from sphinx import application as s_app
+
+
+CONF = '''
+extensions = ['edgedb.sphinxext']
+master_doc = 'index'
+html_theme = 'alabaster'
+html_sidebars = {'**': ['globaltoc.html']}
+edgedb_cached_toctree = %r
+'''
+
+
+def make_project(srcdir, n, cached):
+    with open(os.path.join(srcdir, 'conf.py'), 'wt') as f:
+        f.write(CONF % cached)
+
+    sections = [f'section{i}' for i in range((n + 19) // 20)]
+    with open(os.path.join(srcdir, 'index.rst'), 'wt') as f:
+        f.write('Index\n=====\n\n.. toctree::\n\n')
+        for section in sections:
+            f.write(f'    {section}/index\n')
+
+    for s, section in enumerate(sections):
+        os.mkdir(os.path.join(srcdir, section))
+        pages = [f'page{i}' for i in range(s * 20, min(n, s * 20 + 20))]
+        with open(os.path.join(srcdir, section, 'index.rst'), 'wt') as f:
+            title = f'Section {s}'
+            f.write(f'{title}\n{"=" * len(title)}\n\n.. toctree::\n\n')
+            for page in pages:
+                f.write(f'    {page}\n')
+        for page in pages:
+            with open(os.path.join(srcdir, section, f'{page}.rst'),
+                      'wt') as f:
+                f.write(f'{page}\n{"=" * len(page)}\n\nSome text.\n')
+
+
+def run(n, cached):
+    with tempfile.TemporaryDirectory() as td:
+        srcdir = os.path.join(td, 'src')
+        os.mkdir(srcdir)
+        make_project(srcdir, n, cached)
+
+        app = s_app.Sphinx(
+            srcdir, srcdir, os.path.join(td, 'out'),
+            os.path.join(td, 'doctrees'), 'html',
+            status=None, warning=None, freshenv=True)
+
+        marks = {}
+
+        def mark(name):
+            # The handlers must return None: Sphinx reads the return
+            # value of "env-updated" as a list of documents to write.
+            def handler(*args):
+                marks.setdefault(name, time.perf_counter())
+            return handler
+
+        app.connect('env-updated', mark('read'))
+        app.connect('build-finished', mark('write'))
+        app.build()
+
+        return marks['write'] - marks['read']
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, action='append', dest='sizes')
+    args = parser.parse_args()
+
+    print(f'{"pages":>8} {"default (s)":>12} {"cached (s)":>12} '
+          f'{"speedup":>8}')
+    for n in args.sizes or [100, 200, 400, 800]:
+        default = run(n, False)
+        cached = run(n, True)
+        print(f'{n:>8} {default:>12.2f} {cached:>12.2f} '
+              f'{default / cached:>7.2f}x')
+
+
+if __name__ == '__main__':
+    main()
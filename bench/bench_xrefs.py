@@ -0,0 +1,113 @@
+"""Benchmark eql cross-reference resolution.
+
+Builds a project with a page declaring N statements and types and
+a page with N :eql:stmt: and N :eql:type: references to them, then
+measures how long it takes to resolve the references of that page with
+and without XRefBatchTransform: only the two transforms that resolve
+references (XRefBatchTransform and ReferencesResolver) are timed, on a
+fresh copy of the doctree each time.  The timings are CPU times with
+the garbage collector disabled, as its pauses otherwise dominate the
+differences; the median of the repeats is reported.
+
+    $ python bench/bench_xrefs.py -n 100 -n 500 -n 1000
+"""
+
+
+import argparse
+import gc
+import os.path
+import statistics
+import tempfile
+import time
+
+from sphinx import application as s_app
+from sphinx.transforms import post_transforms as s_post_transforms
+
+from edgedb.sphinxext import eql
+
+
+CONF = '''
+extensions = ['edgedb.sphinxext']
+master_doc = 'index'
+'''
+
+
+def make_project(srcdir, n):
+    with open(os.path.join(srcdir, 'conf.py'), 'wt') as f:
+        f.write(CONF)
+
+    defs = ['Definitions', '===========', '']
+    refs = ['References', '==========', '']
+    for i in range(n):
+        word = ''.join(chr(ord('A') + int(d)) for d in str(i))
+        title = f'STMT {word}'
+        defs.extend([
+            title, '-' * len(title), '',
+            ':eql-statement:', '',
+            'A statement.', '',
+            f'.. eql:type:: std::type{i}', '',
+            '    A type.', '',
+        ])
+        refs.append(
+            f'See :eql:stmt:`{title}`, :eql:type:`type{i}` and '
+            f':eql:type:`SET OF type{i}`.')
+        refs.append('')
+
+    with open(os.path.join(srcdir, 'index.rst'), 'wt') as f:
+        f.write('Index\n=====\n\n.. toctree::\n\n    defs\n    refs\n')
+    with open(os.path.join(srcdir, 'defs.rst'), 'wt') as f:
+        f.write('\n'.join(defs))
+    with open(os.path.join(srcdir, 'refs.rst'), 'wt') as f:
+        f.write('\n'.join(refs))
+
+
+def run(n, repeat):
+    with tempfile.TemporaryDirectory() as td:
+        srcdir = os.path.join(td, 'src')
+        os.mkdir(srcdir)
+        make_project(srcdir, n)
+
+        app = s_app.Sphinx(
+            srcdir, srcdir, os.path.join(td, 'out'),
+            os.path.join(td, 'doctrees'), 'html',
+            status=None, warning=None, freshenv=True)
+        app.build()
+
+        doctree = app.env.get_doctree('refs')
+        app.env.temp_data['docname'] = 'refs'
+
+        results = {}
+        for batch in (False, True):
+            app.config.edgedb_eql_batch_xrefs = batch
+            timings = []
+            for _ in range(repeat):
+                document = doctree.deepcopy()
+                gc.collect()
+                gc.disable()
+                started = time.process_time()
+                eql.XRefBatchTransform(document).apply()
+                s_post_transforms.ReferencesResolver(document).apply()
+                timings.append(time.process_time() - started)
+                gc.enable()
+            results[batch] = statistics.median(timings)
+
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, action='append', dest='sizes')
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f'{"refs":>8} {"per-xref (ms)":>14} {"batched (ms)":>14} '
+          f'{"speedup":>8}')
+    for n in args.sizes or [100, 500, 1000]:
+        results = run(n, args.repeat)
+        default, batched = results[False], results[True]
+        print(f'{n * 3:>8} {default * 1000:>14.1f} {batched * 1000:>14.1f} '
+              f'{default / batched:>7.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -161,6 +161,7 @@ html_static_path = ['_static']
 html_sidebars = {
     '**': [
         'globaltoc.html',
+        'versions.html',
         'srclinks.html',
         'searchbox.html',
     ]
@@ -300,3 +301,11 @@ texinfo_documents = [
 srclink_project = 'https://github.com/edgedb/edgedb'
 srclink_src_path = 'doc/'
 srclink_branch = 'doc'
+
+# config for edgedb.sphinxext
+
+edgedb_write_if_changed = True
+edgedb_write_threads = 4
+edgedb_cached_toctree = True
+edgedb_hash_sources = True
+edgedb_schedule_reads = True
@@ -1,10 +1,24 @@
 from docutils import nodes as d_nodes
 from sphinx import transforms as s_transforms
 
+from . import compress
+from . import doctreestore
 from . import eql
 from . import eschema
 from . import graphql
+from . import inventory
+from . import lowmem
+from . import memprofile
+from . import metrics
+from . import multiversion
+from . import navigation
+from . import pagewriter
+from . import react
+from . import schedule
 from . import shared
+from . import sourcehash
+from . import srclinks
+from . import stdlib
 
 
 class ProhibitedNodeTransform(s_transforms.SphinxTransform):
@@ -25,9 +39,33 @@ class ProhibitedNodeTransform(s_transforms.SphinxTransform):
                 f'double backticks?')
 
 
+def emit_build_started(app):
+    app.emit(shared.BUILD_STARTED_EVENT)
+
+
 def setup(app):
+    app.add_event(shared.BUILD_STARTED_EVENT)
+
     eql.setup_domain(app)
     eschema.setup_domain(app)
     graphql.setup_domain(app)
 
+    compress.setup_extension(app)
+    doctreestore.setup_extension(app)
+    inventory.setup_extension(app)
+    lowmem.setup_extension(app)
+    memprofile.setup_extension(app)
+    metrics.setup_extension(app)
+    multiversion.setup_extension(app)
+    navigation.setup_extension(app)
+    pagewriter.setup_extension(app)
+    react.setup_extension(app)
+    schedule.setup_extension(app)
+    sourcehash.setup_extension(app)
+    srclinks.setup_extension(app)
+    stdlib.setup_extension(app)
+
     app.add_transform(ProhibitedNodeTransform)
+
+    # After the "builder-inited" handlers of the modules.
+    app.connect('builder-inited', emit_build_started)
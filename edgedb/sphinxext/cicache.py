@@ -0,0 +1,262 @@
+"""
+======================
+CI build cache archive
+======================
+
+Export the doctree directory of a build (the pickled environment, the
+doctrees and the extension caches stored next to them) and, optionally,
+its output directory into a single archive, and restore them on a later
+CI run:
+
+    $ python -m edgedb.sphinxext.cicache import \\
+        --cache-dir ~/.cache/edgedb-docs -d _build/doctrees \\
+        -o _build/html doc
+    $ make html
+    $ python -m edgedb.sphinxext.cicache export \\
+        --cache-dir ~/.cache/edgedb-docs -d _build/doctrees \\
+        -o _build/html doc
+
+The output directory holds the state of the page writer
+(".edgedb-pages.json") and of the compress stage (".edgedb-compress.json");
+the state is only valid together with the pages and compressed files it
+describes, so the whole directory is archived.  With it restored, a CI
+build rewrites and recompresses only the pages that changed, and
+"changed-files.json" lists just those.  The EdgeQL snippet checks
+(tests/test_sourcecode.py) keep their compiled schemas in memory only,
+so there is nothing of theirs to archive.
+
+Archives are named "<tools key>-<tree key>.tar.gz".  The tools key is a
+hash of the extension code and of the EdgeQL parser; the tree key is a
+hash of the documentation source tree.  Import prefers an archive with
+both keys matching and otherwise takes the newest archive with the same
+tools key: a fresh checkout resets mtimes, so with
+"edgedb_hash_sources = True" only the documents whose content differs
+from the cached build are read again.
+
+Every archive carries a manifest with the hash of each member, and an
+archive that fails verification is ignored.  The doctrees are stored
+under "doctrees/" and the output under "outdir/" in the archive.
+"""
+
+
+import argparse
+import glob
+import io
+import json
+import os
+import os.path
+import shutil
+import sys
+import tarfile
+import tempfile
+
+from . import fingerprint
+
+
+MANIFEST_NAME = 'MANIFEST.json'
+ARCHIVE_SUFFIX = '.tar.gz'
+
+DOCTREES_PREFIX = 'doctrees'
+OUTDIR_PREFIX = 'outdir'
+
+
+class CacheVerificationError(Exception):
+    pass
+
+
+def tools_key():
+    return fingerprint.hash_bytes(
+        f'{fingerprint.extension_fingerprint()}\0'
+        f'{fingerprint.parser_fingerprint()}'.encode())[:16]
+
+
+def tree_key(srcdir):
+    return fingerprint.tree_fingerprint(srcdir)[:16]
+
+
+def _iter_files(path, *, exclude=None):
+    for dirpath, dirnames, filenames in os.walk(path):
+        if exclude is not None:
+            # The doctree directory can be inside the output directory
+            # (the sphinx-build default); it is archived on its own.
+            dirnames[:] = [
+                d for d in dirnames
+                if os.path.abspath(os.path.join(dirpath, d)) != exclude]
+        dirnames.sort()
+        for fn in sorted(filenames):
+            filename = os.path.join(dirpath, fn)
+            yield os.path.relpath(filename, path).replace(os.sep, '/')
+
+
+def _archived_dirs(doctreedir, outdir):
+    dirs = [(DOCTREES_PREFIX, doctreedir)]
+    if outdir is not None:
+        dirs.append((OUTDIR_PREFIX, outdir))
+    return dirs
+
+
+def export_cache(cache_dir, doctreedir, srcdir, *, outdir=None, keep=3):
+    """Archive *doctreedir* and *outdir* into *cache_dir*.
+
+    Return the archive path.
+    """
+    tkey = tools_key()
+    key = f'{tkey}-{tree_key(srcdir)}'
+
+    paths = {}  # archive name -> filename
+    for prefix, path in _archived_dirs(doctreedir, outdir):
+        for relname in _iter_files(
+                path, exclude=os.path.abspath(doctreedir)):
+            paths[f'{prefix}/{relname}'] = os.path.join(path, relname)
+
+    files = {
+        name: fingerprint.hash_file(filename)
+        for name, filename in paths.items()
+    }
+    manifest = json.dumps({'key': key, 'files': files}).encode()
+
+    os.makedirs(cache_dir, exist_ok=True)
+    archive = os.path.join(cache_dir, f'{key}{ARCHIVE_SUFFIX}')
+    fd, tmp = tempfile.mkstemp(dir=cache_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f, \
+                tarfile.open(fileobj=f, mode='w:gz') as tar:
+            info = tarfile.TarInfo(MANIFEST_NAME)
+            info.size = len(manifest)
+            tar.addfile(info, io.BytesIO(manifest))
+            for name, filename in paths.items():
+                tar.add(filename, arcname=name)
+        os.replace(tmp, archive)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+    # Keep only the newest archives made with the current tools.
+    archives = sorted(
+        glob.glob(os.path.join(cache_dir, f'*{ARCHIVE_SUFFIX}')),
+        key=os.path.getmtime, reverse=True)
+    kept = 0
+    for fn in archives:
+        if os.path.basename(fn).startswith(f'{tkey}-') and kept < keep:
+            kept += 1
+            continue
+        os.unlink(fn)
+
+    return archive
+
+
+def find_archive(cache_dir, srcdir):
+    tkey = tools_key()
+    exact = os.path.join(cache_dir, f'{tkey}-{tree_key(srcdir)}'
+                                    f'{ARCHIVE_SUFFIX}')
+    if os.path.exists(exact):
+        return exact
+
+    candidates = glob.glob(
+        os.path.join(cache_dir, f'{tkey}-*{ARCHIVE_SUFFIX}'))
+    if candidates:
+        return max(candidates, key=os.path.getmtime)
+
+    return None
+
+
+def _extract_verified(archive, destdir):
+    with tarfile.open(archive, mode='r:gz') as tar:
+        try:
+            manifest = json.load(tar.extractfile(MANIFEST_NAME))
+        except (KeyError, ValueError) as ex:
+            raise CacheVerificationError(
+                f'{archive}: missing or invalid manifest') from ex
+
+        files = manifest['files']
+        for member in tar.getmembers():
+            if member.name == MANIFEST_NAME:
+                continue
+            if (member.name not in files or not member.isfile() or
+                    os.path.isabs(member.name) or
+                    '..' in member.name.split('/')):
+                raise CacheVerificationError(
+                    f'{archive}: unexpected member {member.name!r}')
+
+            target = os.path.join(destdir, *member.name.split('/'))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with tar.extractfile(member) as src, open(target, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+
+    for relname, digest in files.items():
+        filename = os.path.join(destdir, *relname.split('/'))
+        if (not os.path.exists(filename) or
+                fingerprint.hash_file(filename) != digest):
+            raise CacheVerificationError(
+                f'{archive}: checksum mismatch for {relname!r}')
+
+
+def import_cache(cache_dir, doctreedir, srcdir, *, outdir=None):
+    """Restore *doctreedir* and *outdir* from *cache_dir*.
+
+    Return the archive used.
+    """
+    archive = find_archive(cache_dir, srcdir)
+    if archive is None:
+        return None
+
+    # The output directory is restored first, as it can contain the
+    # doctree directory.
+    dirs = _archived_dirs(doctreedir, outdir)[::-1]
+    parent = os.path.dirname(os.path.commonpath(
+        [os.path.abspath(path) for _, path in dirs]))
+    os.makedirs(parent, exist_ok=True)
+    tmpdir = tempfile.mkdtemp(dir=parent)
+    try:
+        _extract_verified(archive, tmpdir)
+        for prefix, path in dirs:
+            extracted = os.path.join(tmpdir, prefix)
+            if not os.path.isdir(extracted):
+                continue
+            if os.path.exists(path):
+                shutil.rmtree(path)
+            os.makedirs(os.path.dirname(os.path.abspath(path)),
+                        exist_ok=True)
+            os.rename(extracted, path)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    return archive
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m edgedb.sphinxext.cicache',
+        description='Export or import a docs build cache archive.')
+    parser.add_argument('command', choices=['export', 'import'])
+    parser.add_argument('srcdir')
+    parser.add_argument('--cache-dir', required=True)
+    parser.add_argument('-d', '--doctreedir', required=True)
+    parser.add_argument('-o', '--outdir')
+    parser.add_argument('--keep', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    if args.command == 'export':
+        archive = export_cache(
+            args.cache_dir, args.doctreedir, args.srcdir,
+            outdir=args.outdir, keep=args.keep)
+        print(f'exported {archive}')
+        return 0
+
+    try:
+        archive = import_cache(
+            args.cache_dir, args.doctreedir, args.srcdir,
+            outdir=args.outdir)
+    except (CacheVerificationError, tarfile.TarError) as ex:
+        print(f'ignoring the build cache: {ex}')
+        return 0
+
+    if archive is None:
+        print('no build cache found')
+    else:
+        print(f'imported {archive}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,281 @@
+"""
+=======================================
+Pre-compressed and fingerprinted output
+=======================================
+
+A post-build stage for HTML builds, enabled with the
+"edgedb_precompress" and "edgedb_fingerprint_static" config values,
+or run separately on an existing output directory:
+
+    $ python -m edgedb.sphinxext.compress [--fingerprint] _build/html
+
+* Static assets in "_static/" are copied to fingerprinted names
+  ("basic.css" -> "basic.1f2e3d4c5b.css") suitable for immutable
+  caching, and references to them in HTML pages are rewritten.
+  Fingerprinted copies of previous versions of an asset, or of
+  deleted assets, are removed.
+
+* Text files whose content hash has changed since the previous run
+  are compressed by a pool of worker processes into ".gz" and, if the
+  "brotli" package is installed, ".br" siblings.  Unchanged files are
+  not touched.
+
+* The content hashes are kept in ".edgedb-compress.json".  The files
+  added or changed by the build and the files removed since the
+  previous run, including their compressed siblings, are listed in
+  "changed-files.json" ({"changed": [...], "removed": [...]}) so that
+  a deploy can upload and delete only the delta.  The compressed
+  siblings of removed files are deleted.
+
+The stage runs after every other "build-finished" handler, so that the
+files they write (eql.inv, react-manifest.json, metrics, the memory
+profile) are compressed and listed too.  It also runs after the page
+writer (pagewriter.py) has recorded the hashes of the pages as they
+were rendered: rewritten references do not make an unchanged page look
+changed to the next build, and pages are rewritten again only when a
+static asset changes.
+"""
+
+
+import argparse
+import gzip
+import json
+import os
+import os.path
+import re
+import sys
+
+from concurrent import futures
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from . import fingerprint
+
+
+STATE_FILENAME = '.edgedb-compress.json'
+CHANGES_FILENAME = 'changed-files.json'
+
+COMPRESSIBLE = {
+    '.html', '.css', '.js', '.json', '.svg', '.txt', '.xml', '.map',
+}
+
+COMPRESSED_SUFFIXES = ('.gz', '.br')
+
+_FINGERPRINT_LEN = 10
+
+_fingerprinted_re = re.compile(
+    rf'^(?P<base>.+)\.[0-9a-f]{{{_FINGERPRINT_LEN}}}(?P<ext>\.[^./]+)$')
+
+_static_ref_re = re.compile(
+    r'''(?P<attr>(?:href|src)=")(?P<prefix>[^"]*?)'''
+    r'''(?P<path>_static/[^"?#]+)''')
+
+
+def _strip_fingerprint(relpath):
+    m = _fingerprinted_re.match(relpath)
+    if m:
+        return m.group('base') + m.group('ext')
+    return relpath
+
+
+def _iter_files(outdir):
+    for dirpath, dirnames, filenames in os.walk(outdir):
+        # Skip hidden directories, such as the default ".doctrees".
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+        for fn in sorted(filenames):
+            if fn.endswith(COMPRESSED_SUFFIXES) or fn.startswith('.'):
+                continue
+            path = os.path.join(dirpath, fn)
+            yield os.path.relpath(path, outdir).replace(os.sep, '/')
+
+
+def fingerprint_static(outdir, known=()):
+    """Copy static assets to fingerprinted names.
+
+    Fingerprinted copies that are not current are removed if they
+    are copies of a current asset or of an asset in *known* (the
+    files of the previous run).  Return a mapping of asset path ->
+    fingerprinted asset path.
+    """
+    mapping = {}
+    staticdir = os.path.join(outdir, '_static')
+    if not os.path.isdir(staticdir):
+        return mapping
+
+    copies = []
+    for relpath in _iter_files(outdir):
+        if not relpath.startswith('_static/'):
+            continue
+        if _strip_fingerprint(relpath) != relpath:
+            copies.append(relpath)
+            continue
+
+        digest = fingerprint.hash_file(os.path.join(outdir, relpath))
+        base, ext = os.path.splitext(relpath)
+        fp_relpath = f'{base}.{digest[:_FINGERPRINT_LEN]}{ext}'
+
+        fp_path = os.path.join(outdir, fp_relpath)
+        if not os.path.exists(fp_path):
+            with open(os.path.join(outdir, relpath), 'rb') as src, \
+                    open(fp_path, 'wb') as dst:
+                dst.write(src.read())
+
+        mapping[relpath] = fp_relpath
+
+    current = set(mapping.values())
+    for relpath in copies:
+        asset = _strip_fingerprint(relpath)
+        if relpath not in current and (asset in mapping or asset in known):
+            os.unlink(os.path.join(outdir, relpath))
+
+    return mapping
+
+
+def rewrite_static_refs(filename, mapping):
+    with open(filename, 'rt', encoding='utf-8') as f:
+        content = f.read()
+
+    def repl(m):
+        path = _strip_fingerprint(m.group('path'))
+        fp_path = mapping.get(path)
+        if fp_path is None:
+            return m.group(0)
+        return f'{m.group("attr")}{m.group("prefix")}{fp_path}'
+
+    new_content = _static_ref_re.sub(repl, content)
+    if new_content != content:
+        with open(filename, 'wt', encoding='utf-8') as f:
+            f.write(new_content)
+
+
+def compress_file(filename):
+    with open(filename, 'rb') as f:
+        data = f.read()
+
+    written = []
+
+    with open(f'{filename}.gz', 'wb') as f:
+        # mtime=0 makes the output depend on the content only.
+        with gzip.GzipFile(fileobj=f, mode='wb', compresslevel=9,
+                           mtime=0) as gz:
+            gz.write(data)
+    written.append(f'{filename}.gz')
+
+    if brotli is not None:
+        with open(f'{filename}.br', 'wb') as f:
+            f.write(brotli.compress(data))
+        written.append(f'{filename}.br')
+
+    return written
+
+
+def process_output(outdir, *, compress=True, fingerprint_assets=False,
+                   jobs=None):
+    """Run the post-build stage.
+
+    Return the lists of changed and of removed files.
+    """
+    state_file = os.path.join(outdir, STATE_FILENAME)
+    try:
+        with open(state_file, 'rt') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {}
+
+    if fingerprint_assets:
+        mapping = fingerprint_static(outdir, known=state)
+        for relpath in _iter_files(outdir):
+            if relpath.endswith('.html'):
+                rewrite_static_refs(os.path.join(outdir, relpath), mapping)
+
+    hashes = {}
+    changed = []
+    to_compress = []
+    for relpath in _iter_files(outdir):
+        if relpath == CHANGES_FILENAME:
+            continue
+
+        path = os.path.join(outdir, relpath)
+        digest = hashes[relpath] = fingerprint.hash_file(path)
+        if state.get(relpath) == digest:
+            continue
+
+        changed.append(relpath)
+        if compress and os.path.splitext(relpath)[1] in COMPRESSIBLE:
+            to_compress.append(path)
+
+    if to_compress:
+        with futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+            for written in pool.map(compress_file, to_compress,
+                                    chunksize=16):
+                changed.extend(
+                    os.path.relpath(fn, outdir).replace(os.sep, '/')
+                    for fn in written)
+
+    removed = []
+    for relpath in sorted(state.keys() - hashes.keys()):
+        removed.append(relpath)
+        for suffix in COMPRESSED_SUFFIXES:
+            sibling = os.path.join(outdir, f'{relpath}{suffix}')
+            if os.path.exists(sibling):
+                os.unlink(sibling)
+                removed.append(f'{relpath}{suffix}')
+
+    with open(state_file, 'wt') as f:
+        json.dump(hashes, f, indent=0, sort_keys=True)
+
+    with open(os.path.join(outdir, CHANGES_FILENAME), 'wt') as f:
+        json.dump({'changed': sorted(changed), 'removed': removed}, f,
+                  indent=2)
+
+    return changed, removed
+
+
+def process_build_output(app, exception):
+    if exception is not None or app.builder.format != 'html':
+        return
+
+    compress = app.config.edgedb_precompress
+    fingerprint_assets = app.config.edgedb_fingerprint_static
+    if compress or fingerprint_assets:
+        process_output(
+            app.outdir, compress=compress,
+            fingerprint_assets=fingerprint_assets,
+            jobs=app.parallel or None)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m edgedb.sphinxext.compress',
+        description='Compress and fingerprint HTML build output.')
+    parser.add_argument('outdir')
+    parser.add_argument('--fingerprint', action='store_true')
+    parser.add_argument('--no-compress', action='store_true')
+    parser.add_argument('-j', '--jobs', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    changed, removed = process_output(
+        args.outdir, compress=not args.no_compress,
+        fingerprint_assets=args.fingerprint, jobs=args.jobs)
+    print(f'{len(changed)} files changed, {len(removed)} removed')
+    return 0
+
+
+def connect_output_stage(app):
+    # Sphinx runs the handlers of an event in the order they were
+    # connected; handlers connected in setup() all come before this one.
+    app.connect('build-finished', process_build_output)
+
+
+def setup_extension(app):
+    app.add_config_value('edgedb_precompress', False, '')
+    app.add_config_value('edgedb_fingerprint_static', False, '')
+
+    app.connect('builder-inited', connect_output_stage)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
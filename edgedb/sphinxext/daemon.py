@@ -0,0 +1,441 @@
+"""
+============
+Build daemon
+============
+
+A long-running process that keeps Sphinx, docutils, the EdgeQL parser
+and the loaded build environments in memory, and builds on request:
+
+    $ python -m edgedb.sphinxext.daemon serve
+    $ python -m edgedb.sphinxext.daemon build -b html -W -n doc _build/html
+    $ python -m edgedb.sphinxext.daemon check -W -n doc
+    $ python -m edgedb.sphinxext.daemon render doc doc/edgeql/index.rst
+
+"build", "check" and "render" are clients; with "--start" they start the
+daemon in the background if it is not running yet.  "check" reads and
+resolves all documents without writing anything (the dummy builder),
+"render" builds only the given source files (the other outdated
+documents are still read).  "stop" shuts the daemon down.
+
+Clients and the daemon talk over a Unix socket (by default
+"_build/.daemon.sock"), one JSON message per line.  The client sends a
+request; the daemon answers with any number of {"output": ...} messages
+followed by {"status": ..., "elapsed": ...}.  Requests are served one at
+a time.
+
+A Sphinx application is kept for each combination of source directory,
+builder, output and doctree directories and options, so that a
+repeated build only reads the changed documents and writes the
+affected pages.  Before every further build of an application, the
+daemon emits the "edgedb-build-started" event, which resets the
+per-build state of the extension (page writer, metrics, memory
+profile, repository links) set up at "builder-inited", and restores
+the directives, roles and nodes the application registered with
+docutils, which keeps them globally.  An application
+is recreated when its conf.py, a file in its templates or theme paths
+or the module of one of its extensions changes, and dropped after a
+failed build.  The daemon exits when the code of this extension
+changes; clients started with "--start" then start a new one.
+"""
+
+
+import argparse
+import collections
+import io
+import json
+import os
+import os.path
+import socket
+import socketserver
+import subprocess
+import sys
+import time
+import traceback
+
+from . import fingerprint
+from . import shared
+
+
+DEFAULT_SOCKET = os.path.join('_build', '.daemon.sock')
+MAX_APPS = 4
+START_TIMEOUT = 30
+
+
+class DaemonError(Exception):
+    pass
+
+
+class _Relay(io.TextIOBase):
+    """Status and warning stream of the applications.
+
+    Sphinx binds the streams when an application is created; the relay
+    forwards them to the client of the current request.
+    """
+
+    def __init__(self):
+        self.send = None
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        if self.send is not None and text:
+            self.send({'output': text})
+        return len(text)
+
+
+def _app_stamp(app):
+    """Return the mtimes of the files *app* was set up from."""
+    config = app.config
+    filenames = [os.path.join(app.confdir, 'conf.py')]
+    for dirname in [*config.templates_path,
+                    *getattr(config, 'html_theme_path', ())]:
+        for dirpath, _, names in os.walk(os.path.join(app.confdir, dirname)):
+            filenames.extend(os.path.join(dirpath, name) for name in names)
+    for extension in app.extensions.values():
+        filename = getattr(extension.module, '__file__', None)
+        if filename:
+            filenames.append(filename)
+
+    stamp = []
+    for filename in sorted(set(filenames)):
+        try:
+            stamp.append((filename, os.stat(filename).st_mtime))
+        except OSError:
+            stamp.append((filename, None))
+    return tuple(stamp)
+
+
+def _get_docutils_state():
+    from docutils.parsers.rst import directives as d_directives
+    from docutils.parsers.rst import roles as d_roles
+    from sphinx.util import docutils as s_docutils
+
+    return (
+        dict(d_directives._directives),
+        dict(d_roles._roles),
+        set(s_docutils.additional_nodes),
+    )
+
+
+def _set_docutils_state(state):
+    """Restore the docutils registrations of an application."""
+    from docutils.parsers.rst import directives as d_directives
+    from docutils.parsers.rst import roles as d_roles
+    from sphinx.util import docutils as s_docutils
+
+    directives, roles, nodes = state
+    d_directives._directives = dict(directives)
+    d_roles._roles = dict(roles)
+    for node in s_docutils.additional_nodes - nodes:
+        s_docutils.unregister_node(node)
+    for node in nodes - s_docutils.additional_nodes:
+        s_docutils.register_node(node)
+    s_docutils.additional_nodes.intersection_update(nodes)
+
+
+class BuildServer(socketserver.UnixStreamServer):
+
+    def __init__(self, path):
+        self.apps = collections.OrderedDict()
+        self.relay = _Relay()
+        self.extension_hash = fingerprint.extension_fingerprint()
+        self.docutils_state = _get_docutils_state()
+        self.stopping = False
+        super().__init__(path, BuildRequestHandler)
+
+    def warm_up(self):
+        # Importing the extension imports Sphinx, docutils, lxml and
+        # the EdgeDB compiler stack; building a parser loads (or
+        # generates) the parser tables.
+        from sphinx import application  # NoQA
+        from . import eql
+        eql.edgeql_parser.EdgeQLBlockParser()
+
+    def get_app(self, request):
+        """Return (app, created) for *request*."""
+        from sphinx import application as s_application
+
+        srcdir = request['srcdir']
+        confdir = request.get('confdir') or srcdir
+        confoverrides = dict(request.get('define') or {})
+        if request.get('nitpicky'):
+            confoverrides['nitpicky'] = True
+
+        key = (
+            srcdir, confdir, request['outdir'], request['doctreedir'],
+            request['builder'], bool(request.get('warningiserror')),
+            request.get('jobs', 1),
+            tuple(sorted(confoverrides.items())),
+        )
+        entry = self.apps.pop(key, None)
+        if entry is not None and entry[0] == _app_stamp(entry[1]):
+            self.apps[key] = entry
+            _set_docutils_state(entry[2])
+            return entry[1], False
+
+        # Directives, roles and nodes registered with docutils by
+        # another application make the new one warn, which fails -W
+        # builds.
+        _set_docutils_state(self.docutils_state)
+        app = s_application.Sphinx(
+            srcdir, confdir, request['outdir'], request['doctreedir'],
+            request['builder'], confoverrides=confoverrides,
+            status=self.relay, warning=self.relay,
+            warningiserror=bool(request.get('warningiserror')),
+            parallel=request.get('jobs', 1))
+
+        self.apps[key] = (_app_stamp(app), app, _get_docutils_state())
+        while len(self.apps) > MAX_APPS:
+            self.apps.popitem(last=False)
+        return app, True
+
+    def drop_app(self, app):
+        for key, (_, cached, _) in list(self.apps.items()):
+            if cached is app:
+                del self.apps[key]
+
+    def build(self, request):
+        app, created = self.get_app(request)
+        if not created:
+            # A new application has just emitted it after
+            # "builder-inited".
+            app.emit(shared.BUILD_STARTED_EVENT)
+
+        filenames = request.get('filenames') or None
+        try:
+            app.build(force_all=bool(request.get('force')),
+                      filenames=filenames)
+        except BaseException:
+            self.drop_app(app)
+            raise
+
+        response = {'status': app.statuscode}
+        if filenames:
+            outfiles = []
+            for filename in filenames:
+                docname = app.env.path2doc(filename)
+                if docname is not None:
+                    outfiles.append(os.path.join(
+                        app.outdir, app.builder.get_target_uri(docname)))
+            response['outfiles'] = outfiles
+        return response
+
+
+class BuildRequestHandler(socketserver.StreamRequestHandler):
+
+    def send(self, message):
+        self.wfile.write(json.dumps(message).encode() + b'\n')
+        self.wfile.flush()
+
+    def handle(self):
+        server = self.server
+        request = json.loads(self.rfile.readline().decode())
+        started = time.monotonic()
+
+        command = request.get('command')
+        if command == 'stop':
+            server.stopping = True
+            self.send({'status': 0, 'elapsed': 0})
+            return
+
+        if (fingerprint.current_extension_fingerprint() !=
+                server.extension_hash):
+            server.stopping = True
+            self.send({'status': None, 'restart': True})
+            return
+
+        server.relay.send = self.send
+        try:
+            response = server.build(request)
+        except Exception as ex:
+            self.send({'output': ''.join(traceback.format_exception(
+                type(ex), ex, ex.__traceback__))})
+            response = {'status': 2}
+        finally:
+            server.relay.send = None
+
+        response['elapsed'] = time.monotonic() - started
+        self.send(response)
+
+
+def serve(path):
+    if os.path.exists(path):
+        try:
+            _connect(path).close()
+        except OSError:
+            os.unlink(path)
+        else:
+            raise DaemonError(f'a daemon is already listening on {path}')
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    server = BuildServer(path)
+    try:
+        server.warm_up()
+        while not server.stopping:
+            server.handle_request()
+    finally:
+        server.server_close()
+        os.unlink(path)
+
+
+def _connect(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def _start_daemon(path):
+    subprocess.Popen(
+        [sys.executable, '-m', __spec__.name, '--socket', path, 'serve'],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL, start_new_session=True)
+
+    deadline = time.monotonic() + START_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            return _connect(path)
+        except OSError:
+            time.sleep(0.05)
+    raise DaemonError(f'the daemon did not start listening on {path}')
+
+
+def request(path, message, *, start=False):
+    """Send *message* to the daemon, print its output, return the status."""
+    for attempt in range(2):
+        try:
+            sock = _connect(path)
+        except OSError:
+            if not start:
+                raise DaemonError(
+                    f'no daemon is listening on {path} (use --start)')
+            sock = _start_daemon(path)
+
+        with sock, sock.makefile('rwb') as f:
+            f.write(json.dumps(message).encode() + b'\n')
+            f.flush()
+
+            for line in f:
+                response = json.loads(line.decode())
+                if 'output' in response:
+                    sys.stdout.write(response['output'])
+                    sys.stdout.flush()
+                    continue
+                break
+            else:
+                raise DaemonError('the daemon closed the connection')
+
+        if not response.get('restart'):
+            return response
+        if not start:
+            raise DaemonError(
+                'the extension code changed and the daemon exited; '
+                'start it again')
+        # Wait for the old daemon to release the socket.
+        while os.path.exists(path):
+            time.sleep(0.05)
+
+    raise DaemonError('the daemon exited twice in a row')
+
+
+def _build_message(args, command):
+    srcdir = os.path.abspath(args.srcdir)
+    builder = 'dummy' if command == 'check' else args.builder
+    outdir = os.path.abspath(args.outdir)
+    # Like "make html": _build/html is built with _build/doctrees.
+    doctreedir = os.path.abspath(
+        args.doctreedir or
+        os.path.join(os.path.dirname(outdir), 'doctrees'))
+
+    define = {}
+    for item in args.define:
+        name, _, value = item.partition('=')
+        define[name] = value
+
+    return {
+        'command': command,
+        'srcdir': srcdir,
+        'outdir': outdir,
+        'doctreedir': doctreedir,
+        'builder': builder,
+        'define': define,
+        'warningiserror': args.warningiserror,
+        'nitpicky': args.nitpicky,
+        'jobs': args.jobs,
+        'force': getattr(args, 'force', False),
+        'filenames': [os.path.abspath(fn)
+                      for fn in getattr(args, 'filenames', [])],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m edgedb.sphinxext.daemon',
+        description='Build the documentation with a persistent daemon.')
+    parser.add_argument(
+        '--socket', default=DEFAULT_SOCKET,
+        help=f'path of the daemon socket (default: {DEFAULT_SOCKET})')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    commands.add_parser('serve', help='run the daemon')
+    commands.add_parser('stop', help='stop the daemon')
+
+    build_parser = commands.add_parser('build', help='build the docs')
+    check_parser = commands.add_parser(
+        'check', help='read and resolve the docs without writing')
+    render_parser = commands.add_parser(
+        'render', help='build the given source files only')
+
+    for sub in (build_parser, check_parser, render_parser):
+        sub.add_argument(
+            '--start', action='store_true',
+            help='start the daemon if it is not running')
+        sub.add_argument('-d', dest='doctreedir', default=None)
+        sub.add_argument('-D', dest='define', action='append', default=[])
+        sub.add_argument('-W', dest='warningiserror', action='store_true')
+        sub.add_argument('-n', dest='nitpicky', action='store_true')
+        sub.add_argument('-j', dest='jobs', type=int, default=1)
+        sub.add_argument('srcdir')
+
+    for sub in (build_parser, render_parser):
+        sub.add_argument('-b', dest='builder', default='html')
+    build_parser.add_argument('-a', dest='force', action='store_true')
+    build_parser.add_argument('outdir')
+    check_parser.add_argument(
+        '-o', dest='outdir', default=os.path.join('_build', 'dummy'))
+    render_parser.add_argument(
+        '-o', dest='outdir', default=os.path.join('_build', 'html'))
+    render_parser.add_argument('filenames', nargs='+')
+
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'serve':
+            serve(args.socket)
+            return 0
+
+        if args.command == 'stop':
+            request(args.socket, {'command': 'stop'})
+            return 0
+
+        response = request(
+            args.socket, _build_message(args, args.command),
+            start=args.start)
+    except DaemonError as ex:
+        print(f'error: {ex}', file=sys.stderr)
+        return 2
+
+    for outfile in response.get('outfiles', []):
+        print(outfile)
+    print(f'{args.command}: finished in {response["elapsed"]:.2f}s',
+          file=sys.stderr)
+    return response['status']
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,311 @@
+"""
+=========================
+Binary doctree side files
+=========================
+
+With "edgedb_binary_doctrees = True" every document read is also
+stored in a compact binary file, "eql-doctrees/<docname>.edt" in the
+doctree directory, next to the pickle Sphinx itself uses.  The file is
+designed to be memory-mapped: tools that only need the eql metadata
+of a document (signatures, summaries, statements, section titles) read
+a small side table and the strings it refers to, without unpickling or
+even decoding the document tree.
+
+    $ python -m edgedb.sphinxext.doctreestore _build/doctrees
+
+prints the metadata of all documents as JSON lines.
+
+File layout (all integers are little-endian u32):
+
+    header   magic "EDT1", string count, node count, metadata count,
+             and the offsets of the three tables below
+    strings  (count + 1) offsets into a UTF-8 blob, followed by the blob;
+             every distinct string is stored once
+    nodes    the document tree in preorder, one record per node:
+             class name, number of children, subtree size, attributes
+             (as JSON) and text; the subtree size allows to skip to or
+             decode any subtree without walking the nodes before it
+    meta     one record per eql object or section: kind, name, title or
+             signature, summary and the index of its node
+
+Strings that are absent are stored as 0xFFFFFFFF.  Sphinx keeps using
+its own pickles for resolving and writing; decoded trees are meant for
+tools and carry node attributes (tuples become lists) but not the
+document-level state.
+"""
+
+
+import collections
+import importlib
+import json
+import mmap
+import os
+import os.path
+import struct
+import sys
+
+from docutils import nodes as d_nodes
+from sphinx import addnodes as s_nodes
+
+
+MAGIC = b'EDT1'
+DIRNAME = 'eql-doctrees'
+SUFFIX = '.edt'
+NONE = 0xFFFFFFFF
+
+_header = struct.Struct('<4s6I')
+_u32 = struct.Struct('<I')
+_node = struct.Struct('<5I')
+_meta = struct.Struct('<5I')
+
+
+MetaRecord = collections.namedtuple(
+    'MetaRecord', ['kind', 'name', 'title', 'summary', 'node'])
+
+
+class DoctreeFormatError(Exception):
+    pass
+
+
+class _StringTable:
+
+    def __init__(self):
+        self.index = {}
+        self.strings = []
+
+    def add(self, s):
+        if s is None:
+            return NONE
+        idx = self.index.get(s)
+        if idx is None:
+            idx = self.index[s] = len(self.strings)
+            self.strings.append(s)
+        return idx
+
+    def pack(self):
+        blobs = [s.encode('utf-8') for s in self.strings]
+        offsets = [0]
+        for blob in blobs:
+            offsets.append(offsets[-1] + len(blob))
+        return (struct.pack(f'<{len(offsets)}I', *offsets) +
+                b''.join(blobs))
+
+
+def _class_name(node):
+    cls = type(node)
+    return f'{cls.__module__}.{cls.__qualname__}'
+
+
+def _attributes(node):
+    # Every element is created with empty list attributes; other
+    # empty lists (e.g. index entries) are kept.
+    attrs = {k: v for k, v in node.attributes.items()
+             if not (v == [] and k in d_nodes.Element.list_attributes)}
+    if not attrs:
+        return None
+    return json.dumps(attrs, sort_keys=True, default=str)
+
+
+def extract_metadata(doctree):
+    """Yield (kind, name, title, summary, node) for *doctree*."""
+    for node in doctree.traverse():
+        if isinstance(node, d_nodes.section):
+            kind = ('statement' if node.get('eql-statement') == 'true'
+                    else 'section')
+            title = node[0].astext() if node.children else ''
+            yield (kind, node['ids'][0] if node['ids'] else None,
+                   title, node.get('summary'), node)
+
+        elif (isinstance(node, s_nodes.desc_signature) and
+                node.get('eql-fullname')):
+            desc = node.parent
+            yield (desc.get('objtype'), node['eql-fullname'],
+                   node.get('eql-signature') or node['eql-fullname'],
+                   desc.get('summary'), node)
+
+
+def encode_doctree(doctree):
+    strings = _StringTable()
+    records = []
+    positions = {}
+
+    def encode(node):
+        pos = len(records)
+        positions[id(node)] = pos
+        records.append(None)
+
+        if isinstance(node, d_nodes.Text):
+            records[pos] = (strings.add('#text'), 0, 1, NONE,
+                            strings.add(str(node)))
+            return 1
+
+        size = 1
+        for child in node.children:
+            size += encode(child)
+        records[pos] = (strings.add(_class_name(node)), len(node.children),
+                        size, strings.add(_attributes(node)), NONE)
+        return size
+
+    encode(doctree)
+
+    meta = [
+        (strings.add(kind), strings.add(name), strings.add(title),
+         strings.add(summary), positions[id(node)])
+        for kind, name, title, summary, node in extract_metadata(doctree)
+    ]
+
+    string_data = strings.pack()
+    nodes_data = b''.join(_node.pack(*rec) for rec in records)
+    meta_data = b''.join(_meta.pack(*rec) for rec in meta)
+
+    strings_offset = _header.size
+    nodes_offset = strings_offset + len(string_data)
+    meta_offset = nodes_offset + len(nodes_data)
+
+    header = _header.pack(
+        MAGIC, len(strings.strings), len(records), len(meta),
+        strings_offset, nodes_offset, meta_offset)
+    return header + string_data + nodes_data + meta_data
+
+
+class DoctreeFile:
+    """A memory-mapped binary doctree file."""
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, self._n_strings, self._n_nodes, self._n_meta,
+         self._strings_offset, self._nodes_offset,
+         self._meta_offset) = _header.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise DoctreeFormatError(f'{filename}: not a binary doctree')
+
+        self._blob_offset = (
+            self._strings_offset + _u32.size * (self._n_strings + 1))
+
+    def close(self):
+        self._mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def string(self, idx):
+        if idx == NONE:
+            return None
+        start, end = struct.unpack_from(
+            '<2I', self._mm, self._strings_offset + _u32.size * idx)
+        return self._mm[
+            self._blob_offset + start:self._blob_offset + end].decode()
+
+    def metadata(self):
+        for i in range(self._n_meta):
+            kind, name, title, summary, node = _meta.unpack_from(
+                self._mm, self._meta_offset + _meta.size * i)
+            yield MetaRecord(
+                self.string(kind), self.string(name), self.string(title),
+                self.string(summary), node)
+
+    def _record(self, idx):
+        return _node.unpack_from(
+            self._mm, self._nodes_offset + _node.size * idx)
+
+    def load(self, node=0):
+        """Decode the subtree starting at node index *node*."""
+        classes = {}
+
+        def decode(idx):
+            cls_idx, n_children, size, attrs, text = self._record(idx)
+            cls_name = self.string(cls_idx)
+            if cls_name == '#text':
+                return d_nodes.Text(self.string(text)), idx + 1
+
+            cls = classes.get(cls_name)
+            if cls is None:
+                modname, _, qualname = cls_name.rpartition('.')
+                cls = classes[cls_name] = getattr(
+                    importlib.import_module(modname), qualname)
+
+            if cls is d_nodes.document:
+                result = d_nodes.document(None, None)
+            else:
+                result = cls()
+            if attrs != NONE:
+                result.attributes.update(json.loads(self.string(attrs)))
+
+            idx += 1
+            for _ in range(n_children):
+                child, idx = decode(idx)
+                result += child
+            return result, idx
+
+        return decode(node)[0]
+
+
+def doctree_filename(doctreedir, docname):
+    return os.path.join(doctreedir, DIRNAME, *f'{docname}{SUFFIX}'.split('/'))
+
+
+def iter_metadata(doctreedir):
+    """Yield (docname, MetaRecord) for all documents in *doctreedir*."""
+    root = os.path.join(doctreedir, DIRNAME)
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for fn in sorted(filenames):
+            if not fn.endswith(SUFFIX):
+                continue
+            filename = os.path.join(dirpath, fn)
+            docname = os.path.relpath(filename, root)[:-len(SUFFIX)]
+            docname = docname.replace(os.sep, '/')
+            with DoctreeFile(filename) as f:
+                for record in f.metadata():
+                    yield docname, record
+
+
+def store_doctree(app, doctree):
+    if not app.config.edgedb_binary_doctrees:
+        return
+
+    filename = doctree_filename(app.doctreedir, app.env.docname)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    tmp = f'{filename}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(encode_doctree(doctree))
+    os.replace(tmp, filename)
+
+
+def remove_doctree(app, env, docname):
+    if not app.config.edgedb_binary_doctrees:
+        return
+
+    try:
+        os.unlink(doctree_filename(app.doctreedir, docname))
+    except FileNotFoundError:
+        pass
+
+
+def main(argv=None):
+    args = sys.argv[1:] if argv is None else argv
+    if len(args) != 1:
+        print('usage: python -m edgedb.sphinxext.doctreestore DOCTREEDIR',
+              file=sys.stderr)
+        return 2
+
+    for docname, record in iter_metadata(args[0]):
+        print(json.dumps({'docname': docname, **record._asdict()}))
+    return 0
+
+
+def setup_extension(app):
+    app.add_config_value('edgedb_binary_doctrees', False, '')
+
+    app.connect('doctree-read', store_doctree)
+    app.connect('env-purge-doc', remove_doctree)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
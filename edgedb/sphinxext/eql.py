@@ -179,7 +179,9 @@ To reference a keyword use a ":eql:kw:" role.  For instance:
 """
 
 
+import collections.abc
 import lxml.etree
+import pickle
 import re
 
 from edgedb.lang.edgeql.pygments import EdgeQLLexer
@@ -198,10 +200,13 @@ from sphinx import domains as s_domains
 from sphinx import roles as s_roles
 from sphinx import transforms as s_transforms
 from sphinx.directives import code as s_code
+from sphinx.transforms import post_transforms as s_post_transforms
 from sphinx.util import docfields as s_docfields
 from sphinx.util import nodes as s_nodes_utils
 
+from . import inventory
 from . import shared
+from . import suggest
 
 
 class EQLField(s_docfields.Field):
@@ -391,14 +396,18 @@ class BaseEQLDirective(s_directives.ObjectDescription):
                 'there must be a short text paragraph after directive fields')
 
         summary = self.strip_ws(first_node.astext())
-        if len(summary) > 79:
-            raise shared.DirectiveParseError(
-                self,
-                f'First paragraph is expected to be shorter than 80 '
-                f'characters, got {len(summary)}: {summary!r}')
+        error = self.summary_error(summary)
+        if error:
+            raise shared.DirectiveParseError(self, error)
 
         node['summary'] = summary
 
+    @staticmethod
+    def summary_error(summary):
+        if len(summary) > 79:
+            return (f'First paragraph is expected to be shorter than 80 '
+                    f'characters, got {len(summary)}: {summary!r}')
+
     def _find_field_desc(self, field_node: d_nodes.field):
         fieldname = field_node.children[0].astext()
 
@@ -419,6 +428,52 @@ class BaseEQLDirective(s_directives.ObjectDescription):
 
         return fieldtype, None, fieldarg
 
+    @classmethod
+    def find_source_field(cls, fieldname):
+        """Look up a field as written in the source, e.g. "paramtype $a".
+
+        Unlike _find_field_desc(), which sees the fields after Sphinx
+        has transformed them, this accepts all names and type names of
+        the directive's fields.
+        """
+        fieldtype, _, fieldarg = fieldname.strip().partition(' ')
+        fieldtype = fieldtype.lower()
+        fieldarg = fieldarg.strip() or None
+
+        for fielddesc in getattr(cls, 'doc_field_types', ()):
+            names = (*fielddesc.names,
+                     *getattr(fielddesc, 'typenames', ()))
+            if fieldtype in names:
+                return fieldtype, fielddesc, fieldarg
+
+        return fieldtype, None, fieldarg
+
+    @staticmethod
+    def field_error(fname, fdesc, farg):
+        msg = f'found unknown field {fname!r}'
+
+        if fdesc is None:
+            msg += (
+                f'\n\nPossible reason: field {fname!r} '
+                f'is not supported by the directive; '
+                f'is there a typo?\n\n'
+            )
+        else:
+            if farg and not fdesc.has_arg:
+                msg += (
+                    f'\n\nPossible reason: field {fname!r} '
+                    f'is specified with an argument {farg!r}, but '
+                    f'the directive expects it without one.\n\n'
+                )
+            elif not farg and fdesc.has_arg:
+                msg += (
+                    f'\n\nPossible reason: field {fname!r} '
+                    f'expects an argument but did not receive it;'
+                    f'check your ReST source.\n\n'
+                )
+
+        return msg
+
     def _validate_fields(self, node):
         desc_cnt = None
         for child in node.children:
@@ -448,29 +503,8 @@ class BaseEQLDirective(s_directives.ObjectDescription):
                 # in Sphinx, attempt to do it here.
 
                 fname, fdesc, farg = self._find_field_desc(field)
-                msg = f'found unknown field {fname!r}'
-
-                if fdesc is None:
-                    msg += (
-                        f'\n\nPossible reason: field {fname!r} '
-                        f'is not supported by the directive; '
-                        f'is there a typo?\n\n'
-                    )
-                else:
-                    if farg and not fdesc.has_arg:
-                        msg += (
-                            f'\n\nPossible reason: field {fname!r} '
-                            f'is specified with an argument {farg!r}, but '
-                            f'the directive expects it without one.\n\n'
-                        )
-                    elif not farg and fdesc.has_arg:
-                        msg += (
-                            f'\n\nPossible reason: field {fname!r} '
-                            f'expects an argument but did not receive it;'
-                            f'check your ReST source.\n\n'
-                        )
-
-                raise shared.DirectiveParseError(self, msg)
+                raise shared.DirectiveParseError(
+                    self, self.field_error(fname, fdesc, farg))
 
     def run(self):
         indexnode, node = super().run()
@@ -650,6 +684,78 @@ class EQLOperatorDirective(BaseEQLDirective):
             f'operator::{name}', sig, signode)
 
 
+FunctionSignature = collections.namedtuple(
+    'FunctionSignature',
+    ['module', 'name', 'signature', 'params', 'returns'])
+
+
+class FunctionSignatureError(shared.EdgeSphinxExtensionError):
+    pass
+
+
+# sig -> FunctionSignature; also populated by the stdlib generator
+# with signatures of functions it has already parsed.
+_function_signatures = {}
+
+
+def describe_function(astnode):
+    if (not isinstance(astnode, ql_ast.CreateFunction) or
+            not isinstance(astnode.name, ql_ast.ObjectRef)):
+        raise FunctionSignatureError(
+            f'EdgeQL parser returned unsupported AST')
+
+    modname = astnode.name.module
+    funcname = astnode.name.name
+    if not modname:
+        raise FunctionSignatureError(
+            f'EdgeQL function declaration is missing namespace')
+
+    func_repr = ql_gen.EdgeQLSourceGenerator.to_source(astnode)
+    m = re.match(r'''(?xs)
+        ^
+        CREATE\sFUNCTION\s
+        (?P<f>.*?)
+        \sFROM\s(?:SQL|EDGEQL)\b
+        .*$
+    ''', func_repr)
+    if not m or not m.group('f'):
+        raise FunctionSignatureError(
+            f'could not recreate function signature from AST')
+    func_repr = m.group('f')
+
+    params = []
+    for idx, param in enumerate(astnode.args):
+        name = param.name
+        if not name:
+            name = f'${idx}'
+        params.append(
+            (name, ql_gen.EdgeQLSourceGenerator.to_source(param)))
+
+    ret_repr = ql_gen.EdgeQLSourceGenerator.to_source(astnode.returning)
+    if astnode.set_returning is ql_ast.SetQualifier.SET_OF:
+        ret_repr = f'SET OF {ret_repr}'
+
+    return FunctionSignature(
+        modname, funcname, func_repr, tuple(params), ret_repr)
+
+
+def parse_function_signature(sig):
+    try:
+        fsig = _function_signatures[sig]
+    except KeyError:
+        shared.count_cache('function_signature', False)
+    else:
+        shared.count_cache('function_signature', True)
+        return fsig
+
+    parser = edgeql_parser.EdgeQLBlockParser()
+    astnode = parser.parse(
+        f'CREATE FUNCTION {sig} FROM SQL FUNCTION "xxx";')[0]
+
+    fsig = _function_signatures[sig] = describe_function(astnode)
+    return fsig
+
+
 class EQLFunctionDirective(BaseEQLDirective):
 
     doc_field_types = [
@@ -672,64 +778,32 @@ class EQLFunctionDirective(BaseEQLDirective):
     ]
 
     def handle_signature(self, sig, signode):
-        parser = edgeql_parser.EdgeQLBlockParser()
         try:
-            astnode = parser.parse(
-                f'CREATE FUNCTION {sig} FROM SQL FUNCTION "xxx";')[0]
+            fsig = parse_function_signature(sig)
+        except FunctionSignatureError as ex:
+            raise shared.DirectiveParseError(self, str(ex))
         except Exception as ex:
             raise shared.DirectiveParseError(
                 self, f'could not parse function signature {sig!r}',
                 cause=ex)
 
-        if (not isinstance(astnode, ql_ast.CreateFunction) or
-                not isinstance(astnode.name, ql_ast.ObjectRef)):
-            raise shared.DirectiveParseError(
-                self, f'EdgeQL parser returned unsupported AST')
-
-        modname = astnode.name.module
-        funcname = astnode.name.name
-        if not modname:
-            raise shared.DirectiveParseError(
-                self, f'EdgeQL function declaration is missing namespace')
-
-        func_repr = ql_gen.EdgeQLSourceGenerator.to_source(astnode)
-        m = re.match(r'''(?xs)
-            ^
-            CREATE\sFUNCTION\s
-            (?P<f>.*?)
-            \sFROM\sSQL\sFUNCTION
-            .*$
-        ''', func_repr)
-        if not m or not m.group('f'):
-            raise shared.DirectiveParseError(
-                self, f'could not recreate function signature from AST')
-        func_repr = m.group('f')
-
-        signode['eql-module'] = modname
-        signode['eql-name'] = funcname
-        signode['eql-fullname'] = fullname = f'{modname}::{funcname}'
-        signode['eql-signature'] = func_repr
+        signode['eql-module'] = fsig.module
+        signode['eql-name'] = fsig.name
+        signode['eql-fullname'] = fullname = f'{fsig.module}::{fsig.name}'
+        signode['eql-signature'] = fsig.signature
 
         signode += s_nodes.desc_annotation('function', 'function')
         signode += d_nodes.Text(' ')
         signode += s_nodes.desc_name(fullname, fullname)
 
         params = s_nodes.desc_parameterlist()
-        for idx, param in enumerate(astnode.args):
-            name = param.name
-            if not name:
-                name = f'${idx}'
-
-            param_repr = ql_gen.EdgeQLSourceGenerator.to_source(param)
+        for name, param_repr in fsig.params:
             param_node = s_nodes.desc_parameter(param_repr, param_repr)
             param_node['eql-name'] = name
             params += param_node
         signode += params
 
-        ret_repr = ql_gen.EdgeQLSourceGenerator.to_source(astnode.returning)
-        if astnode.set_returning is ql_ast.SetQualifier.SET_OF:
-            ret_repr = f'SET OF {ret_repr}'
-        signode += s_nodes.desc_returns(ret_repr, ret_repr)
+        signode += s_nodes.desc_returns(fsig.returns, fsig.returns)
 
         return fullname
 
@@ -852,6 +926,135 @@ class EQLConstraintXRef(s_roles.XRefRole):
     pass
 
 
+class EQLObjectIndex(collections.abc.MutableMapping):
+    """A mapping of fullname -> (docname, objtype) sharded by object type.
+
+    Every shard is pickled separately and only when it was modified since
+    the last time it was pickled; shards are unpickled lazily on first
+    access.  A docname -> fullnames index makes clearing and merging
+    the data of a document proportional to the size of that document.
+    The suggestion index for unresolved references is built on demand
+    and dropped whenever a shard changes.
+    """
+
+    def __init__(self):
+        self._shards = {}  # shard name -> {fullname: (docname, objtype)}
+        self._blobs = {}  # shard name -> pickled shard
+        self._dirty = set()
+        self._docs = {}  # docname -> {fullname}
+        self._suggestions = None
+
+    @staticmethod
+    def shard_name(fullname):
+        return fullname.split('::', 1)[0]
+
+    def _get_shard(self, name, *, create=False):
+        shard = self._shards.get(name)
+        if shard is None:
+            blob = self._blobs.get(name)
+            if blob is not None:
+                shard = pickle.loads(blob)
+            elif create:
+                shard = {}
+            else:
+                return None
+            self._shards[name] = shard
+        return shard
+
+    def _mark_dirty(self, name):
+        self._dirty.add(name)
+        self._blobs.pop(name, None)
+        self._suggestions = None
+
+    def _unlink_doc(self, docname, fullname):
+        names = self._docs[docname]
+        names.discard(fullname)
+        if not names:
+            del self._docs[docname]
+
+    def shard_names(self):
+        return sorted(self._shards.keys() | self._blobs.keys())
+
+    def iter_shard(self, name):
+        shard = self._get_shard(name)
+        if shard is not None:
+            yield from shard.items()
+
+    def __getitem__(self, fullname):
+        shard = self._get_shard(self.shard_name(fullname))
+        if shard is None:
+            raise KeyError(fullname)
+        return shard[fullname]
+
+    def __setitem__(self, fullname, value):
+        name = self.shard_name(fullname)
+        shard = self._get_shard(name, create=True)
+        old = shard.get(fullname)
+        if old is not None:
+            self._unlink_doc(old[0], fullname)
+        shard[fullname] = value
+        self._docs.setdefault(value[0], set()).add(fullname)
+        self._mark_dirty(name)
+
+    def __delitem__(self, fullname):
+        name = self.shard_name(fullname)
+        shard = self._get_shard(name)
+        if shard is None:
+            raise KeyError(fullname)
+        docname, _ = shard.pop(fullname)
+        self._unlink_doc(docname, fullname)
+        self._mark_dirty(name)
+
+    def __iter__(self):
+        for name in self.shard_names():
+            yield from self._get_shard(name)
+
+    def __len__(self):
+        return sum(len(names) for names in self._docs.values())
+
+    def clear_doc(self, docname):
+        for fullname in self._docs.pop(docname, ()):
+            name = self.shard_name(fullname)
+            del self._get_shard(name)[fullname]
+            self._mark_dirty(name)
+
+    def merge(self, other, docnames):
+        for docname in docnames:
+            for fullname in other._docs.get(docname, ()):
+                self[fullname] = other[fullname]
+
+    def suggestions(self):
+        if self._suggestions is None:
+            self._suggestions = suggest.SuggestionIndex(
+                (fullname, objtype)
+                for name in self.shard_names()
+                for fullname, (_, objtype) in self.iter_shard(name))
+        return self._suggestions
+
+    def compact(self):
+        """Keep all shards only in their pickled form."""
+        self.__getstate__()
+        self._shards.clear()
+
+    def __getstate__(self):
+        for name in self._dirty:
+            shard = self._shards.get(name)
+            if shard:
+                self._blobs[name] = pickle.dumps(
+                    shard, pickle.HIGHEST_PROTOCOL)
+        self._dirty.clear()
+        return {'blobs': self._blobs, 'docs': self._docs}
+
+    def __setstate__(self, state):
+        self._shards = {}
+        self._blobs = dict(state['blobs'])
+        self._dirty = set()
+        self._docs = {
+            docname: set(names) for docname, names in state['docs'].items()
+        }
+        self._suggestions = None
+
+
 class EdgeQLDomain(s_domains.Domain):
 
     name = "eql"
@@ -871,6 +1074,10 @@ class EdgeQLDomain(s_domains.Domain):
         for tn, td in object_types.items() for role in td.roles
     }
 
+    _object_type_to_role = {
+        tn: td.roles[0] for tn, td in object_types.items()
+    }
+
     directives = {
         'function': EQLFunctionDirective,
         'constraint': EQLConstraintDirective,
@@ -892,14 +1099,14 @@ class EdgeQLDomain(s_domains.Domain):
     }
 
     initial_data = {
-        'objects': {}  # fullname -> docname, objtype
+        'objects': EQLObjectIndex()  # fullname -> docname, objtype
     }
 
-    def resolve_xref(self, env, fromdocname, builder,
-                     type, target, node, contnode):
+    data_version = 1
 
-        objects = self.data['objects']
-        expected_type = self._role_to_object_type[type]
+    @classmethod
+    def get_target_candidates(cls, type, target):
+        expected_type = cls._role_to_object_type[type]
 
         target = target.replace(' ', '-')
         if expected_type == 'keyword':
@@ -915,6 +1122,17 @@ class EdgeQLDomain(s_domains.Domain):
         else:
             targets = [target]
 
+        return expected_type, targets
+
+    @classmethod
+    def find_target(cls, objects, type, target):
+        """Look up a reference target in *objects*.
+
+        *objects* maps fullnames to (docname, objtype) tuples, like the
+        domain's object index.
+        """
+        expected_type, targets = cls.get_target_candidates(type, target)
+
         docname = None
         obj_type = None
         for target in targets:
@@ -923,10 +1141,39 @@ class EdgeQLDomain(s_domains.Domain):
             except KeyError:
                 continue
 
+        return expected_type, targets, target, docname, obj_type
+
+    def find_object(self, type, target):
+        return self.find_target(self.data['objects'], type, target)
+
+    @classmethod
+    def did_you_mean(cls, suggestions, type, target):
+        """Return a "; did you mean ...?" suffix for an error message.
+
+        *suggestions* is a suggest.SuggestionIndex, *target* is the full
+        name that was looked up.
+        """
+        expected_type = cls._role_to_object_type[type]
+        found = suggestions.suggest(expected_type, target.split('::', 1)[1])
+        return suggest.format_suggestions(found, cls._object_type_to_role)
+
+    def resolve_xref(self, env, fromdocname, builder,
+                     type, target, node, contnode):
+
+        expected_type, targets, target, docname, obj_type = \
+            self.find_object(type, target)
+
         if docname is None:
+            refnode = inventory.resolve_external(
+                env, expected_type, targets, contnode)
+            if refnode is not None:
+                return refnode
+
             if not node.get('eql-auto-link'):
                 raise shared.DomainError(
-                    f'cannot resolve :eql:{type}: targeting {target!r}')
+                    f'cannot resolve :eql:{type}: targeting {target!r}' +
+                    self.did_you_mean(
+                        self.data['objects'].suggestions(), type, target))
             else:
                 return
 
@@ -942,18 +1189,16 @@ class EdgeQLDomain(s_domains.Domain):
         return node
 
     def clear_doc(self, docname):
-        for fullname, (fn, _l) in list(self.data['objects'].items()):
-            if fn == docname:
-                del self.data['objects'][fullname]
+        self.data['objects'].clear_doc(docname)
 
     def merge_domaindata(self, docnames, otherdata):
-        for fullname, (fn, objtype) in otherdata['objects'].items():
-            if fn in docnames:
-                self.data['objects'][fullname] = (fn, objtype)
+        self.data['objects'].merge(otherdata['objects'], docnames)
 
     def get_objects(self):
-        for refname, (docname, type) in self.data['objects'].items():
-            yield (refname, refname, type, docname, refname, 1)
+        objects = self.data['objects']
+        for shard in objects.shard_names():
+            for refname, (docname, type) in objects.iter_shard(shard):
+                yield (refname, refname, type, docname, refname, 1)
 
     def get_full_qualified_name(self, node):
         fn = node.get('eql-fullname')
@@ -1018,6 +1263,58 @@ class StatementTransform(s_transforms.SphinxTransform):
             section['ids'].append(target)
 
 
+class XRefBatchTransform(s_post_transforms.SphinxPostTransform):
+    """Resolve all eql references of a document in one pass.
+
+    References are grouped by (reftype, reftarget), every unique target
+    is looked up once and the relative URI is computed once per target
+    document.  References that do not resolve to an object of the
+    expected type are left to ReferencesResolver, which reports them.
+    """
+
+    default_priority = 5  # before ReferencesResolver
+
+    def run(self):
+        if not self.config.edgedb_eql_batch_xrefs:
+            return
+
+        groups = {}
+        for node in self.document.traverse(s_nodes.pending_xref):
+            if node.get('refdomain') == 'eql':
+                key = (node['reftype'], node['reftarget'])
+                groups.setdefault(key, []).append(node)
+
+        if not groups:
+            return
+
+        domain = self.env.get_domain('eql')
+        builder = self.app.builder
+        uris = {}
+
+        for (type, target), xrefs in groups.items():
+            expected_type, _, anchor, docname, obj_type = \
+                domain.find_object(type, target)
+            if docname is None or obj_type != expected_type:
+                continue
+
+            for node in xrefs:
+                fromdocname = node.get('refdoc', self.env.docname)
+
+                refnode = d_nodes.reference('', '', internal=True)
+                if fromdocname == docname:
+                    refnode['refid'] = anchor
+                else:
+                    uri = uris.get((fromdocname, docname))
+                    if uri is None:
+                        uri = uris[fromdocname, docname] = \
+                            builder.get_relative_uri(fromdocname, docname)
+                    refnode['refuri'] = f'{uri}#{anchor}'
+                refnode['eql-type'] = obj_type
+                refnode.append(node[0].deepcopy())
+
+                node.replace_self(refnode)
+
+
 def setup_domain(app):
     app.add_lexer("edgeql", EdgeQLLexer())
     app.add_lexer("edgeql-repl", EdgeQLLexer())
@@ -1030,3 +1327,6 @@ def setup_domain(app):
     app.add_domain(EdgeQLDomain)
 
     app.add_transform(StatementTransform)
+
+    app.add_config_value('edgedb_eql_batch_xrefs', True, '')
+    app.add_post_transform(XRefBatchTransform)
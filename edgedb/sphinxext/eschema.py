@@ -27,6 +27,11 @@ class EschemaDomain(s_domains.Domain):
         'synopsis': EschemaSynopsisDirective,
     }
 
+    def merge_domaindata(self, docnames, otherdata):
+        # No per-document data; needed for parallel reads and for
+        # documents restored from the shared doctree store.
+        pass
+
 
 def setup_domain(app):
     app.add_lexer("eschema", EdgeSchemaLexer())
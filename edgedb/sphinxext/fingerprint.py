@@ -0,0 +1,151 @@
+import hashlib
+import os
+import os.path
+import re
+
+
+# Config values that are substituted into documents at read time
+# only if a document explicitly refers to them.
+_SUBSTITUTION_CONFIG = {
+    'version': b'|version|',
+    'release': b'|release|',
+    'today': b'|today|',
+}
+
+_extension_fingerprint = None
+
+# Memory addresses in reprs, e.g. "<function setup at 0x7f...>".
+_address_re = re.compile(r' at 0x[0-9a-fA-F]+')
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(filename):
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def extension_fingerprint():
+    """Return a hash of the source code of the edgedb.sphinxext package."""
+    global _extension_fingerprint
+
+    if _extension_fingerprint is None:
+        _extension_fingerprint = current_extension_fingerprint()
+
+    return _extension_fingerprint
+
+
+def current_extension_fingerprint():
+    """Like :func:`extension_fingerprint`, but not cached."""
+    h = hashlib.sha256()
+    pkgdir = os.path.dirname(os.path.abspath(__file__))
+    for fn in sorted(os.listdir(pkgdir)):
+        if fn.endswith('.py'):
+            h.update(fn.encode())
+            with open(os.path.join(pkgdir, fn), 'rb') as f:
+                h.update(f.read())
+    return h.hexdigest()
+
+
+def config_fingerprint(config):
+    """Return a hash of all config values that affect read results.
+
+    Values that are only used for document substitutions (like
+    ``version``) are excluded; use :func:`document_fingerprint`
+    to account for them.
+    """
+    h = hashlib.sha256()
+    for name, opt in sorted(config.values.items()):
+        # Sphinx >= 7.3 stores options as _Opt objects, older
+        # versions as (default, rebuild, types) tuples.
+        rebuild = getattr(opt, 'rebuild', None)
+        if rebuild is None:
+            rebuild = opt[1]
+        if rebuild != 'env' or name in _SUBSTITUTION_CONFIG:
+            continue
+        value = stable_repr(getattr(config, name, None))
+        h.update(f'{name}={value}\n'.encode())
+    return h.hexdigest()
+
+
+def stable_repr(value):
+    """Return a repr of *value* that is the same in every process.
+
+    Set items are sorted, and the memory addresses in the reprs of
+    functions and other objects are left out.
+    """
+    if isinstance(value, (list, tuple)):
+        items = ', '.join(stable_repr(v) for v in value)
+        return f'[{items}]' if isinstance(value, list) else f'({items})'
+    if isinstance(value, (set, frozenset)):
+        return '{' + ', '.join(sorted(stable_repr(v) for v in value)) + '}'
+    if isinstance(value, dict):
+        items = sorted(
+            f'{stable_repr(k)}: {stable_repr(v)}' for k, v in value.items())
+        return '{' + ', '.join(items) + '}'
+    if callable(value) and hasattr(value, '__qualname__'):
+        return f'<{getattr(value, "__module__", None)}.{value.__qualname__}>'
+    return _address_re.sub('', repr(value))
+
+
+def document_fingerprint(source, config, *, config_hash=None):
+    """Return a content key of a document source read with *config*."""
+    if config_hash is None:
+        config_hash = config_fingerprint(config)
+
+    h = hashlib.sha256()
+    h.update(extension_fingerprint().encode())
+    h.update(config_hash.encode())
+    for name, marker in _SUBSTITUTION_CONFIG.items():
+        if marker in source:
+            value = stable_repr(getattr(config, name, None))
+            h.update(f'{name}={value}\n'.encode())
+    h.update(source)
+    return h.hexdigest()
+
+
+def dependencies_fingerprint(srcdir, dependencies):
+    """Return a hash of the names and contents of *dependencies*.
+
+    *dependencies* are file names relative to *srcdir* (or absolute),
+    like the values of ``env.dependencies``; missing files are hashed
+    as such instead of failing.
+    """
+    h = hashlib.sha256()
+    for dep in sorted(dependencies):
+        try:
+            digest = hash_file(os.path.join(srcdir, dep))
+        except OSError:
+            digest = 'missing'
+        h.update(f'{dep}\0{digest}\n'.encode())
+    return h.hexdigest()
+
+
+def tree_fingerprint(path, *, suffixes=None,
+                     exclude=('_build', '__pycache__')):
+    """Return a hash of names and contents of all files under *path*."""
+    h = hashlib.sha256()
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames[:] = sorted(d for d in dirnames if d not in exclude)
+        for fn in sorted(filenames):
+            if suffixes is not None and not fn.endswith(suffixes):
+                continue
+            filename = os.path.join(dirpath, fn)
+            relname = os.path.relpath(filename, path).replace(os.sep, '/')
+            h.update(f'{relname}\0{hash_file(filename)}\n'.encode())
+    return h.hexdigest()
+
+
+def parser_fingerprint():
+    """Return a hash of the EdgeQL parser the docs are checked with."""
+    try:
+        from edgedb.lang.edgeql import parser as ql_parser
+    except ImportError:
+        return 'none'
+    return tree_fingerprint(
+        os.path.dirname(ql_parser.__file__), suffixes=('.py',))
@@ -0,0 +1,179 @@
+"""
+=======================
+EdgeQL object inventory
+=======================
+
+HTML builds write an "eql.inv" file next to "objects.inv".  It contains
+only the objects of the :eql: domain in the Sphinx inventory format
+(version 2) with compact display names and anchors compressed with
+the "$" shorthand.  Entries are rendered one domain shard at a time in
+sorted order and streamed through zlib; the file is only replaced when
+its content has changed.
+
+Anchors are deliberately left equal to the refnames
+("#type::std::int64"): the "$" shorthand stores them in one byte, any
+other anchor would make the inventory larger, and existing links to
+the documentation use them.
+
+Other Sphinx projects that load "edgedb.sphinxext" can link to these
+objects with the regular :eql: roles by listing the inventory in their
+intersphinx mapping:
+
+    intersphinx_mapping = {
+        'edgedb': ('https://edgedb.com/docs/',
+                   'https://edgedb.com/docs/eql.inv'),
+    }
+
+References that cannot be resolved locally are then looked up in the
+loaded inventories using the same target normalization as
+EdgeQLDomain.resolve_xref.
+"""
+
+
+import hashlib
+import os
+import os.path
+import tempfile
+import zlib
+
+from docutils import nodes as d_nodes
+
+
+INVENTORY_FILENAME = 'eql.inv'
+
+_HEADER = (
+    '# Sphinx inventory version 2\n'
+    '# Project: {project}\n'
+    '# Version: {version}\n'
+    '# The remainder of this file is compressed using zlib.\n'
+)
+
+_SPACED_TYPES = {'type', 'keyword', 'statement'}
+_MODULE_TYPES = {'type', 'function', 'constraint'}
+
+
+def display_name(refname, objtype):
+    name = refname.split('::', 1)[1]
+    if objtype in _MODULE_TYPES and name.startswith('std::'):
+        name = name[len('std::'):]
+    if objtype in _SPACED_TYPES:
+        name = name.replace('-', ' ')
+    if objtype == 'function':
+        name += '()'
+    return name
+
+
+def iter_entries(objects, builder):
+    """Yield inventory lines for all objects in sorted order."""
+    uris = {}
+    for shard in objects.shard_names():
+        for refname, (docname, objtype) in sorted(objects.iter_shard(shard)):
+            uri = uris.get(docname)
+            if uri is None:
+                uri = uris[docname] = builder.get_target_uri(docname)
+
+            dispname = display_name(refname, objtype)
+            if dispname == refname:
+                dispname = '-'
+
+            # Anchors of eql objects are their refnames (see the module
+            # docstring), so they are always written as "$".
+            yield f'{refname} eql:{objtype} 1 {uri}#$ {dispname}\n'
+
+
+def write_inventory(filename, objects, builder, *, project, version):
+    """Stream the inventory into *filename*.
+
+    Return True if the file was (re)written and False if an identical
+    inventory was already there.
+    """
+    outdir = os.path.dirname(filename)
+    fd, tmp = tempfile.mkstemp(dir=outdir)
+
+    h = hashlib.sha256()
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            header = _HEADER.format(
+                project=project, version=version).encode()
+            f.write(header)
+            h.update(header)
+
+            compressor = zlib.compressobj(9)
+            for line in iter_entries(objects, builder):
+                line = line.encode()
+                h.update(line)
+                f.write(compressor.compress(line))
+            f.write(compressor.flush())
+
+        if (os.path.exists(filename) and
+                _content_hash(filename) == h.digest()):
+            os.unlink(tmp)
+            return False
+
+        os.replace(tmp, filename)
+    except BaseException:
+        # Do not leave the temporary file in the published site.
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return True
+
+
+def _content_hash(filename):
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        header = []
+        for _ in range(4):
+            header.append(f.readline())
+        h.update(b''.join(header))
+
+        decompressor = zlib.decompressobj()
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            h.update(decompressor.decompress(chunk))
+        h.update(decompressor.flush())
+    return h.digest()
+
+
+def resolve_external(env, objtype, targets, contnode):
+    """Resolve an :eql: reference against intersphinx inventories."""
+    inventory = getattr(env, 'intersphinx_inventory', None)
+    if not inventory:
+        return None
+
+    entries = inventory.get(f'eql:{objtype}')
+    if not entries:
+        return None
+
+    for target in targets:
+        entry = entries.get(target)
+        if entry is None:
+            continue
+
+        proj, version, uri, _dispname = entry
+        reftitle = f'(in {proj} v{version})' if version else f'(in {proj})'
+        refnode = d_nodes.reference(
+            '', '', internal=False, refuri=uri, reftitle=reftitle)
+        refnode.append(contnode)
+        refnode['eql-type'] = objtype
+        return refnode
+
+    return None
+
+
+def build_inventory(app, exception):
+    if (exception is not None or not app.config.edgedb_eql_inventory or
+            app.builder.format != 'html'):
+        return
+
+    write_inventory(
+        os.path.join(app.outdir, INVENTORY_FILENAME),
+        app.env.domaindata['eql']['objects'],
+        app.builder,
+        project=app.config.project,
+        version=app.config.version)
+
+
+def setup_extension(app):
+    app.add_config_value('edgedb_eql_inventory', True, '')
+
+    app.connect('build-finished', build_inventory)
@@ -0,0 +1,97 @@
+"""
+===================
+Bounded-memory mode
+===================
+
+With "edgedb_low_memory = True" the build keeps at most one resolved
+doctree in memory at a time:
+
+* Documents are resolved and written one by one: parallel writing,
+  which resolves whole chunks of documents in the main process before
+  handing them to workers, is disabled.  Parallel reading is not
+  affected.
+
+* Doctrees that Sphinx keeps in memory between the read and the write
+  phase, or as pickles for repeated loading, are dropped as soon as the
+  next document is read; every document is loaded from its pickle when
+  it is written and dropped from the caches right after.
+
+* Once a page is written, the reference cycles of its doctree (every
+  node refers to its parent and to the document) are broken, so that
+  it is freed immediately instead of waiting for a full garbage
+  collection.
+
+* After the read phase, the eql object index keeps its shards only in
+  their pickled form and unpickles the ones actually used for resolving
+  references.
+"""
+
+
+def release_doctree(doctree):
+    """Break the reference cycles of *doctree*."""
+    stack = [doctree]
+    while stack:
+        node = stack.pop()
+        children = getattr(node, 'children', None)
+        if children:
+            stack.extend(children)
+            node.children = []
+        node.parent = None
+        node.document = None
+
+
+def _drop_cached_doctree(env, docname):
+    # Newer Sphinx versions keep doctrees read in this process, and the
+    # pickles of all loaded doctrees, in memory.
+    for cache in ('_write_doc_doctree_cache', '_pickled_doctree_cache'):
+        getattr(env, cache, {}).pop(docname, None)
+
+
+def _drop_read_doctrees(env):
+    cache = getattr(env, '_write_doc_doctree_cache', {})
+    while cache:
+        _, doctree = cache.popitem()
+        release_doctree(doctree)
+
+
+def install_low_memory(app):
+    if not app.config.edgedb_low_memory:
+        return
+
+    builder = app.builder
+    builder.allow_parallel = False
+
+    write_doc = builder.write_doc
+
+    def write_doc_and_release(docname, doctree):
+        try:
+            write_doc(docname, doctree)
+        finally:
+            _drop_cached_doctree(builder.env, docname)
+            release_doctree(doctree)
+
+    builder.write_doc = write_doc_and_release
+
+
+def drop_read_doctrees(app, docname, source):
+    # Doctrees of the documents read so far are already pickled.
+    if app.config.edgedb_low_memory:
+        _drop_read_doctrees(app.env)
+
+
+def compact_env(app, env):
+    if not app.config.edgedb_low_memory:
+        return
+
+    _drop_read_doctrees(env)
+    getattr(env, '_pickled_doctree_cache', {}).clear()
+
+    env.get_domain('eql').data['objects'].compact()
+
+
+def setup_extension(app):
+    app.add_config_value('edgedb_low_memory', False, '')
+
+    app.connect('builder-inited', install_low_memory)
+    app.connect('source-read', drop_read_doctrees)
+    app.connect('env-updated', compact_env)
@@ -0,0 +1,572 @@
+"""
+================================
+Language server for docs authors
+================================
+
+A Language Server Protocol server for editing the documentation:
+
+    $ python -m edgedb.sphinxext.lsp [--docs doc]
+
+It speaks JSON-RPC over stdin/stdout and provides:
+
+* completion of :eql:func:, :eql:type:, :eql:op:, :eql:stmt:,
+  :eql:kw: and :eql:constraint: targets, and of the fields of eql
+  directives;
+
+* go-to-definition for these roles;
+
+* diagnostics: unknown or malformed directive fields and missing or
+  too long summaries (the checks of BaseEQLDirective), signatures that
+  do not name an object, duplicate declarations and references that
+  EdgeQLDomain.resolve_xref would not resolve (see xrefcheck).
+
+All ".rst" files under the docs directory ("doc" in the workspace root
+by default) are scanned into a srcindex.SourceIndex at start-up.  An
+edited file is rescanned on its own once no changes have arrived for
+DEBOUNCE seconds (or right away when completion or a definition is
+requested in it); when its declarations change, the references of the
+other open files are checked again.  Nothing here runs Sphinx, so
+diagnostics that need a full build (EdgeQL signature parsing, for one)
+are left to it.
+
+Character offsets are counted in code points rather than in UTF-16
+code units as the protocol specifies; they only differ on lines with
+characters outside the BMP.
+"""
+
+
+import argparse
+import json
+import os
+import os.path
+import pathlib
+import select
+import sys
+import time
+import traceback
+import urllib.parse
+
+from . import eql
+from . import srcindex
+from . import suggest
+from . import xrefcheck
+
+
+DEBOUNCE = 0.15
+
+# LSP constants.
+TEXT_DOCUMENT_SYNC_INCREMENTAL = 2
+SEVERITY_ERROR = 1
+SEVERITY_WARNING = 2
+COMPLETION_KIND_FIELD = 5
+COMPLETION_KIND_REFERENCE = 18
+MESSAGE_TYPE_ERROR = 1
+METHOD_NOT_FOUND = -32601
+INTERNAL_ERROR = -32603
+
+_COMPLETION_KINDS = {
+    'function': 3,
+    'type': 7,
+    'operator': 24,
+    'keyword': 14,
+    'constraint': 22,
+    'statement': 14,
+}
+
+_SECTION_FIELDS = ('eql-statement', 'eql-haswith')
+
+
+def uri_to_path(uri):
+    return urllib.parse.unquote(urllib.parse.urlparse(uri).path)
+
+
+def path_to_uri(path):
+    return pathlib.Path(os.path.abspath(path)).as_uri()
+
+
+def check_declaration(decl):
+    """Yield (lineno, col, message) for problems of a declaration."""
+    if decl.objtype == 'statement':
+        if decl.paragraph is None:
+            yield (decl.lineno, 0,
+                   f'section {decl.signature!r} is marked with an '
+                   f':eql-statement: and is required to have at least '
+                   f'one paragraph')
+        return
+
+    directive = eql.EdgeQLDomain.directives[decl.objtype]
+    for name, lineno, col in decl.fields:
+        fname, fdesc, farg = directive.find_source_field(name)
+        if fdesc is None or bool(farg) != fdesc.has_arg:
+            yield (lineno, col,
+                   directive.field_error(fname, fdesc, farg).strip())
+
+    if not decl.has_content:
+        yield decl.lineno, 0, 'the directive must include a description'
+    elif decl.paragraph is None:
+        yield (decl.lineno, 0,
+               'there must be a short text paragraph after directive fields')
+    else:
+        summary = directive.strip_ws(srcindex.plain_text(decl.paragraph))
+        error = directive.summary_error(summary)
+        if error:
+            yield decl.paragraph_lineno, 0, error
+
+
+class Document:
+
+    def __init__(self, uri, text, version):
+        self.uri = uri
+        self.filename = uri_to_path(uri)
+        self.text = text
+        self.version = version
+        self.scan = None
+        self.deadline = None
+
+    def lines(self):
+        return self.text.split('\n')
+
+    def offset(self, position):
+        lines = self.text.split('\n')
+        line = min(position['line'], len(lines))
+        offset = sum(len(ln) + 1 for ln in lines[:line])
+        if line < len(lines):
+            offset += min(position['character'], len(lines[line]))
+        return offset
+
+    def apply_change(self, change):
+        if 'range' not in change:
+            self.text = change['text']
+            return
+        start = self.offset(change['range']['start'])
+        end = self.offset(change['range']['end'])
+        self.text = self.text[:start] + change['text'] + self.text[end:]
+
+
+class LanguageServer:
+
+    def __init__(self, docsdir=None, *, output=None):
+        self.docsdir = docsdir
+        self.output = output or sys.stdout.buffer
+        self.index = srcindex.SourceIndex()
+        self.documents = {}
+        self.running = True
+        self._completions = {}  # objtype -> [item]
+        self._completions_version = None
+        self._suggestions = None
+        self._suggestions_version = None
+
+    # Transport
+
+    def send(self, message):
+        message['jsonrpc'] = '2.0'
+        body = json.dumps(message).encode()
+        self.output.write(
+            f'Content-Length: {len(body)}\r\n\r\n'.encode() + body)
+        self.output.flush()
+
+    def notify(self, method, params):
+        self.send({'method': method, 'params': params})
+
+    def dispatch(self, message):
+        method = message.get('method')
+        handler = getattr(
+            self, 'on_' + (method or '').replace('/', '_'), None)
+
+        if 'id' not in message:
+            if handler is not None:
+                try:
+                    handler(message.get('params') or {})
+                except Exception:
+                    # There is no response to carry the error; log it
+                    # and drop the notification.
+                    self.notify('window/logMessage', {
+                        'type': MESSAGE_TYPE_ERROR,
+                        'message': f'error handling {method!r}:\n'
+                                   f'{traceback.format_exc()}'})
+            return
+
+        if handler is None:
+            self.send({'id': message['id'], 'error': {
+                'code': METHOD_NOT_FOUND,
+                'message': f'unsupported method {method!r}'}})
+            return
+        try:
+            result = handler(message.get('params') or {})
+        except Exception as ex:
+            self.send({'id': message['id'], 'error': {
+                'code': INTERNAL_ERROR,
+                'message': f'error handling {method!r}: {ex}'}})
+            return
+        self.send({'id': message['id'], 'result': result})
+
+    # Indexing and diagnostics
+
+    def scan_sources(self):
+        if not self.docsdir or not os.path.isdir(self.docsdir):
+            return
+        for filename in xrefcheck.find_sources(os.path.abspath(self.docsdir)):
+            if path_to_uri(filename) not in self.documents:
+                self.index.update(srcindex.scan_file(filename))
+
+    def rescan(self, doc):
+        doc.deadline = None
+        doc.scan = srcindex.scan_source(doc.text, doc.filename)
+        if self.index.update(doc.scan):
+            for other in self.documents.values():
+                if other is not doc and other.scan is not None:
+                    self.publish_diagnostics(other)
+        self.publish_diagnostics(doc)
+
+    def rescan_due(self, now):
+        for doc in list(self.documents.values()):
+            if doc.deadline is not None and doc.deadline <= now:
+                self.rescan(doc)
+
+    def next_deadline(self):
+        deadlines = [doc.deadline for doc in self.documents.values()
+                     if doc.deadline is not None]
+        return min(deadlines) if deadlines else None
+
+    def ensure_scanned(self, doc):
+        if doc.scan is None or doc.deadline is not None:
+            self.rescan(doc)
+
+    def diagnostics(self, doc):
+        scan = doc.scan
+        result = []
+
+        def add(lineno, col, end_lineno, end_col, message,
+                severity=SEVERITY_ERROR):
+            result.append({
+                'range': {
+                    'start': {'line': lineno, 'character': col},
+                    'end': {'line': end_lineno, 'character': end_col},
+                },
+                'severity': severity,
+                'source': 'eql',
+                'message': message,
+            })
+
+        for problem in scan.problems:
+            add(problem.lineno, 0, problem.lineno + 1, 0, problem.message)
+
+        for decl in scan.declarations:
+            for lineno, col, message in check_declaration(decl):
+                add(lineno, col, lineno + 1, 0, message)
+
+        for decl, first in self.index.duplicates(doc.filename):
+            add(decl.lineno, 0, decl.lineno + 1, 0,
+                f'duplicate {decl.objtype} {decl.target} description '
+                f'(first described in {first.filename}:{first.lineno + 1})')
+
+        for ref in scan.references:
+            resolved = xrefcheck.resolve_reference(
+                self.index.objects, ref, suggestions=self.suggestions())
+            if resolved is not None and resolved[0] is None:
+                add(ref.lineno, ref.col, ref.end_lineno, ref.end_col,
+                    resolved[1], SEVERITY_WARNING)
+
+        return result
+
+    def publish_diagnostics(self, doc):
+        self.notify('textDocument/publishDiagnostics', {
+            'uri': doc.uri,
+            'diagnostics': self.diagnostics(doc),
+        })
+
+    def suggestions(self):
+        if self._suggestions_version != self.index.version:
+            self._suggestions = suggest.SuggestionIndex(
+                (target, objtype)
+                for target, (_, objtype) in self.index.objects.items())
+            self._suggestions_version = self.index.version
+        return self._suggestions
+
+    # Completion and definitions
+
+    def completion_items(self, objtype):
+        if self._completions_version != self.index.version:
+            self._completions = {}
+            self._completions_version = self.index.version
+
+        items = self._completions.get(objtype)
+        if items is None:
+            items = []
+            prefix = f'{objtype}::'
+            for decl in self.index.declarations():
+                if decl.objtype != objtype:
+                    continue
+                name = decl.target[len(prefix):]
+                if objtype in {'type', 'function', 'constraint'}:
+                    if name.startswith('std::'):
+                        name = name[len('std::'):]
+                elif objtype in {'keyword', 'statement'}:
+                    name = name.replace('-', ' ')
+                item = {
+                    'label': name,
+                    'kind': _COMPLETION_KINDS.get(
+                        objtype, COMPLETION_KIND_REFERENCE),
+                    'detail': f'{objtype} {decl.signature}',
+                }
+                if decl.paragraph:
+                    item['documentation'] = eql.BaseEQLDirective.strip_ws(
+                        srcindex.plain_text(decl.paragraph))
+                items.append(item)
+            items.sort(key=lambda item: item['label'].lower())
+            self._completions[objtype] = items
+        return items
+
+    def field_items(self, doc, lineno, indent):
+        lines = doc.lines()
+        for ln in range(lineno - 1, -1, -1):
+            line = lines[ln]
+            if not line.strip():
+                continue
+            line_indent = len(line) - len(line.lstrip())
+            if line_indent >= indent:
+                continue
+            name = srcindex.directive_name(line)
+            if name is None or not name.startswith('eql:'):
+                return []
+            directive = eql.EdgeQLDomain.directives.get(name[4:])
+            names = []
+            for fielddesc in getattr(directive, 'doc_field_types', ()):
+                names.extend(fielddesc.names)
+                names.extend(getattr(fielddesc, 'typenames', ()))
+            return [{'label': name, 'kind': COMPLETION_KIND_FIELD}
+                    for name in names]
+
+        return [{'label': name, 'kind': COMPLETION_KIND_FIELD}
+                for name in _SECTION_FIELDS]
+
+    def completions_at(self, doc, position):
+        lines = doc.lines()
+        if position['line'] >= len(lines):
+            return []
+        before = lines[position['line']][:position['character']]
+
+        role = srcindex.open_role(before)
+        if role is not None:
+            try:
+                objtype, _ = eql.EdgeQLDomain.get_target_candidates(
+                    role, '')
+            except KeyError:
+                return []
+            return self.completion_items(objtype)
+
+        stripped = before.lstrip()
+        if stripped.startswith(':') and ':' not in stripped[1:]:
+            rest = stripped[1:]
+            if all(c.isalnum() or c in '-_' for c in rest):
+                return self.field_items(
+                    doc, position['line'], len(before) - len(stripped))
+
+        return []
+
+    def reference_at(self, doc, position):
+        line, col = position['line'], position['character']
+        for ref in doc.scan.references:
+            if ((ref.lineno, ref.col) <= (line, col) <=
+                    (ref.end_lineno, ref.end_col)):
+                return ref
+        return None
+
+    # Protocol methods
+
+    def on_initialize(self, params):
+        if self.docsdir is None:
+            root = params.get('rootPath')
+            if params.get('rootUri'):
+                root = uri_to_path(params['rootUri'])
+            if root:
+                self.docsdir = os.path.join(root, 'doc')
+
+        return {
+            'capabilities': {
+                'textDocumentSync': {
+                    'openClose': True,
+                    'change': TEXT_DOCUMENT_SYNC_INCREMENTAL,
+                },
+                'completionProvider': {'triggerCharacters': ['`', ':', '<']},
+                'definitionProvider': True,
+            },
+            'serverInfo': {'name': 'edgedb-docs'},
+        }
+
+    def on_initialized(self, params):
+        self.scan_sources()
+
+    def on_shutdown(self, params):
+        return None
+
+    def on_exit(self, params):
+        self.running = False
+
+    def on_textDocument_didOpen(self, params):
+        item = params['textDocument']
+        doc = self.documents[item['uri']] = Document(
+            item['uri'], item['text'], item.get('version'))
+        self.rescan(doc)
+
+    def on_textDocument_didChange(self, params):
+        doc = self.documents.get(params['textDocument']['uri'])
+        if doc is None:
+            return
+        for change in params['contentChanges']:
+            doc.apply_change(change)
+        doc.version = params['textDocument'].get('version')
+        doc.deadline = time.monotonic() + DEBOUNCE
+
+    def on_textDocument_didClose(self, params):
+        uri = params['textDocument']['uri']
+        doc = self.documents.pop(uri, None)
+        if doc is None:
+            return
+
+        # Unsaved changes are gone; index the file as it is on disk.
+        if os.path.exists(doc.filename):
+            self.index.update(srcindex.scan_file(doc.filename))
+        else:
+            self.index.remove(doc.filename)
+        self.notify('textDocument/publishDiagnostics',
+                    {'uri': uri, 'diagnostics': []})
+
+    def on_workspace_didChangeWatchedFiles(self, params):
+        changed = False
+        for change in params.get('changes', ()):
+            uri = change['uri']
+            filename = uri_to_path(uri)
+            if uri in self.documents or not filename.endswith('.rst'):
+                continue
+            if os.path.exists(filename):
+                changed |= self.index.update(srcindex.scan_file(filename))
+            else:
+                changed |= self.index.remove(filename)
+
+        if changed:
+            for doc in self.documents.values():
+                if doc.scan is not None:
+                    self.publish_diagnostics(doc)
+
+    def on_textDocument_completion(self, params):
+        doc = self.documents.get(params['textDocument']['uri'])
+        items = []
+        if doc is not None:
+            self.ensure_scanned(doc)
+            items = self.completions_at(doc, params['position'])
+        return {'isIncomplete': False, 'items': items}
+
+    def on_textDocument_definition(self, params):
+        doc = self.documents.get(params['textDocument']['uri'])
+        if doc is None:
+            return None
+        self.ensure_scanned(doc)
+
+        ref = self.reference_at(doc, params['position'])
+        if ref is None:
+            return None
+        resolved = xrefcheck.resolve_reference(self.index.objects, ref)
+        if resolved is None or resolved[0] is None:
+            return None
+
+        decl = self.index.get_declaration(resolved[0])
+        return {
+            'uri': path_to_uri(decl.filename),
+            'range': {
+                'start': {'line': decl.lineno, 'character': 0},
+                'end': {'line': decl.lineno, 'character': 0},
+            },
+        }
+
+    # Main loop
+
+    def serve(self, fd):
+        reader = MessageReader(fd)
+        while self.running:
+            deadline = self.next_deadline()
+            timeout = (None if deadline is None
+                       else max(deadline - time.monotonic(), 0))
+            try:
+                message = reader.read(timeout)
+            except EOFError:
+                break
+
+            if message is None:
+                self.rescan_due(time.monotonic())
+            else:
+                self.dispatch(message)
+
+
+class MessageReader:
+    """Read JSON-RPC messages from a file descriptor."""
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.buffer = b''
+        self.eof = False
+
+    def read(self, timeout=None):
+        """Return the next message, or None if there is none in *timeout*.
+
+        Raises EOFError at the end of the input.
+        """
+        while True:
+            message = self._parse()
+            if message is not None:
+                return message
+            if self.eof:
+                raise EOFError
+
+            ready, _, _ = select.select([self.fd], [], [], timeout)
+            if not ready:
+                return None
+            data = os.read(self.fd, 1 << 16)
+            if not data:
+                self.eof = True
+            self.buffer += data
+
+    def _parse(self):
+        while True:
+            header_end = self.buffer.find(b'\r\n\r\n')
+            if header_end < 0:
+                return None
+
+            length = None
+            for line in self.buffer[:header_end].split(b'\r\n'):
+                name, _, value = line.decode('ascii', 'replace').partition(':')
+                if name.strip().lower() == 'content-length':
+                    try:
+                        length = int(value)
+                    except ValueError:
+                        length = None
+            start = header_end + 4
+            if length is None or length < 0:
+                # A protocol error: drop the header block and go on with
+                # whatever follows it.
+                self.buffer = self.buffer[start:]
+                continue
+            if len(self.buffer) < start + length:
+                return None
+
+            body = self.buffer[start:start + length]
+            self.buffer = self.buffer[start + length:]
+            return json.loads(body.decode())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m edgedb.sphinxext.lsp',
+        description='Language server for the EdgeDB documentation.')
+    parser.add_argument(
+        '--docs', default=None,
+        help='docs directory (default: "doc" in the workspace root)')
+    args = parser.parse_args(argv)
+
+    server = LanguageServer(args.docs)
+    server.serve(sys.stdin.fileno())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,237 @@
+"""
+================
+Memory profiling
+================
+
+With "edgedb_memory_profile" set to a file name (relative to the output
+directory), the build is traced with tracemalloc and a report is
+written to that file at the end of the build.  Tracing slows the build
+down considerably and is meant for investigating memory use only.
+
+The report contains:
+
+* tracemalloc snapshots at phase boundaries: after the read phase,
+  when the first document is resolved for writing (resolving and
+  writing alternate per document) and at the end of the build, each
+  with the top allocation sites and the growth since the previous
+  snapshot;
+
+* memory allocated and still held by each transform of this extension,
+  summed over all documents, with the document where it was largest;
+
+* the documents that held the most memory when they were read.
+
+Allocations made in parallel worker processes (-j) are not traced.
+"""
+
+
+import functools
+import os
+import os.path
+import tracemalloc
+
+from sphinx.util import logging as s_logging
+
+from . import shared
+
+
+TRACE_FRAMES = 10
+TOP_SITES = 25
+TOP_DOCUMENTS = 25
+
+logger = s_logging.getLogger(__name__)
+
+_filters = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+]
+
+
+class MemoryProfile:
+
+    def __init__(self):
+        self.snapshots = []  # [(phase, snapshot)]
+        self.transforms = {}  # name -> [total, max, docname of max]
+        self.documents = {}  # docname -> bytes
+        self.read_started = None
+        self.wrapped = []  # [(transform class, apply or None)]
+
+    def take_snapshot(self, phase):
+        snapshot = tracemalloc.take_snapshot().filter_traces(_filters)
+        self.snapshots.append((phase, snapshot))
+
+    def record_transform(self, name, docname, size):
+        stats = self.transforms.setdefault(name, [0, 0, None])
+        stats[0] += size
+        if size > stats[1]:
+            stats[1:] = [size, docname]
+
+    def format_report(self):
+        lines = []
+
+        prev = None
+        for phase, snapshot in self.snapshots:
+            total = sum(stat.size for stat in snapshot.statistics('filename'))
+            lines.append(f'== after {phase}: {total / 2**20:.1f} MiB traced')
+            lines.append('')
+            lines.append('top allocation sites:')
+            for stat in snapshot.statistics('lineno')[:TOP_SITES]:
+                lines.append(f'  {stat}')
+            if prev is not None:
+                lines.append('')
+                lines.append('growth since the previous snapshot:')
+                for stat in snapshot.compare_to(prev, 'lineno')[:TOP_SITES]:
+                    lines.append(f'  {stat}')
+            lines.append('')
+            prev = snapshot
+
+        lines.append('== extension transforms (memory held after apply)')
+        lines.append('')
+        for name, (total, largest, docname) in sorted(
+                self.transforms.items(), key=lambda i: -i[1][0]):
+            lines.append(
+                f'  {name}: {total / 2**10:.1f} KiB in total, '
+                f'{largest / 2**10:.1f} KiB at most (in {docname})')
+        lines.append('')
+
+        lines.append('== largest documents (memory held after reading)')
+        lines.append('')
+        for docname, size in sorted(
+                self.documents.items(),
+                key=lambda i: -i[1])[:TOP_DOCUMENTS]:
+            lines.append(f'  {docname}: {size / 2**10:.1f} KiB')
+        lines.append('')
+
+        return '\n'.join(lines)
+
+
+def _get_profile(app):
+    return getattr(app, 'edgedb_memory_profile', None)
+
+
+def _traced():
+    return tracemalloc.get_traced_memory()[0]
+
+
+def _wrap_transform(profile, cls):
+    # Transform classes outlive the build (and, in the build daemon, are
+    # shared by all builds): wrap apply() for this build only, and never
+    # twice.
+    if getattr(cls.apply, 'edgedb_memory_profiled', False):
+        return
+
+    apply = cls.apply
+
+    @functools.wraps(apply)
+    def profiled_apply(self, *args, **kwargs):
+        profile = _get_profile(self.app)
+        if profile is None:
+            return apply(self, *args, **kwargs)
+
+        before = _traced()
+        try:
+            return apply(self, *args, **kwargs)
+        finally:
+            profile.record_transform(
+                cls.__name__, self.env.docname, _traced() - before)
+
+    profiled_apply.edgedb_memory_profiled = True
+    profile.wrapped.append((cls, cls.__dict__.get('apply')))
+    cls.apply = profiled_apply
+
+
+def _unwrap_transforms(profile):
+    for cls, apply in reversed(profile.wrapped):
+        if apply is None:
+            # apply() was inherited.
+            del cls.apply
+        else:
+            cls.apply = apply
+    profile.wrapped.clear()
+
+
+def start_profile(app):
+    # A build that failed before "build-finished" leaves its profile.
+    previous = _get_profile(app)
+    if previous is not None:
+        _unwrap_transforms(previous)
+        app.edgedb_memory_profile = None
+
+    if not app.config.edgedb_memory_profile:
+        return
+
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACE_FRAMES)
+
+    profile = app.edgedb_memory_profile = MemoryProfile()
+
+    transforms = [
+        *app.registry.get_transforms(),
+        *app.registry.get_post_transforms(),
+    ]
+    for cls in transforms:
+        if cls.__module__.startswith(__package__):
+            _wrap_transform(profile, cls)
+
+
+def start_read(app, docname, source):
+    profile = _get_profile(app)
+    if profile is not None:
+        profile.read_started = (docname, _traced())
+
+
+def finish_read(app, doctree):
+    profile = _get_profile(app)
+    if profile is None or profile.read_started is None:
+        return
+
+    docname, before = profile.read_started
+    if docname == app.env.docname:
+        profile.documents[docname] = max(_traced() - before, 0)
+    profile.read_started = None
+
+
+def snapshot_read(app, env):
+    profile = _get_profile(app)
+    if profile is not None:
+        profile.take_snapshot('read')
+
+
+def snapshot_resolve(app, doctree, docname):
+    profile = _get_profile(app)
+    if profile is not None and len(profile.snapshots) == 1:
+        profile.take_snapshot(f'resolve ({docname})')
+
+
+def write_report(app, exception):
+    profile = _get_profile(app)
+    if profile is None:
+        return
+
+    _unwrap_transforms(profile)
+    profile.take_snapshot('write')
+    app.edgedb_memory_profile = None
+
+    filename = os.path.join(app.outdir, app.config.edgedb_memory_profile)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, 'wt') as f:
+        f.write(profile.format_report())
+
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    logger.info(
+        f'memory profile written to {filename}; '
+        f'traced peak: {peak / 2**20:.1f} MiB')
+
+
+def setup_extension(app):
+    app.add_config_value('edgedb_memory_profile', None, '')
+
+    app.connect(shared.BUILD_STARTED_EVENT, start_profile)
+    app.connect('source-read', start_read)
+    app.connect('doctree-read', finish_read)
+    app.connect('env-updated', snapshot_read)
+    app.connect('doctree-resolved', snapshot_resolve)
+    app.connect('build-finished', write_report)
@@ -0,0 +1,200 @@
+"""
+=============
+Build metrics
+=============
+
+With "edgedb_metrics_file" set, every build writes its metrics in the
+OpenMetrics text format, suitable for the node-exporter textfile
+collector.  A relative path is relative to the output directory.  The
+file is replaced atomically at the end of the build, including failed
+builds.
+
+The metrics include the build duration (total and per phase), the
+number of documents read and written, eql objects by type, resolved
+and unresolved eql references, peak RSS of the build process and of
+its parallel workers, the size of the output and hit/miss counts of the
+extension caches.  Cache lookups done in parallel read workers are not
+counted.
+"""
+
+
+import os
+import os.path
+import resource
+import sys
+import tempfile
+import time
+
+from docutils import nodes as d_nodes
+
+from . import shared
+
+
+PREFIX = 'edgedb_docs'
+
+
+class BuildMetrics:
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.read_finished = None
+        self.docs_read = 0
+        self.docs_written = 0
+        self.xrefs_resolved = 0
+        self.xrefs_unresolved = 0
+
+
+def _get_metrics(app):
+    metrics = getattr(app, 'edgedb_metrics', None)
+    if metrics is None:
+        metrics = app.edgedb_metrics = BuildMetrics()
+    return metrics
+
+
+def _peak_rss(who):
+    rss = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def _dir_size(path):
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for fn in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, fn))
+            except OSError:
+                pass
+    return total
+
+
+def start_build(app):
+    shared.cache_stats.clear()
+    app.edgedb_metrics = BuildMetrics()
+
+
+def count_read(app, doctree):
+    _get_metrics(app).docs_read += 1
+
+
+def count_merged(app, env, docnames, other):
+    # Documents read by parallel workers; doctree-read is emitted
+    # in the worker processes.
+    _get_metrics(app).docs_read += len(docnames)
+
+
+def finish_read(app, env):
+    _get_metrics(app).read_finished = time.monotonic()
+
+
+def count_written(app, doctree, docname):
+    metrics = _get_metrics(app)
+    metrics.docs_written += 1
+    for node in doctree.traverse(d_nodes.reference):
+        if 'eql-type' in node:
+            metrics.xrefs_resolved += 1
+
+
+def count_missing(app, env, node, contnode):
+    if node.get('refdomain') == 'eql':
+        _get_metrics(app).xrefs_unresolved += 1
+
+
+def collect(app, exception):
+    """Return a list of (name, type, descr, [(labels, value)])."""
+    metrics = _get_metrics(app)
+    finished = time.monotonic()
+    read_finished = metrics.read_finished or finished
+
+    object_types = {}
+    eql_domain = app.env.get_domain('eql')
+    for _, _, type, _, _, _ in eql_domain.get_objects():
+        object_types[type] = object_types.get(type, 0) + 1
+
+    caches = sorted(shared.cache_stats.items())
+
+    return [
+        ('build_success', 'gauge', 'Whether the build succeeded.',
+         [({}, int(exception is None))]),
+        ('build_duration_seconds', 'gauge', 'Build duration by phase.',
+         [({'phase': 'total'}, finished - metrics.started),
+          ({'phase': 'read'}, read_finished - metrics.started),
+          ({'phase': 'write'}, finished - read_finished)]),
+        ('documents', 'gauge', 'Documents read, written and total.',
+         [({'state': 'read'}, metrics.docs_read),
+          ({'state': 'written'}, metrics.docs_written),
+          ({'state': 'total'}, len(app.env.all_docs))]),
+        ('eql_objects', 'gauge', 'eql objects by type.',
+         [({'type': type}, count)
+          for type, count in sorted(object_types.items())]),
+        ('eql_xrefs', 'gauge', 'eql references of the written documents.',
+         [({'state': 'resolved'}, metrics.xrefs_resolved),
+          ({'state': 'unresolved'}, metrics.xrefs_unresolved)]),
+        ('peak_rss_bytes', 'gauge', 'Peak resident set size.',
+         [({'process': 'main'}, _peak_rss(resource.RUSAGE_SELF)),
+          ({'process': 'workers'}, _peak_rss(resource.RUSAGE_CHILDREN))]),
+        ('output_bytes', 'gauge', 'Total size of the output directory.',
+         [({}, _dir_size(app.outdir))]),
+        ('cache_requests', 'gauge', 'Extension cache lookups.',
+         [({'cache': name, 'result': result}, count)
+          for (name, result), count in caches]),
+    ]
+
+
+def _escape(value, *, quote=True):
+    value = str(value).replace('\\', r'\\').replace('\n', r'\n')
+    return value.replace('"', r'\"') if quote else value
+
+
+def format_metrics(families, labels):
+    """Format metric *families* in the OpenMetrics text format.
+
+    *labels* are added to every sample.
+    """
+    lines = []
+    for name, type, descr, samples in families:
+        name = f'{PREFIX}_{name}'
+        lines.append(f'# TYPE {name} {type}')
+        lines.append(f'# HELP {name} {_escape(descr, quote=False)}')
+        for sample_labels, value in samples:
+            sample_labels = {**labels, **sample_labels}
+            label_str = ','.join(
+                f'{k}="{_escape(v)}"'
+                for k, v in sorted(sample_labels.items()))
+            if label_str:
+                label_str = f'{{{label_str}}}'
+            if isinstance(value, float):
+                value = f'{value:.6f}'
+            lines.append(f'{name}{label_str} {value}')
+    lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
+
+
+def write_metrics(app, exception):
+    filename = app.config.edgedb_metrics_file
+    if not filename:
+        return
+
+    filename = os.path.join(app.outdir, filename)
+    content = format_metrics(
+        collect(app, exception), {'builder': app.builder.name})
+
+    dirname = os.path.dirname(filename)
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=dirname)
+    with os.fdopen(fd, 'wt') as f:
+        f.write(content)
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, filename)
+
+
+def setup_extension(app):
+    app.add_config_value('edgedb_metrics_file', None, '')
+
+    app.connect(shared.BUILD_STARTED_EVENT, start_build)
+    app.connect('doctree-read', count_read)
+    app.connect('env-merge-info', count_merged)
+    app.connect('env-updated', finish_read)
+    app.connect('doctree-resolved', count_written)
+    app.connect('missing-reference', count_missing)
+    app.connect('build-finished', write_metrics)
@@ -0,0 +1,98 @@
+"""
+==========================
+Several builders, one read
+==========================
+
+Run several Sphinx builders over a single read phase:
+
+    $ python -m edgedb.sphinxext.multibuild -o _build doc html json text man
+
+The documents are read once (with the "dummy" builder, which writes
+nothing) into a doctree directory.  Then every requested builder runs in
+its own process against a private copy of it ("DOCTREEDIR.BUILDER"), so
+a builder that finds documents outdated and reads them again does not
+race the others writing the environment and the doctrees.  Normally
+nothing is outdated and the builders only resolve and write.
+"""
+
+
+import argparse
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import time
+
+from concurrent import futures
+
+
+def _copy_doctrees(doctreedir, builder):
+    copy = f'{doctreedir}.{builder}'
+    shutil.rmtree(copy, ignore_errors=True)
+    shutil.copytree(doctreedir, copy)
+    return copy
+
+
+def _run_builder(builder, srcdir, outdir, doctreedir, sphinx_opts):
+    cmd = [
+        sys.executable, '-m', 'sphinx',
+        '-b', builder,
+        '-d', doctreedir,
+        *sphinx_opts,
+        srcdir,
+        os.path.join(outdir, builder),
+    ]
+
+    started = time.monotonic()
+    proc = subprocess.run(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    return builder, proc.returncode, proc.stdout.decode(), \
+        time.monotonic() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m edgedb.sphinxext.multibuild',
+        description='Run several Sphinx builders over one read phase.')
+    parser.add_argument('srcdir')
+    parser.add_argument('builders', nargs='+')
+    parser.add_argument('-o', '--outdir', required=True)
+    parser.add_argument(
+        '-d', '--doctreedir', default=None,
+        help='doctree directory of the read phase '
+             '(default: OUTDIR/doctrees)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count())
+    parser.add_argument(
+        '-O', '--sphinx-opt', dest='sphinx_opts', action='append',
+        default=[], help='extra option to pass to sphinx-build')
+    args = parser.parse_args(argv)
+
+    doctreedir = args.doctreedir or os.path.join(args.outdir, 'doctrees')
+
+    results = [_run_builder(
+        'dummy', args.srcdir, args.outdir, doctreedir, args.sphinx_opts)]
+
+    if results[0][1] == 0:
+        with futures.ThreadPoolExecutor(
+                max_workers=max(args.jobs, 1)) as pool:
+            results.extend(pool.map(
+                lambda builder: _run_builder(
+                    builder, args.srcdir, args.outdir,
+                    _copy_doctrees(doctreedir, builder), args.sphinx_opts),
+                args.builders))
+
+    failed = False
+    for builder, returncode, output, elapsed in results:
+        status = 'ok' if returncode == 0 else 'FAILED'
+        phase = 'read' if builder == 'dummy' else 'write'
+        print(f'{builder} ({phase}): {status} in {elapsed:.1f}s')
+        if returncode != 0:
+            failed = True
+            print(output)
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,304 @@
+"""
+=================================
+Multi-version documentation build
+=================================
+
+Build documentation for several EdgeDB releases at once:
+
+    $ python -m edgedb.sphinxext.multiversion -o _build/versions \\
+        --store _build/store 0.5.0=doc 0.4.0=../edgedb-0.4/doc
+
+The first version is built alone and seeds a shared content-addressed
+store; the remaining versions are then built in parallel.  Every build
+publishes its doctrees to the store, keyed by a hash of the document
+source, the relevant config values, the extension code and the contents
+of the files the document depends on (includes, literalincludes, stdlib
+schema files).  A later build of any version restores documents with a
+matching key from the store instead of reading and parsing them again,
+so only documents that differ between versions are actually read.
+
+Dependencies are only known after a document has been read, so the
+store also records the dependency names of every published source
+("docs/<source key>.deps"); a restoring build hashes the files of
+those names in its own source directory to compute the full key.
+
+The driver also writes a "versions.json" file which is used to render
+the version switcher ("versions.html" sidebar template).
+"""
+
+
+import argparse
+import collections
+import functools
+import json
+import os
+import os.path
+import pickle
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from concurrent import futures
+
+from sphinx.util import logging as s_logging
+
+from . import fingerprint
+from . import shared
+
+
+ENV_PICKLE_FILENAME = 'environment.pickle'
+
+logger = s_logging.getLogger(__name__)
+
+
+def _source_key(env, docname, config_hash):
+    with open(env.doc2path(docname), 'rb') as f:
+        source = f.read()
+    key = fingerprint.document_fingerprint(
+        source, env.config, config_hash=config_hash)
+    return fingerprint.hash_bytes(f'{docname}\0{key}'.encode())
+
+
+def _doc_key(env, source_key, dependencies):
+    deps = fingerprint.dependencies_fingerprint(env.srcdir, dependencies)
+    return fingerprint.hash_bytes(f'{source_key}\0{deps}'.encode())
+
+
+def _read_dependencies(store, source_key):
+    try:
+        with open(os.path.join(store, 'docs', f'{source_key}.deps'),
+                  'rt') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _atomic_copy(src, dst):
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dst))
+    os.close(fd)
+    try:
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _atomic_write(dst, data):
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dst))
+    with os.fdopen(fd, 'wt') as f:
+        f.write(data)
+    os.replace(tmp, dst)
+
+
+def restore_docs(app, env, docnames):
+    store = app.config.edgedb_shared_store
+    if not store:
+        return
+
+    config_hash = fingerprint.config_fingerprint(app.config)
+
+    by_env = collections.defaultdict(list)  # envkey -> [(docname, key)]
+    for docname in docnames:
+        source_key = _source_key(env, docname, config_hash)
+        dependencies = _read_dependencies(store, source_key)
+        envkey = None
+        if dependencies is not None:
+            key = _doc_key(env, source_key, dependencies)
+            try:
+                with open(os.path.join(store, 'docs', f'{key}.env'),
+                          'rt') as f:
+                    envkey = f.read().strip()
+            except FileNotFoundError:
+                pass
+        if envkey is None:
+            shared.count_cache('shared_store', False)
+            continue
+        shared.count_cache('shared_store', True)
+        by_env[envkey].append((docname, key))
+
+    restored = []
+    for envkey, docs in by_env.items():
+        try:
+            with open(os.path.join(store, 'envs', f'{envkey}.pickle'),
+                      'rb') as f:
+                donor = pickle.load(f)
+        except Exception:
+            continue
+
+        names = []
+        for docname, key in docs:
+            if docname not in donor.all_docs:
+                continue
+            _atomic_copy(
+                os.path.join(store, 'docs', f'{key}.doctree'),
+                os.path.join(app.doctreedir, f'{docname}.doctree'))
+            names.append(docname)
+
+        env.merge_info_from(names, donor, app)
+        now = time.time()
+        for docname in names:
+            env.all_docs[docname] = now
+        restored.extend(names)
+
+    for docname in restored:
+        docnames.remove(docname)
+
+    if restored:
+        logger.info(
+            f'restored {len(restored)} documents from the shared store')
+
+
+def publish_docs(app, exception):
+    store = app.config.edgedb_shared_store
+    if not store or exception is not None:
+        return
+
+    env = app.env
+    env_pickle = os.path.join(app.doctreedir, ENV_PICKLE_FILENAME)
+    if not os.path.exists(env_pickle):
+        return
+
+    config_hash = fingerprint.config_fingerprint(app.config)
+    envkey = None
+
+    for docname in sorted(env.all_docs):
+        source_key = _source_key(env, docname, config_hash)
+        dependencies = sorted(env.dependencies.get(docname, ()))
+        key = _doc_key(env, source_key, dependencies)
+        keyfile = os.path.join(store, 'docs', f'{key}.env')
+        if os.path.exists(keyfile):
+            continue
+
+        if envkey is None:
+            envkey = fingerprint.hash_file(env_pickle)
+            stored_env = os.path.join(store, 'envs', f'{envkey}.pickle')
+            if not os.path.exists(stored_env):
+                _atomic_copy(env_pickle, stored_env)
+
+        _atomic_copy(
+            os.path.join(app.doctreedir, f'{docname}.doctree'),
+            os.path.join(store, 'docs', f'{key}.doctree'))
+        if _read_dependencies(store, source_key) != dependencies:
+            _atomic_write(
+                os.path.join(store, 'docs', f'{source_key}.deps'),
+                json.dumps(dependencies))
+        # The key file is written last: its presence means that
+        # the entry is complete.
+        _atomic_write(keyfile, envkey)
+
+
+@functools.lru_cache()
+def _load_versions(versions_file):
+    with open(versions_file, 'rt') as f:
+        return json.load(f)
+
+
+def add_versions_context(app, pagename, templatename, context, doctree):
+    versions_file = app.config.edgedb_versions_file
+    if not versions_file:
+        return
+
+    versions = _load_versions(versions_file)
+
+    current = app.config.edgedb_version_name or app.config.version
+    prefix = '../' * (pagename.count('/') + 1)
+    suffix = app.builder.out_suffix
+
+    context['edgedb_versions'] = [
+        {
+            'name': v['name'],
+            'url': f'{prefix}{v["path"]}{pagename}{suffix}',
+            'current': v['name'] == current,
+        }
+        for v in versions
+    ]
+
+
+def _build_version(name, srcdir, args, versions_file):
+    outdir = os.path.join(args.outdir, name)
+    doctreedir = os.path.join(args.outdir, '.doctrees', name)
+
+    cmd = [
+        sys.executable, '-m', 'sphinx',
+        '-b', args.builder,
+        '-d', doctreedir,
+        '-D', f'edgedb_shared_store={os.path.abspath(args.store)}',
+        '-D', f'edgedb_versions_file={versions_file}',
+        '-D', f'edgedb_version_name={name}',
+        *args.sphinx_opts,
+        srcdir,
+        outdir,
+    ]
+
+    started = time.monotonic()
+    proc = subprocess.run(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    return name, proc.returncode, proc.stdout.decode(), \
+        time.monotonic() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m edgedb.sphinxext.multiversion',
+        description='Build documentation for several versions at once.')
+    parser.add_argument(
+        'versions', nargs='+', metavar='NAME=SRCDIR',
+        help='version name and its documentation source directory; '
+             'the first version is built first and seeds the store')
+    parser.add_argument('-o', '--outdir', required=True)
+    parser.add_argument('--store', required=True)
+    parser.add_argument('-b', '--builder', default='html')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count())
+    parser.add_argument(
+        '-O', '--sphinx-opt', dest='sphinx_opts', action='append',
+        default=[], help='extra option to pass to sphinx-build')
+    args = parser.parse_args(argv)
+
+    versions = []
+    for spec in args.versions:
+        name, sep, srcdir = spec.partition('=')
+        if not sep or not name or not srcdir:
+            parser.error(f'invalid version specification: {spec!r}')
+        versions.append((name, os.path.abspath(srcdir)))
+
+    os.makedirs(args.outdir, exist_ok=True)
+    versions_file = os.path.abspath(
+        os.path.join(args.outdir, 'versions.json'))
+    _atomic_write(versions_file, json.dumps(
+        [{'name': name, 'path': f'{name}/'} for name, _ in versions],
+        indent=2))
+
+    results = [_build_version(*versions[0], args, versions_file)]
+    with futures.ThreadPoolExecutor(max_workers=max(args.jobs, 1)) as pool:
+        results.extend(pool.map(
+            lambda v: _build_version(*v, args, versions_file),
+            versions[1:]))
+
+    failed = False
+    for name, returncode, output, elapsed in results:
+        status = 'ok' if returncode == 0 else 'FAILED'
+        print(f'{name}: {status} in {elapsed:.1f}s')
+        if returncode != 0:
+            failed = True
+            print(output)
+
+    return 1 if failed else 0
+
+
+def setup_extension(app):
+    app.add_config_value('edgedb_shared_store', None, '')
+    app.add_config_value('edgedb_versions_file', None, '')
+    app.add_config_value('edgedb_version_name', None, '')
+
+    app.connect('env-before-read-docs', restore_docs)
+    app.connect('build-finished', publish_docs)
+    app.connect('html-page-context', add_versions_context)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,222 @@
+"""
+========================
+Cached global navigation
+========================
+
+Every page of the docs renders the global toctree in its sidebar
+("globaltoc.html").  By default Sphinx resolves and renders the whole
+toctree again for every page, which makes the write phase quadratic in
+the number of pages.
+
+With "edgedb_cached_toctree = True" the toctree() template function is
+replaced by a cached renderer: the full (uncollapsed) toctree is
+rendered once per build and split into chunks around its lists, list
+items and links.  Every page gets a copy with link URLs made relative
+to the page and, as in Sphinx, the entries on the path to the page
+marked with the "current" class, the lists deeper than "maxdepth"
+removed and, unless "collapse=False" is passed, the sub-lists of
+entries off that path removed as well.
+"""
+
+
+import posixpath
+import re
+
+from sphinx import addnodes as s_nodes
+from sphinx.environment.adapters import toctree as s_toctree
+from sphinx.util import osutil as s_osutil
+
+from . import shared
+
+
+_tag_re = re.compile(r'''(?x)
+    <(?P<ul>ul)(?:\sclass="(?P<ul_cls>[^"]*)")?>
+    | (?P<ul_end></ul>\n?)
+    | <(?P<li>li)(?:\sclass="(?P<li_cls>[^"]*)")?>
+    | (?P<li_end></li>)
+    | <a\sclass="(?P<a_cls>[^"]*)"\shref="(?P<href>[^"]*)">
+''')
+
+_absolute_re = re.compile(r'^(?:[a-z][a-z0-9+.-]*:|/)')
+
+
+def _strip_current(classes):
+    if not classes:
+        return ''
+    return ' '.join(c for c in classes.split() if c != 'current')
+
+
+def _add_class(classes, cls):
+    return f'{classes} {cls}' if classes else cls
+
+
+class CachedToctree:
+
+    def __init__(self, html, base_uri):
+        """Split rendered toctree *html* into text chunks and tags.
+
+        Link URLs in *html* are relative to *base_uri*; they are stored
+        relative to the output root.
+        """
+        self.chunks = []
+        # (kind, classes, indexes of the enclosing ul and li tags,
+        #  (root uri, anchor, href) for links or depth for lists)
+        self.tags = []
+        self.ends = {}  # ul tag index -> </ul> tag index
+        self.by_uri = {}  # root-relative uri -> [link tag index]
+
+        base_dir = posixpath.dirname(base_uri)
+        stack = []
+        pos = 0
+        for m in _tag_re.finditer(html):
+            self.chunks.append(html[pos:m.start()])
+            pos = m.end()
+            idx = len(self.tags)
+
+            if m.group('ul_end') or m.group('li_end'):
+                start = stack.pop()
+                if m.group('ul_end'):
+                    self.ends[start] = idx
+                self.tags.append(('end', m.group(0), (), None))
+            elif m.group('ul') or m.group('li'):
+                kind = m.group('ul') or m.group('li')
+                # Drop "current" classes of the page the toctree was
+                # rendered for; they are set in render() for every page.
+                classes = _strip_current(m.group(f'{kind}_cls'))
+                depth = sum(self.tags[i][0] == 'ul' for i in stack) + 1
+                self.tags.append((kind, classes, tuple(stack), depth))
+                stack.append(idx)
+            else:
+                href = m.group('href')
+                uri, sep, anchor = href.partition('#')
+                if uri and not _absolute_re.match(uri):
+                    trailing = '/' if uri.endswith('/') else ''
+                    uri = posixpath.normpath(
+                        posixpath.join(base_dir, uri)) + trailing
+                elif not uri:
+                    uri = base_uri
+                else:
+                    uri = None
+
+                if uri is not None:
+                    self.by_uri.setdefault(uri, []).append(idx)
+                self.tags.append((
+                    'a', _strip_current(m.group('a_cls')), tuple(stack),
+                    (uri, sep + anchor, href)))
+
+        self.chunks.append(html[pos:])
+
+    def render(self, page_uri, *, collapse=True, maxdepth=0):
+        # Like Sphinx: all entries linking to the page, including its
+        # sections, are expanded; the path to the page itself is
+        # marked "current".
+        expanded = set()
+        current = set()
+        for idx in self.by_uri.get(page_uri, ()):
+            _, _, parents, (_, anchor, _) = self.tags[idx]
+            expanded.update(parents)
+            if not anchor:
+                current.add(idx)
+                current.update(parents)
+
+        parts = []
+        idx = 0
+        while idx < len(self.tags):
+            parts.append(self.chunks[idx])
+            kind, classes, parents, extra = self.tags[idx]
+
+            if kind == 'end':
+                parts.append(classes)
+            elif kind == 'a':
+                uri, anchor, href = extra
+                if uri is not None:
+                    href = s_osutil.relative_uri(page_uri, uri) + anchor
+                    href = href or '#'
+                if idx in current:
+                    classes = f'current {classes}'.rstrip()
+                parts.append(f'<a class="{classes}" href="{href}">')
+            else:
+                if kind == 'ul' and (
+                        (maxdepth > 0 and extra > maxdepth) or
+                        (collapse and parents and
+                         parents[-1] not in expanded)):
+                    # Skip the nested list with its closing tag.
+                    idx = self.ends[idx] + 1
+                    continue
+                if idx in current:
+                    classes = _add_class(classes, 'current')
+                if classes:
+                    parts.append(f'<{kind} class="{classes}">')
+                else:
+                    parts.append(f'<{kind}>')
+
+            idx += 1
+
+        parts.append(self.chunks[-1])
+        return ''.join(parts)
+
+
+def _resolve_toctrees(builder, docname, *, maxdepth=0, **kwargs):
+    """Return [(CachedToctree, maxdepth)] for the toctrees of *docname*.
+
+    Like TocTree.get_toctree_for(), but the toctrees are not pruned to
+    their maxdepth, as the "current" classes must be set first.
+    """
+    kwargs.setdefault('includehidden', False)
+    base_uri = builder.get_target_uri(docname)
+    adapter = s_toctree.TocTree(builder.env)
+
+    toctrees = []
+    doctree = builder.env.get_doctree(docname)
+    for node in doctree.traverse(s_nodes.toctree):
+        resolved = adapter.resolve(
+            docname, builder, node, prune=True, maxdepth=-1,
+            collapse=False, **kwargs)
+        if resolved:
+            toctrees.append((
+                CachedToctree(
+                    builder.render_partial(resolved)['fragment'], base_uri),
+                maxdepth or node.get('maxdepth', -1)))
+    return toctrees
+
+
+def _get_cache(app):
+    cache = getattr(app.builder, 'edgedb_toctree_cache', None)
+    if cache is None:
+        cache = app.builder.edgedb_toctree_cache = {}
+    return cache
+
+
+def install_toctree(app, pagename, templatename, context, doctree):
+    if not app.config.edgedb_cached_toctree or 'toctree' not in context:
+        return
+
+    builder = app.builder
+    cache = _get_cache(app)
+
+    def toctree(*, collapse=True, **kwargs):
+        key = tuple(sorted(kwargs.items()))
+        cached = cache.get(key)
+        shared.count_cache('toctree', cached is not None)
+        if cached is None:
+            cached = cache[key] = _resolve_toctrees(
+                builder, app.config.master_doc, **kwargs)
+
+        page_uri = builder.get_target_uri(pagename)
+        return ''.join(
+            toctree.render(page_uri, collapse=collapse, maxdepth=maxdepth)
+            for toctree, maxdepth in cached)
+
+    context['toctree'] = toctree
+
+
+def reset_cache(app, env):
+    # The toctree can change only during the read phase.
+    app.builder.edgedb_toctree_cache = {}
+
+
+def setup_extension(app):
+    app.add_config_value('edgedb_cached_toctree', False, 'html')
+
+    app.connect('env-updated', reset_cache)
+    app.connect('html-page-context', install_toctree)
@@ -0,0 +1,323 @@
+"""
+============
+Page writing
+============
+
+With "edgedb_write_if_changed = True" the HTML builder writes every
+page to a temporary file first and compares its content hash with the
+hash recorded for the page by the previous build.  Pages with unchanged
+content are left untouched on disk, so their mtimes are preserved and
+rsync or CDN syncs do not pick them up.
+
+The hashes are kept in ".edgedb-pages.json" in the output directory,
+together with the list of pages that actually changed in the last
+build.  The hashes are those of the pages as they were written; pages
+written by parallel write processes (-j) are recorded by the workers
+in ".edgedb-pages.json.<pid>" side files, which the main process
+merges at the end of the build.
+
+With "edgedb_write_threads = N" rendered pages are handed to a pool of
+N threads that encode and write them to disk while the next page is
+rendered.  At most a few pages per thread are queued at any time; when
+the queue is full, rendering waits for the writers.  The time spent in
+the writer threads and the time rendering had to wait for them are
+reported at the end of the build.  Pages written by parallel write
+processes (-j) are written synchronously.  The serializing builders
+(json, pickle) do not render templates, so their pages are always
+written synchronously.
+"""
+
+
+import glob
+import json
+import os
+import os.path
+import threading
+import time
+
+from concurrent import futures
+
+from sphinx.builders import html as s_html
+from sphinx.util import logging as s_logging
+
+try:
+    from sphinxcontrib.serializinghtml import SerializingHTMLBuilder
+except ImportError:
+    # Sphinx < 2.0
+    SerializingHTMLBuilder = s_html.SerializingHTMLBuilder
+
+from . import fingerprint
+from . import shared
+
+
+MANIFEST_FILENAME = '.edgedb-pages.json'
+
+# Maximum number of queued pages per writer thread.
+QUEUE_DEPTH = 4
+
+logger = s_logging.getLogger(__name__)
+
+
+class PageWriter:
+
+    def __init__(self, builder, *, write_if_changed=True, threads=0):
+        self.builder = builder
+        self.handle_page = builder.handle_page
+        self.write_if_changed = write_if_changed
+        self.threads = threads
+        self.manifest_file = os.path.join(builder.outdir, MANIFEST_FILENAME)
+
+        self.pid = os.getpid()
+        self.pool = None
+        self.rendered = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Set up the state of a build."""
+        self.flush()
+
+        try:
+            with open(self.manifest_file, 'rt') as f:
+                self.hashes = json.load(f)['pages']
+        except (OSError, ValueError, KeyError):
+            self.hashes = {}
+        self.written = {}  # relname -> hash of the pages written
+        for fn in self._side_files():
+            os.unlink(fn)
+
+        self.errors = []
+        self.io_time = 0.0
+        self.wait_time = 0.0
+
+        if self.threads > 0:
+            self.pool = futures.ThreadPoolExecutor(max_workers=self.threads)
+            self.slots = threading.BoundedSemaphore(
+                self.threads * QUEUE_DEPTH)
+
+            self.render = self.builder.templates.render
+            self.builder.templates.render = self._render
+
+    def __call__(self, pagename, addctx, templatename='page.html',
+                 outfilename=None, event_arg=None):
+        if outfilename is None:
+            outfilename = self.builder.get_outfilename(pagename)
+
+        if self.pool is not None and os.getpid() == self.pid:
+            self._queue_page(
+                pagename, addctx, templatename, outfilename, event_arg)
+        elif self.write_if_changed:
+            self._write_page(
+                pagename, addctx, templatename, outfilename, event_arg)
+        else:
+            self.handle_page(pagename, addctx, templatename,
+                             outfilename=outfilename, event_arg=event_arg)
+
+    def _side_files(self):
+        return glob.glob(f'{glob.escape(self.manifest_file)}.*')
+
+    def _record(self, outfilename, digest):
+        relname = os.path.relpath(outfilename, self.builder.outdir)
+        if os.getpid() == self.pid:
+            with self.lock:
+                self.written[relname] = digest
+        else:
+            # A parallel write process: its state is lost when it
+            # exits, so the hash is passed on through a side file.
+            line = json.dumps([relname, digest])
+            with open(f'{self.manifest_file}.{os.getpid()}', 'at') as f:
+                f.write(f'{line}\n')
+
+    def _render(self, template, context):
+        output = self.render(template, context)
+        if self.rendered is not None:
+            # Called from _queue_page(): the page is written by the
+            # pool, so Sphinx gets nothing to write.
+            self.rendered = (output, context.get('encoding', 'utf-8'))
+            return ''
+        return output
+
+    def _write_page(self, pagename, addctx, templatename, outfilename,
+                    event_arg):
+        tmpname = f'{outfilename}.{os.getpid()}.tmp'
+        self.handle_page(pagename, addctx, templatename,
+                         outfilename=tmpname, event_arg=event_arg)
+        if not os.path.exists(tmpname):
+            return
+
+        relname = os.path.relpath(outfilename, self.builder.outdir)
+        digest = fingerprint.hash_file(tmpname)
+        if (self.hashes.get(relname) == digest and
+                os.path.exists(outfilename)):
+            os.unlink(tmpname)
+        else:
+            os.replace(tmpname, outfilename)
+        self._record(outfilename, digest)
+
+    def _queue_page(self, pagename, addctx, templatename, outfilename,
+                    event_arg):
+        self.rendered = ()
+        try:
+            self.handle_page(pagename, addctx, templatename,
+                             outfilename=os.devnull, event_arg=event_arg)
+            rendered = self.rendered
+        finally:
+            self.rendered = None
+
+        if not rendered:
+            # The page was not rendered through the templates; let
+            # the builder write it.
+            if self.write_if_changed:
+                self._write_page(
+                    pagename, addctx, templatename, outfilename, event_arg)
+            else:
+                self.handle_page(pagename, addctx, templatename,
+                                 outfilename=outfilename, event_arg=event_arg)
+            return
+
+        started = time.perf_counter()
+        self.slots.acquire()
+        self.wait_time += time.perf_counter() - started
+
+        future = self.pool.submit(self._write_output, outfilename, *rendered)
+        future.add_done_callback(lambda f: self.slots.release())
+
+    def _write_output(self, outfilename, output, encoding):
+        started = time.perf_counter()
+        try:
+            data = output.encode(encoding, 'xmlcharrefreplace')
+
+            relname = os.path.relpath(outfilename, self.builder.outdir)
+            digest = fingerprint.hash_bytes(data)
+            if not (self.write_if_changed and
+                    self.hashes.get(relname) == digest and
+                    os.path.exists(outfilename)):
+                os.makedirs(os.path.dirname(outfilename), exist_ok=True)
+                tmpname = f'{outfilename}.{threading.get_ident()}.tmp'
+                with open(tmpname, 'wb') as f:
+                    f.write(data)
+                os.replace(tmpname, outfilename)
+            self._record(outfilename, digest)
+        except Exception as ex:
+            with self.lock:
+                self.errors.append((outfilename, ex))
+        finally:
+            with self.lock:
+                self.io_time += time.perf_counter() - started
+
+    def flush(self):
+        """Wait until all queued pages are written."""
+        if self.pool is None:
+            return
+
+        started = time.perf_counter()
+        self.pool.shutdown(wait=True)
+        self.wait_time += time.perf_counter() - started
+        self.pool = None
+        self.builder.templates.render = self.render
+
+        for outfilename, ex in self.errors:
+            logger.warning(f'error writing file {outfilename}: {ex}')
+        self.errors = []
+
+    def finish(self):
+        """Record hashes of the pages written by this build.
+
+        Pages that were not written keep their recorded hash; pages
+        that are neither written nor recorded (copied by other code)
+        are hashed.
+        """
+        outdir = self.builder.outdir
+        suffix = self.builder.out_suffix
+
+        for fn in self._side_files():
+            with open(fn, 'rt') as f:
+                for line in f:
+                    relname, digest = json.loads(line)
+                    self.written[relname] = digest
+            os.unlink(fn)
+
+        changed = []
+        hashes = {}
+        for dirpath, dirnames, filenames in os.walk(outdir):
+            for fn in filenames:
+                if not fn.endswith(suffix):
+                    continue
+                path = os.path.join(dirpath, fn)
+                relname = os.path.relpath(path, outdir)
+                digest = self.written.get(relname)
+                if digest is None:
+                    digest = self.hashes.get(relname)
+                if digest is None:
+                    digest = fingerprint.hash_file(path)
+                hashes[relname] = digest
+                if self.hashes.get(relname) != digest:
+                    changed.append(relname)
+
+        with open(self.manifest_file, 'wt') as f:
+            json.dump({'pages': hashes, 'changed': sorted(changed)}, f,
+                      indent=0, sort_keys=True)
+
+        self.hashes = hashes
+        return sorted(changed)
+
+
+def install_writer(app):
+    config = app.config
+    if not isinstance(app.builder, s_html.StandaloneHTMLBuilder):
+        return
+
+    builder = app.builder
+    threads = config.edgedb_write_threads
+    if builder.format != 'html' or isinstance(builder, SerializingHTMLBuilder):
+        # Pages are written by the writer threads only when they are
+        # rendered with builder.templates.
+        threads = 0
+    if not (config.edgedb_write_if_changed or threads):
+        return
+
+    writer = app.edgedb_page_writer = PageWriter(
+        builder, write_if_changed=config.edgedb_write_if_changed,
+        threads=threads)
+    builder.handle_page = writer
+
+    # Pages are rendered until the end of builder.finish() (indices,
+    # search page); they must all be on disk before "build-finished".
+    finish = builder.finish
+
+    def finish_and_flush():
+        try:
+            finish()
+        finally:
+            writer.flush()
+
+    builder.finish = finish_and_flush
+
+
+def start_writer(app):
+    writer = getattr(app, 'edgedb_page_writer', None)
+    if writer is not None:
+        writer.start()
+
+
+def report_changes(app, exception):
+    writer = getattr(app, 'edgedb_page_writer', None)
+    if writer is None or exception is not None:
+        return
+
+    if writer.write_if_changed:
+        changed = writer.finish()
+        logger.info(f'{len(changed)} pages changed on disk')
+
+    if writer.threads:
+        logger.info(
+            f'page writer: {writer.io_time:.2f}s of I/O in writer threads, '
+            f'rendering waited {writer.wait_time:.2f}s for the writers')
+
+
+def setup_extension(app):
+    app.add_config_value('edgedb_write_if_changed', False, '')
+    app.add_config_value('edgedb_write_threads', 0, '')
+
+    app.connect('builder-inited', install_writer)
+    app.connect(shared.BUILD_STARTED_EVENT, start_writer)
+    app.connect('build-finished', report_changes)
@@ -0,0 +1,109 @@
+"""
+========================
+React component manifest
+========================
+
+The extension records which React components (".. eql:react-element::")
+are used by every document.  HTML builds write a "react-manifest.json"
+file mapping components to pages and pages to components, which lets
+the front end split its bundles per component.
+
+If the "edgedb_react_module_url" config value is set to a URL template
+relative to the output root (for instance, "_static/react/{name}.js"),
+every page also gets a <link rel="modulepreload"> hint for each
+component it uses, and only for those.
+"""
+
+
+import html
+import json
+import os.path
+
+from docutils import nodes as d_nodes
+
+
+MANIFEST_FILENAME = 'react-manifest.json'
+
+
+def _get_elements(env):
+    if not hasattr(env, 'edgedb_react_elements'):
+        env.edgedb_react_elements = {}  # docname -> [component]
+    return env.edgedb_react_elements
+
+
+def collect_elements(app, doctree):
+    components = []
+    for node in doctree.traverse(d_nodes.container):
+        name = node.get('react-element')
+        if name and name not in components:
+            components.append(name)
+
+    elements = _get_elements(app.env)
+    if components:
+        elements[app.env.docname] = components
+    else:
+        elements.pop(app.env.docname, None)
+
+
+def purge_elements(app, env, docname):
+    _get_elements(env).pop(docname, None)
+
+
+def merge_elements(app, env, docnames, other):
+    elements = _get_elements(env)
+    other_elements = _get_elements(other)
+    for docname in docnames:
+        if docname in other_elements:
+            elements[docname] = other_elements[docname]
+
+
+def add_preload_hints(app, pagename, templatename, context, doctree):
+    url = app.config.edgedb_react_module_url
+    if not url:
+        return
+
+    components = _get_elements(app.env).get(pagename)
+    if not components:
+        return
+
+    pathto = context['pathto']
+    hints = []
+    for name in components:
+        href = html.escape(pathto(url.format(name=name), 1), quote=True)
+        hints.append(f'<link rel="modulepreload" href="{href}" />\n')
+    context['metatags'] = context.get('metatags', '') + ''.join(hints)
+
+
+def write_manifest(app, exception):
+    if exception is not None or app.builder.format != 'html':
+        return
+
+    elements = _get_elements(app.env)
+    components = {}
+    for docname in sorted(elements):
+        for name in elements[docname]:
+            components.setdefault(name, []).append(docname)
+
+    manifest = json.dumps({
+        'components': {name: components[name] for name in sorted(components)},
+        'pages': {docname: elements[docname] for docname in sorted(elements)},
+    }, indent=2)
+
+    filename = os.path.join(app.outdir, MANIFEST_FILENAME)
+    if os.path.exists(filename):
+        with open(filename, 'rt') as f:
+            if f.read() == manifest:
+                return
+
+    with open(filename, 'wt') as f:
+        f.write(manifest)
+
+
+def setup_extension(app):
+    app.add_config_value('edgedb_react_module_url', None, 'html')
+
+    app.connect('doctree-read', collect_elements)
+    app.connect('env-purge-doc', purge_elements)
+    app.connect('env-merge-info', merge_elements)
+    app.connect('html-page-context', add_preload_hints)
+    app.connect('build-finished', write_manifest)
@@ -0,0 +1,121 @@
+"""
+=========================
+Cost-aware parallel reads
+=========================
+
+With parallel reads (-j N) Sphinx splits the documents to read into
+fixed-size chunks in the order they are given, and workers pick up the
+chunks one by one.  A few heavy documents (statement and DDL pages)
+landing in one chunk keep one worker busy long after the others are
+done.
+
+The extension records how long every document took to read.  When
+reading in parallel, documents are assigned to chunks longest first,
+each to the chunk with the lowest total cost so far (the "longest
+processing time first" rule), and the chunks are ordered by their total
+cost, so the most expensive chunks start first.  Documents without a
+recorded cost are estimated from their source size.
+"""
+
+
+import os.path
+import time
+
+from sphinx.util import parallel as s_parallel
+
+
+def _get_costs(env):
+    if not hasattr(env, 'edgedb_read_costs'):
+        env.edgedb_read_costs = {}  # docname -> seconds
+    return env.edgedb_read_costs
+
+
+def start_timer(app, docname, source):
+    app.edgedb_read_started = (docname, time.perf_counter())
+
+
+def stop_timer(app, doctree):
+    docname, started = getattr(app, 'edgedb_read_started', (None, 0))
+    if docname == app.env.docname:
+        _get_costs(app.env)[docname] = time.perf_counter() - started
+
+
+def merge_costs(app, env, docnames, other):
+    costs = _get_costs(env)
+    other_costs = _get_costs(other)
+    for docname in docnames:
+        if docname in other_costs:
+            costs[docname] = other_costs[docname]
+
+
+def estimate_costs(env, docnames):
+    costs = _get_costs(env)
+
+    # Documents that are gone are not read again.
+    for docname in list(costs):
+        if docname not in env.found_docs:
+            del costs[docname]
+
+    sizes = {}
+    for docname in docnames:
+        try:
+            sizes[docname] = os.path.getsize(env.doc2path(docname))
+        except OSError:
+            sizes[docname] = 0
+
+    known = [docname for docname in docnames if docname in costs]
+    known_size = sum(sizes[docname] for docname in known)
+    if known_size:
+        per_byte = sum(costs[docname] for docname in known) / known_size
+    else:
+        per_byte = 1.0
+
+    return {
+        docname: costs.get(docname, sizes[docname] * per_byte)
+        for docname in docnames
+    }
+
+
+def schedule(docnames, costs, nproc):
+    """Return *docnames* reordered for make_chunks(docnames, nproc)."""
+    chunk_sizes = [
+        len(chunk) for chunk in s_parallel.make_chunks(docnames, nproc)]
+
+    chunks = [[] for _ in chunk_sizes]
+    totals = [0.0] * len(chunks)
+    for docname in sorted(docnames, key=lambda d: (-costs[d], d)):
+        idx = min(
+            (i for i in range(len(chunks))
+             if len(chunks[i]) < chunk_sizes[i]),
+            key=lambda i: totals[i])
+        chunks[idx].append(docname)
+        totals[idx] += costs[docname]
+
+    # make_chunks() slices the list in order, so the sizes of chunks
+    # must be kept in their original order.
+    order = sorted(range(len(chunks)), key=lambda i: -totals[i])
+    for i, size in enumerate(chunk_sizes):
+        for j in order:
+            if len(chunks[j]) == size:
+                order.remove(j)
+                yield from chunks[j]
+                break
+
+
+def reorder_docs(app, env, docnames):
+    if not app.config.edgedb_schedule_reads or app.parallel <= 1:
+        return
+    if len(docnames) <= app.parallel:
+        return
+
+    costs = estimate_costs(env, docnames)
+    docnames[:] = list(schedule(docnames, costs, app.parallel))
+
+
+def setup_extension(app):
+    app.add_config_value('edgedb_schedule_reads', False, '')
+
+    app.connect('source-read', start_timer)
+    app.connect('doctree-read', stop_timer)
+    app.connect('env-merge-info', merge_costs)
+    app.connect('env-before-read-docs', reorder_docs)
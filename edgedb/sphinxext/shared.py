@@ -1,8 +1,23 @@
+import collections
+
 from docutils import nodes as d_nodes
 from docutils import utils as d_utils
 from docutils.parsers.rst import roles as d_roles
 
 
+# (cache name, 'hit' or 'miss') -> count; reported by the metrics module.
+cache_stats = collections.Counter()
+
+# Emitted after "builder-inited" and, by the build daemon, before every
+# further build with the same application; handlers set up the state
+# of a single build.
+BUILD_STARTED_EVENT = 'edgedb-build-started'
+
+
+def count_cache(name, hit):
+    cache_stats[name, 'hit' if hit else 'miss'] += 1
+
+
 class EdgeSphinxExtensionError(Exception):
     pass
 
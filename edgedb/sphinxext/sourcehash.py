@@ -0,0 +1,120 @@
+"""
+=============================
+Content-hash change detection
+=============================
+
+Sphinx decides which documents to read again by comparing file mtimes
+with the time of the previous read.  Checkouts and "touch" reset mtimes,
+which turns every build into a full rebuild.
+
+With "edgedb_hash_sources = True" the extension records, for every
+document read, a hash of its source, of all files it depends on
+(includes, literalincludes, stdlib schema files and so on), of the
+extension code and of the config values that affect reading.  Documents
+that Sphinx considers outdated by mtime, but whose hash has not changed,
+are not read again.
+"""
+
+
+import time
+
+from sphinx.util import logging as s_logging
+
+from . import fingerprint
+from . import shared
+
+
+logger = s_logging.getLogger(__name__)
+
+
+def _get_hashes(env):
+    if not hasattr(env, 'edgedb_source_hashes'):
+        env.edgedb_source_hashes = {}  # docname -> hash
+    return env.edgedb_source_hashes
+
+
+def source_hash(env, docname, config_hash):
+    """Return a hash of the source of *docname* and its dependencies."""
+    with open(env.doc2path(docname), 'rb') as f:
+        source = f.read()
+
+    key = fingerprint.document_fingerprint(
+        source, env.config, config_hash=config_hash)
+    deps = fingerprint.dependencies_fingerprint(
+        env.srcdir, env.dependencies.get(docname, ()))
+    return fingerprint.hash_bytes(f'{key}\0{deps}'.encode())
+
+
+def _config_hash(app):
+    # Computed once per build, in filter_outdated(); parallel read
+    # processes inherit it.
+    if getattr(app, '_edgedb_config_hash', None) is None:
+        app._edgedb_config_hash = fingerprint.config_fingerprint(app.config)
+    return app._edgedb_config_hash
+
+
+def record_hash(app, doctree):
+    env = app.env
+    _get_hashes(env)[env.docname] = source_hash(
+        env, env.docname, _config_hash(app))
+
+
+def purge_hash(app, env, docname):
+    _get_hashes(env).pop(docname, None)
+
+
+def merge_hashes(app, env, docnames, other):
+    hashes = _get_hashes(env)
+    other_hashes = _get_hashes(other)
+    for docname in docnames:
+        if docname in other_hashes:
+            hashes[docname] = other_hashes[docname]
+
+
+def filter_outdated(app, env, added, changed, removed):
+    if not app.config.edgedb_hash_sources:
+        return []
+
+    app._edgedb_config_hash = None
+    hashes = _get_hashes(env)
+    config_hash = _config_hash(app)
+
+    unchanged = []
+    for docname in changed:
+        recorded = hashes.get(docname)
+        if recorded is None:
+            continue
+        try:
+            current = source_hash(env, docname, config_hash)
+        except OSError:
+            continue
+        shared.count_cache('source_hash', current == recorded)
+        if current == recorded:
+            unchanged.append(docname)
+
+    # Mark the documents as read now, so that the next build does
+    # not hash them again unless they are modified.
+    now = time.time()
+    for docname in unchanged:
+        changed.discard(docname)
+        env.all_docs[docname] = now
+
+    if unchanged:
+        logger.info(
+            f'{len(unchanged)} documents with a new mtime are unchanged')
+
+    return []
+
+
+def connect_hashing(app):
+    if app.config.edgedb_hash_sources:
+        app.connect('doctree-read', record_hash)
+
+
+def setup_extension(app):
+    app.add_config_value('edgedb_hash_sources', False, '')
+
+    app.connect('builder-inited', connect_hashing)
+    app.connect('env-purge-doc', purge_hash)
+    app.connect('env-merge-info', merge_hashes)
+    app.connect('env-get-outdated', filter_outdated)
@@ -0,0 +1,487 @@
+"""
+======================
+Source-level eql index
+======================
+
+Extracts the declarations and references of the :eql: domain from
+reStructuredText sources without running Sphinx or docutils:
+
+* ".. eql:function::", ".. eql:type::", ".. eql:operator::",
+  ".. eql:constraint::" and ".. eql:keyword::" directives, with the
+  fields and the first paragraph of their content;
+
+* sections marked with an ":eql-statement:" field;
+
+* :eql:* role usages, with the target as XRefRole would extract it
+  (explicit titles, backslash escapes and "!" are handled).
+
+Sources are lexed line by line.  Literal blocks, code blocks, comments
+and inline literals are skipped.  Names are extracted from signatures
+without the EdgeQL parser, so a function or constraint signature the
+parser would reject still gets an entry; objects generated by
+".. eql:stdlib::" are not seen.
+
+Line numbers and columns are 0-based.  SourceIndex keeps the scans of
+a set of files and maps targets ("type::std::int64") to declarations;
+a file can be rescanned on its own.
+"""
+
+
+import collections
+import re
+
+
+Declaration = collections.namedtuple(
+    'Declaration',
+    ['target', 'objtype', 'signature', 'filename', 'lineno',
+     'fields', 'has_content', 'paragraph', 'paragraph_lineno'])
+
+# fields: ((name, lineno, col), ...) of the field list that starts the
+# content; paragraph: the first paragraph of the content, or None if
+# the content does not start with one.
+
+Reference = collections.namedtuple(
+    'Reference',
+    ['role', 'target', 'filename', 'lineno', 'col', 'end_lineno', 'end_col'])
+
+Problem = collections.namedtuple('Problem', ['filename', 'lineno', 'message'])
+
+SourceScan = collections.namedtuple(
+    'SourceScan', ['filename', 'declarations', 'references', 'problems'])
+
+
+DECLARING_DIRECTIVES = frozenset(
+    {'function', 'type', 'operator', 'constraint', 'keyword'})
+
+LITERAL_DIRECTIVES = frozenset({
+    'code', 'code-block', 'sourcecode', 'literalinclude', 'raw', 'math',
+    'eql:synopsis', 'eql:migration',
+})
+
+_directive_re = re.compile(
+    r'^(?P<indent>\s*)\.\.\s+(?P<name>[\w:.-]+)::(?:\s+(?P<arg>.*))?$')
+_explicit_markup_re = re.compile(r'^\s*\.\.(?:\s|$)')
+_target_re = re.compile(r'^\s*\.\.\s+(?:_|\[|\|)')
+_underline_re = re.compile(r'^([!-/:-@\[-`{-~])\1+\s*$')
+_field_re = re.compile(r'^\s*:(?P<name>[^:`\s][^:`]*):(?:\s|$)')
+_not_paragraph_re = re.compile(
+    r'^(?:[-*+](?:\s|$)|#\.\s|\d+[.)]\s|\.\.(?:\s|$)|::$|>>>|\|\s|\+[-=])')
+_role_start_re = re.compile(r':eql:(?P<role>[\w-]+):`')
+_inline_literal_re = re.compile(r'``.+?``')
+_explicit_title_re = re.compile(r'^(.+?)\s*(?<!\x00)<([^<]*?)>$', re.DOTALL)
+_symbol_re = re.compile(r'\s*([\w:]+)')
+
+_role_text_re = re.compile(
+    r':(?P<role>[\w:-]+):`(?P<text>(?:[^`\\]|\\.)*)`')
+_markup_re = re.compile(
+    r'``(?P<literal>.+?)``|\*\*(?P<strong>.+?)\*\*|\*(?P<em>.+?)\*|'
+    r'`(?P<link>[^`<]+?)\s*(?:<[^`]*>)?`__?')
+
+
+def _unescape(text):
+    # Like docutils.utils.unescape() on a text where backslash escapes
+    # have been replaced with NUL characters.
+    return text.replace('\x00 ', '').replace('\x00\n', '').replace('\x00', '')
+
+
+def parse_role_text(text):
+    """Return (title, target) of a role's text, or None for "!target"."""
+    text = re.sub(r'\\(.)', '\x00\\1', text, flags=re.DOTALL)
+    if text.startswith('!'):
+        return None
+
+    m = _explicit_title_re.match(text)
+    if m:
+        title, target = m.group(1), m.group(2)
+    else:
+        title = target = text
+    return _unescape(title), ' '.join(_unescape(target).split())
+
+
+def plain_text(text):
+    """Approximate the text of a paragraph with inline markup removed."""
+    def role_title(m):
+        parsed = parse_role_text(m.group('text'))
+        title = parsed[0] if parsed else m.group('text')[1:]
+        if m.group('role') == 'eql:func' and '<' not in m.group('text'):
+            title += '()'
+        return title
+
+    text = _role_text_re.sub(role_title, text)
+    text = _markup_re.sub(
+        lambda m: next(g for g in m.groups() if g is not None), text)
+    return _unescape(re.sub(r'\\(.)', '\x00\\1', text))
+
+
+def directive_name(line):
+    """Return the name of the directive *line* starts, or None."""
+    m = _directive_re.match(line)
+    return m.group('name') if m else None
+
+
+def open_role(text):
+    """Return the name of the role *text* ends inside of, or None."""
+    m = None
+    for m in _role_start_re.finditer(text):
+        pass
+    if m is None or _find_closing(text, m.end()) >= 0:
+        return None
+    return m.group('role').lower()
+
+
+def declaration_target(kind, signature):
+    """Return (target, error) for a declaring directive's signature."""
+    sig = ' '.join(signature.split())
+
+    if kind == 'type':
+        fullname = sig if '::' in sig else f'std::{sig}'
+    elif kind == 'keyword':
+        fullname = sig
+    elif kind == 'operator':
+        name, sep, rest = sig.partition(':')
+        if not sep or not name.strip() or not rest.strip():
+            return None, (':eql:operator signature must match '
+                          '"NAME: SIGNATURE" template')
+        fullname = name.strip()
+    else:
+        m = _symbol_re.match(sig)
+        fullname = m.group(1) if m else ''
+        if '::' not in fullname:
+            return None, f'EdgeQL {kind} declaration is missing namespace'
+
+    if not fullname:
+        return None, f'missing {kind} signature'
+    return f'{kind}::{fullname}'.replace(' ', '-'), None
+
+
+def _indent(line):
+    return len(line) - len(line.lstrip())
+
+
+def _find_closing(line, start):
+    i = start
+    while i < len(line):
+        c = line[i]
+        if c == '\\':
+            i += 2
+        elif c == '`':
+            return i
+        else:
+            i += 1
+    return -1
+
+
+class _Lexer:
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.declarations = []
+        self.references = []
+        self.problems = []
+
+        self.lineno = -1
+        self.prev = None
+        self.skip_indent = None
+        self.decl = None
+        self.section = None
+        self.statement = None
+        self.pending_role = None
+
+    def feed(self, line):
+        self.lineno += 1
+        lineno = self.lineno
+        line = line.rstrip('\r\n').expandtabs()
+        stripped = line.strip()
+        indent = _indent(line)
+
+        if stripped:
+            if self.skip_indent is not None and indent <= self.skip_indent:
+                self.skip_indent = None
+            if self.decl is not None and indent <= self.decl['indent']:
+                self._finish_decl()
+        else:
+            self.pending_role = None
+
+        if self.skip_indent is not None:
+            self.prev = None
+            return
+
+        if self.decl is not None and self._feed_decl(line, stripped, indent):
+            self.prev = line
+            return
+
+        if self.statement is not None:
+            self._feed_statement(line, stripped, indent)
+
+        if (stripped and indent == 0 and self.prev and
+                _underline_re.match(line) and stripped != '::' and
+                not self.prev[0].isspace() and
+                not _underline_re.match(self.prev) and
+                len(stripped) >= len(self.prev.strip())):
+            self._finish_statement()
+            self.section = (self.prev.strip(), lineno - 1)
+            self.prev = line
+            return
+
+        if indent == 0 and stripped == ':eql-statement:':
+            self._start_statement()
+
+        m = _directive_re.match(line)
+        if m:
+            name = m.group('name')
+            if name.startswith('eql:') and name[4:] in DECLARING_DIRECTIVES:
+                if self.decl is not None:
+                    self._finish_decl()
+                self.decl = {
+                    'kind': name[4:], 'indent': indent, 'lineno': lineno,
+                    'signature': m.group('arg') or '', 'phase': 'args',
+                    'fields': [], 'content_indent': None,
+                    'has_content': False, 'paragraph': None,
+                    'paragraph_lineno': None,
+                }
+            elif name in LITERAL_DIRECTIVES:
+                self.skip_indent = indent
+        elif _explicit_markup_re.match(line) and not _target_re.match(line):
+            # A comment.
+            self.skip_indent = indent
+        else:
+            self._scan_roles(line, lineno)
+            if stripped.endswith('::'):
+                self.skip_indent = indent
+
+        self.prev = line
+
+    def finish(self):
+        if self.decl is not None:
+            self._finish_decl()
+        self._finish_statement()
+        return SourceScan(
+            self.filename, self.declarations, self.references, self.problems)
+
+    def _feed_decl(self, line, stripped, indent):
+        """Handle a line inside a declaring directive.
+
+        Returns True if the line is consumed (signature, options).
+        """
+        decl = self.decl
+        phase = decl['phase']
+
+        if phase == 'args':
+            if not stripped:
+                decl['phase'] = 'fields'
+            elif not stripped.startswith(':'):
+                decl['signature'] += ' ' + stripped
+            return True
+
+        if phase == 'fields':
+            if not stripped:
+                return False
+            content_indent = decl['content_indent']
+            m = _field_re.match(line)
+            if m and content_indent in (None, indent):
+                decl['content_indent'] = indent
+                decl['has_content'] = True
+                decl['fields'].append(
+                    (' '.join(m.group('name').split()), self.lineno,
+                     indent + 1))
+                return False
+            if content_indent is not None and indent > content_indent:
+                # A field body.
+                return False
+
+            decl['content_indent'] = indent
+            decl['has_content'] = True
+            if _not_paragraph_re.match(stripped):
+                decl['phase'] = 'body'
+            else:
+                decl['phase'] = 'paragraph'
+                decl['paragraph'] = [stripped]
+                decl['paragraph_lineno'] = self.lineno
+            return False
+
+        if phase == 'paragraph':
+            if stripped and indent == decl['content_indent']:
+                decl['paragraph'].append(stripped)
+            else:
+                decl['phase'] = 'body'
+
+        return False
+
+    def _finish_decl(self):
+        decl, self.decl = self.decl, None
+
+        target, error = declaration_target(decl['kind'], decl['signature'])
+        if error is not None:
+            self.problems.append(Problem(self.filename, decl['lineno'], error))
+            return
+
+        paragraph = decl['paragraph']
+        self.declarations.append(Declaration(
+            target, decl['kind'], ' '.join(decl['signature'].split()),
+            self.filename, decl['lineno'], tuple(decl['fields']),
+            decl['has_content'],
+            ' '.join(paragraph) if paragraph is not None else None,
+            decl['paragraph_lineno']))
+
+    def _start_statement(self):
+        if self.section is None or self.statement is not None:
+            return
+        title, lineno = self.section
+        self.statement = {
+            'title': title, 'lineno': lineno,
+            'phase': 'fields', 'paragraph': None, 'paragraph_lineno': None,
+        }
+
+    def _feed_statement(self, line, stripped, indent):
+        stmt = self.statement
+        if stmt['phase'] == 'fields':
+            if stripped and indent == 0 and not _field_re.match(line):
+                if _not_paragraph_re.match(stripped):
+                    stmt['phase'] = 'body'
+                else:
+                    stmt['phase'] = 'paragraph'
+                    stmt['paragraph'] = [stripped]
+                    stmt['paragraph_lineno'] = self.lineno
+        elif stmt['phase'] == 'paragraph':
+            if stripped and indent == 0:
+                stmt['paragraph'].append(stripped)
+            else:
+                stmt['phase'] = 'body'
+
+    def _finish_statement(self):
+        stmt, self.statement = self.statement, None
+        if stmt is None:
+            return
+
+        paragraph = stmt['paragraph']
+        self.declarations.append(Declaration(
+            'statement::' + stmt['title'].replace(' ', '-'), 'statement',
+            stmt['title'], self.filename, stmt['lineno'], (), True,
+            ' '.join(paragraph) if paragraph is not None else None,
+            stmt['paragraph_lineno']))
+
+    def _scan_roles(self, line, lineno):
+        masked = _inline_literal_re.sub(lambda m: ' ' * len(m.group()), line)
+        pos = 0
+
+        pending = self.pending_role
+        if pending is not None:
+            end = _find_closing(masked, 0)
+            if end < 0:
+                pending['text'] += '\n' + line.strip()
+                return
+            self.pending_role = None
+            pending['text'] += '\n' + line[:end].strip()
+            self._add_reference(pending, lineno, end + 1)
+            pos = end + 1
+
+        while True:
+            m = _role_start_re.search(masked, pos)
+            if m is None:
+                break
+            role = {
+                # Role names are case-insensitive.
+                'role': m.group('role').lower(), 'lineno': lineno,
+                'col': m.start(),
+            }
+            end = _find_closing(masked, m.end())
+            if end < 0:
+                role['text'] = line[m.end():]
+                self.pending_role = role
+                break
+            role['text'] = line[m.end():end]
+            self._add_reference(role, lineno, end + 1)
+            pos = end + 1
+
+    def _add_reference(self, role, end_lineno, end_col):
+        parsed = parse_role_text(role['text'])
+        if parsed is None:
+            return
+        self.references.append(Reference(
+            role['role'], parsed[1], self.filename, role['lineno'],
+            role['col'], end_lineno, end_col))
+
+
+def scan_lines(lines, filename=None):
+    lexer = _Lexer(filename)
+    for line in lines:
+        lexer.feed(line)
+    return lexer.finish()
+
+
+def scan_source(text, filename=None):
+    return scan_lines(text.split('\n'), filename)
+
+
+def scan_file(filename):
+    with open(filename, 'rt', encoding='utf-8') as f:
+        return scan_lines(f, filename)
+
+
+class SourceIndex:
+    """Declarations and references of a set of source files."""
+
+    def __init__(self):
+        self.scans = {}
+        # target -> [Declaration]; the first one is used.
+        self._declarations = collections.defaultdict(list)
+        # target -> (filename, objtype), for EdgeQLDomain.find_target().
+        self.objects = {}
+        self.version = 0
+
+    def update(self, scan):
+        """Add the scan of a file, replacing its previous scan.
+
+        Returns True if the declared targets have changed.
+        """
+        old = self.scans.get(scan.filename)
+        if old is not None:
+            if old.declarations == scan.declarations:
+                self.scans[scan.filename] = scan
+                return False
+            self._remove_declarations(old)
+
+        self.scans[scan.filename] = scan
+        for decl in scan.declarations:
+            decls = self._declarations[decl.target]
+            decls.append(decl)
+            if len(decls) == 1:
+                self.objects[decl.target] = (decl.filename, decl.objtype)
+
+        self.version += 1
+        return True
+
+    def remove(self, filename):
+        scan = self.scans.pop(filename, None)
+        if scan is None or not scan.declarations:
+            return False
+        self._remove_declarations(scan)
+        self.version += 1
+        return True
+
+    def _remove_declarations(self, scan):
+        for decl in scan.declarations:
+            decls = self._declarations[decl.target]
+            decls.remove(decl)
+            if decls:
+                self.objects[decl.target] = (
+                    decls[0].filename, decls[0].objtype)
+            else:
+                del self._declarations[decl.target]
+                del self.objects[decl.target]
+
+    def get_declaration(self, target):
+        decls = self._declarations.get(target)
+        return decls[0] if decls else None
+
+    def duplicates(self, filename):
+        """Yield (duplicate, first declaration) pairs for *filename*."""
+        scan = self.scans.get(filename)
+        for decl in scan.declarations if scan is not None else ():
+            first = self._declarations[decl.target][0]
+            if first != decl:
+                yield decl, first
+
+    def declarations(self):
+        for decls in self._declarations.values():
+            yield decls[0]
@@ -0,0 +1,132 @@
+"""
+============
+Source links
+============
+
+Provides the template variables used by "srclinks.html" based on the
+"srclink_project", "srclink_src_path" and "srclink_branch" config
+values.  Repository-level values, including the current revision,
+which is read directly from the ".git" directory, are computed once
+per build; per-page links are derived from them with string formatting.
+"""
+
+
+import functools
+import os
+import os.path
+import re
+
+from . import shared
+
+
+def _read_text(filename):
+    try:
+        with open(filename, 'rt') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def find_git_dir(path):
+    path = os.path.abspath(path)
+    while True:
+        candidate = os.path.join(path, '.git')
+        if os.path.isdir(candidate):
+            return candidate
+        if os.path.isfile(candidate):
+            # A worktree or a submodule: ".git" is a "gitdir: ..." file.
+            content = _read_text(candidate) or ''
+            if content.startswith('gitdir:'):
+                gitdir = content[len('gitdir:'):].strip()
+                return os.path.normpath(os.path.join(path, gitdir))
+
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def read_git_revision(gitdir):
+    head = _read_text(os.path.join(gitdir, 'HEAD'))
+    if not head:
+        return None
+    if not head.startswith('ref:'):
+        return head  # detached HEAD
+
+    ref = head[len('ref:'):].strip()
+
+    # Refs of a worktree are stored in the main repository.
+    commondir = _read_text(os.path.join(gitdir, 'commondir'))
+    if commondir:
+        gitdir = os.path.normpath(os.path.join(gitdir, commondir))
+
+    rev = _read_text(os.path.join(gitdir, *ref.split('/')))
+    if rev:
+        return rev
+
+    packed = _read_text(os.path.join(gitdir, 'packed-refs')) or ''
+    for line in packed.splitlines():
+        if line.endswith(f' {ref}'):
+            return line.split(' ', 1)[0]
+
+    return None
+
+
+@functools.lru_cache()
+def get_repo_context(srcdir, project, branch):
+    project = project.rstrip('/')
+
+    ctx = {
+        'srclink_src_url': project,
+        'srclink_src_clone_cmd': 'git clone',
+        'srclink_src_https_url': f'{project}.git',
+    }
+
+    m = re.match(r'^https?://(?P<host>[^/]+)/(?P<path>.+)$', project)
+    if m:
+        ctx['srclink_src_ssh_url'] = f'git@{m.group("host")}:' \
+                                     f'{m.group("path")}.git'
+        ctx['srclink_src_native_url'] = f'git://{m.group("host")}/' \
+                                        f'{m.group("path")}.git'
+
+    gitdir = find_git_dir(srcdir)
+    rev = read_git_revision(gitdir) if gitdir else None
+    if rev:
+        ctx['srclink_src_rev'] = rev[:10]
+        ctx['srclink_src_rev_url'] = f'{project}/commit/{rev}'
+
+    return ctx
+
+
+def add_srclinks_context(app, pagename, templatename, context, doctree):
+    config = app.config
+    if not config.srclink_project:
+        return
+
+    context.update(get_repo_context(
+        app.srcdir, config.srclink_project, config.srclink_branch))
+
+    if pagename not in app.env.all_docs:
+        return
+
+    project = config.srclink_project.rstrip('/')
+    branch = config.srclink_branch
+    path = config.srclink_src_path + app.env.doc2path(pagename, base=None)
+
+    context['show_srclink_url'] = f'{project}/blob/{branch}/{path}'
+    context['edit_srclink_url'] = f'{project}/edit/{branch}/{path}'
+    context['history_srclink_url'] = f'{project}/commits/{branch}/{path}'
+    context['annotate_srclink_url'] = f'{project}/blame/{branch}/{path}'
+
+
+def reset_repo_context(app):
+    get_repo_context.cache_clear()
+
+
+def setup_extension(app):
+    app.add_config_value('srclink_project', None, 'html')
+    app.add_config_value('srclink_src_path', '', 'html')
+    app.add_config_value('srclink_branch', 'master', 'html')
+
+    app.connect(shared.BUILD_STARTED_EVENT, reset_repo_context)
+    app.connect('html-page-context', add_srclinks_context)
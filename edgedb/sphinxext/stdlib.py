@@ -0,0 +1,266 @@
+"""
+========================================
+Reference pages for the standard library
+========================================
+
+The ".. eql:stdlib::" directive documents the functions and scalar types
+declared in EdgeDB's standard library schema sources (the "*.eql" files
+in the "edgedb/lib" directory, or in the directory set by the
+"edgedb_stdlib_path" config value):
+
+    .. eql:stdlib:: std
+        :kind: function
+        :exclude: array_agg, len
+
+The directive generates regular ".. eql:function::" and ".. eql:type::"
+directives, so the resulting doctree is the same as for hand-written
+ones.  Overloads of a function are documented by one directive with a
+signature line per overload, and so share one target.  Parameters and
+return types are shown in the signatures; no fields are generated, as
+the schema has no descriptions of individual parameters.
+
+The "description" attribute of an object provides its text: the first
+sentence is the summary.  Objects without a description, or with a
+first sentence that is too long for a summary, are skipped with a
+warning; describe them in the schema or list them in ":exclude:".
+
+The schema sources are parsed once per build and the parsed definitions
+are cached on disk by a hash of the sources, of the extension code and
+of the EdgeQL parser, so they are parsed again only when one of them
+changes.  The signatures of parsed functions are also put into the
+function signature cache, so EQLFunctionDirective does not have to
+parse them again.
+"""
+
+
+import collections
+import itertools
+import os
+import os.path
+import pickle
+
+from edgedb import lang as edgedb_lang
+from edgedb.lang.edgeql.parser import parser as edgeql_parser
+from edgedb.lang.edgeql import ast as ql_ast
+from edgedb.lang.edgeql import codegen as ql_gen
+
+from docutils import nodes as d_nodes
+from docutils import statemachine as d_statemachine
+from docutils.parsers import rst as d_rst
+from docutils.parsers.rst import directives as d_directives
+
+from sphinx.util import logging as s_logging
+
+from . import eql
+from . import fingerprint
+from . import shared
+
+
+StdlibObject = collections.namedtuple(
+    'StdlibObject',
+    ['kind', 'module', 'name', 'signature', 'description', 'source'])
+
+
+# schema hash -> [StdlibObject]
+_stdlib_cache = {}
+
+logger = s_logging.getLogger(__name__)
+
+
+def default_stdlib_path():
+    return os.path.join(
+        os.path.dirname(os.path.dirname(edgedb_lang.__file__)), 'lib')
+
+
+def find_stdlib_files(path):
+    files = []
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        for fn in sorted(filenames):
+            if fn.endswith('.eql'):
+                files.append(os.path.join(dirpath, fn))
+    return files
+
+
+def _get_description(astnode):
+    for cmd in getattr(astnode, 'commands', None) or ():
+        name = getattr(getattr(cmd, 'name', None), 'name', None)
+        value = getattr(getattr(cmd, 'value', None), 'value', None)
+        if name == 'description' and isinstance(value, str):
+            return eql.BaseEQLDirective.strip_ws(value)
+    return None
+
+
+def parse_stdlib_file(filename):
+    with open(filename, 'rt') as f:
+        source = f.read()
+
+    parser = edgeql_parser.EdgeQLBlockParser()
+    try:
+        statements = parser.parse(source)
+    except Exception as ex:
+        raise shared.EdgeSphinxExtensionError(
+            f'could not parse standard library file {filename}: {ex}') from ex
+
+    objects = []
+    for astnode in statements:
+        if isinstance(astnode, ql_ast.CreateFunction):
+            fsig = eql.describe_function(astnode)
+            objects.append(StdlibObject(
+                'function', fsig.module, fsig.name, fsig,
+                _get_description(astnode), filename))
+
+        elif isinstance(astnode, ql_ast.CreateScalarType):
+            objects.append(StdlibObject(
+                'type', astnode.name.module, astnode.name.name,
+                ql_gen.EdgeQLSourceGenerator.to_source(astnode.name),
+                _get_description(astnode), filename))
+
+    return objects
+
+
+def load_stdlib(env):
+    path = env.config.edgedb_stdlib_path or default_stdlib_path()
+    files = find_stdlib_files(path)
+
+    # Parsed objects depend on the extension (describe_function) and
+    # the parser as well as on the sources.
+    h = fingerprint.hash_bytes(''.join([
+        f'{fingerprint.current_extension_fingerprint()}\n',
+        f'{fingerprint.parser_fingerprint()}\n',
+        *(f'{fn}\0{fingerprint.hash_file(fn)}\n' for fn in files),
+    ]).encode())
+
+    objects = _stdlib_cache.get(h)
+    shared.count_cache('stdlib', objects is not None)
+    if objects is None:
+        cachefile = os.path.join(env.doctreedir, f'eql-stdlib-{h}.pickle')
+        try:
+            with open(cachefile, 'rb') as f:
+                objects = pickle.load(f)
+            shared.count_cache('stdlib_pickle', True)
+        except Exception:
+            shared.count_cache('stdlib_pickle', False)
+            objects = []
+            for fn in files:
+                objects.extend(parse_stdlib_file(fn))
+
+            os.makedirs(env.doctreedir, exist_ok=True)
+            with open(cachefile, 'wb') as f:
+                pickle.dump(objects, f, pickle.HIGHEST_PROTOCOL)
+
+        for obj in objects:
+            if obj.kind == 'function':
+                eql._function_signatures[obj.signature.signature] = \
+                    obj.signature
+
+        _stdlib_cache[h] = objects
+
+    return files, objects
+
+
+def _describe(objects):
+    """Return (lines, error) describing a group of overloads."""
+    descriptions = []
+    for obj in objects:
+        if obj.description and obj.description not in descriptions:
+            descriptions.append(obj.description)
+    if not descriptions:
+        return None, 'has no description'
+
+    summary, sep, rest = descriptions[0].partition('. ')
+    summary += sep.rstrip()
+    error = eql.BaseEQLDirective.summary_error(summary)
+    if error:
+        return None, f'has an unsuitable description: {error}'
+
+    lines = []
+    for paragraph in (summary, rest, *descriptions[1:]):
+        if paragraph:
+            lines.extend(['', f'    {paragraph}'])
+    return lines, None
+
+
+def render_objects(objects):
+    """Return (lines, error) for a group of objects of the same name.
+
+    All objects of a group are overloads of one function, or a single
+    type.
+    """
+    first = objects[0]
+    description, error = _describe(objects)
+    if error:
+        return None, f'{first.kind} {first.module}::{first.name} {error}'
+
+    if first.kind == 'function':
+        directive = '.. eql:function:: '
+        signatures = [obj.signature.signature for obj in objects]
+    else:
+        directive = '.. eql:type:: '
+        signatures = [f'{first.module}::{first.name}']
+
+    lines = [f'{directive}{signatures[0]}']
+    lines.extend(f'{" " * len(directive)}{sig}' for sig in signatures[1:])
+    lines.extend(description)
+    lines.append('')
+    return lines, None
+
+
+def group_objects(objects):
+    """Group overloads, types first, each kind sorted by name."""
+    objects = sorted(objects, key=lambda obj: (obj.kind != 'type', obj.name))
+    return [
+        list(group) for _, group in itertools.groupby(
+            objects, key=lambda obj: (obj.kind, obj.module, obj.name))
+    ]
+
+
+def _name_list(argument):
+    return {name.strip() for name in argument.split(',') if name.strip()}
+
+
+class EQLStdlibDirective(d_rst.Directive):
+
+    has_content = False
+    optional_arguments = 0
+    required_arguments = 1
+    option_spec = {
+        'kind': lambda arg: d_directives.choice(arg, ('function', 'type')),
+        'exclude': _name_list,
+    }
+
+    def run(self):
+        env = self.state.document.settings.env
+        module = self.arguments[0]
+        kind = self.options.get('kind')
+        exclude = self.options.get('exclude', set())
+
+        files, objects = load_stdlib(env)
+        for fn in files:
+            env.note_dependency(fn)
+
+        selected = group_objects(
+            obj for obj in objects
+            if obj.module == module and obj.name not in exclude and
+            (kind is None or obj.kind == kind))
+
+        content = d_statemachine.StringList()
+        for group in selected:
+            lines, error = render_objects(group)
+            if error:
+                logger.warning(
+                    f'skipped standard library {error}',
+                    location=(env.docname, self.lineno))
+                continue
+            for line in lines:
+                content.append(line, f'<stdlib:{group[0].source}>')
+
+        node = d_nodes.container()
+        self.state.nested_parse(content, self.content_offset, node)
+        return node.children
+
+
+def setup_extension(app):
+    app.add_config_value('edgedb_stdlib_path', None, 'env')
+
+    app.add_directive_to_domain('eql', 'stdlib', EQLStdlibDirective)
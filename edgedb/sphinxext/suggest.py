@@ -0,0 +1,129 @@
+"""
+=========================================
+Suggestions for unresolved eql references
+=========================================
+
+When an :eql: reference cannot be resolved, the error message lists
+the closest objects:
+
+    cannot resolve :eql:type: targeting 'type::std::in64'; did you
+    mean :eql:type:`int64`, :eql:type:`int16` or :eql:type:`int32`?
+
+Objects of the referenced type are suggested first; objects of other
+types are suggested only when their names match closely, as in
+":eql:func:`SELECT`" for a statement.
+
+SuggestionIndex is a trigram index over the object names: a lookup
+counts shared trigrams over the posting lists of the name's trigrams
+instead of comparing the name to every object.  EdgeQLDomain builds it
+on the first unresolved reference after the objects have changed, so
+in a build it is built once.
+"""
+
+
+import collections
+
+from . import inventory
+
+
+MAX_SUGGESTIONS = 3
+
+# Minimum trigram similarity (Jaccard index) of a suggestion; other
+# types need a closer match.
+MIN_SIMILARITY = 0.2
+MIN_OTHER_TYPE_SIMILARITY = 0.6
+
+
+def _key(name):
+    name = name.lower()
+    if name.startswith('std::'):
+        name = name[len('std::'):]
+    return name.replace(' ', '-')
+
+
+def _trigrams(key):
+    padded = f'  {key} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SuggestionIndex:
+
+    def __init__(self, objects):
+        """*objects* is an iterable of (target, objtype) pairs."""
+        self._entries = []  # [(target, objtype, number of trigrams)]
+        self._postings = collections.defaultdict(list)
+        self._cache = {}
+
+        for target, objtype in objects:
+            key = _key(target.split('::', 1)[1])
+            trigrams = _trigrams(key)
+            entry_id = len(self._entries)
+            self._entries.append((target, objtype, len(trigrams)))
+            for trigram in trigrams:
+                self._postings[trigram].append(entry_id)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, name):
+        """Return [(similarity, target, objtype)] similar to *name*.
+
+        *name* is a target without its type prefix, e.g. "std::in64";
+        the result is sorted from the most similar object and includes
+        all objects at least MIN_SIMILARITY similar.
+        """
+        key = _key(name)
+        result = self._cache.get(key)
+        if result is not None:
+            return result
+
+        trigrams = _trigrams(key)
+        shared = collections.Counter()
+        for trigram in trigrams:
+            shared.update(self._postings.get(trigram, ()))
+
+        scored = []
+        for entry_id, count in shared.items():
+            target, objtype, n_trigrams = self._entries[entry_id]
+            similarity = count / (len(trigrams) + n_trigrams - count)
+            if similarity >= MIN_SIMILARITY:
+                scored.append((similarity, target, objtype))
+
+        scored.sort(key=lambda s: (-s[0], s[1]))
+        self._cache[key] = scored
+        return scored
+
+    def suggest(self, objtype, name, *, limit=MAX_SUGGESTIONS):
+        """Return [(target, objtype)] to suggest for an unresolved name.
+
+        Objects of *objtype* come first, then close matches of other
+        types.
+        """
+        same = []
+        other = []
+        for similarity, target, target_type in self.lookup(name):
+            if target_type == objtype:
+                same.append((target, target_type))
+            elif similarity >= MIN_OTHER_TYPE_SIMILARITY:
+                other.append((target, target_type))
+        return (same + other)[:limit]
+
+
+def format_suggestions(suggestions, roles):
+    """Format [(target, objtype)] as "; did you mean ...?".
+
+    *roles* maps object types to role names.
+    """
+    if not suggestions:
+        return ''
+
+    refs = []
+    for target, objtype in suggestions:
+        name = inventory.display_name(target, objtype)
+        if objtype == 'function':
+            name = name[:-len('()')]
+        refs.append(f':eql:{roles[objtype]}:`{name}`')
+
+    if len(refs) == 1:
+        return f'; did you mean {refs[0]}?'
+    return f'; did you mean {", ".join(refs[:-1])} or {refs[-1]}?'
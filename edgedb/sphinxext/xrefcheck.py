@@ -0,0 +1,163 @@
+"""
+============================
+Broken eql reference scanner
+============================
+
+Reports every :eql: reference that EdgeQLDomain.resolve_xref would not
+resolve, without running Sphinx:
+
+    $ python -m edgedb.sphinxext.xrefcheck doc
+    doc/edgeql/expressions/paths.rst:42: cannot resolve :eql:type: ...
+
+Declarations and references are extracted from all ".rst" files under
+the given directories by srcindex; targets are normalized with
+EQLTypeXRef.filter_target and looked up with EdgeQLDomain.find_target,
+like in a build.  Malformed declaration signatures are reported too.
+The exit status is 1 if anything was reported.
+
+Files are lexed in worker processes when there are enough of them to
+make that worthwhile (-j, PARALLEL_MIN_BYTES); a build of the whole
+documentation is still needed for everything else Sphinx checks, and
+references to objects in intersphinx inventories are not resolved here.
+"""
+
+
+import argparse
+import os
+import os.path
+import sys
+import time
+
+from concurrent import futures
+
+from . import eql
+from . import srcindex
+from . import suggest
+
+
+# Below this much source text, starting worker processes costs more
+# than lexing everything in this one.
+PARALLEL_MIN_BYTES = 4 << 20
+
+
+def find_sources(path):
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames[:] = sorted(
+            d for d in dirnames if not d.startswith(('_', '.')))
+        for fn in sorted(filenames):
+            if fn.endswith('.rst'):
+                yield os.path.join(dirpath, fn)
+
+
+def resolve_reference(objects, ref, *, suggestions=None):
+    """Resolve a srcindex.Reference like EdgeQLDomain.resolve_xref.
+
+    Returns (target, objtype) on success, (None, error message) if the
+    reference cannot be resolved, or None for roles of other kinds.
+    With a suggest.SuggestionIndex of *objects* the error message lists
+    the closest objects.
+    """
+    domain = eql.EdgeQLDomain
+    if ref.role not in domain.roles:
+        return None
+
+    target = ref.target
+    if ref.role == 'type':
+        target = eql.EQLTypeXRef.filter_target(target)
+
+    expected_type, targets, target, filename, obj_type = \
+        domain.find_target(objects, ref.role, target)
+
+    if filename is None:
+        message = f'cannot resolve :eql:{ref.role}: targeting {target!r}'
+    elif obj_type != expected_type:
+        message = (
+            f'cannot resolve :eql:{ref.role}: targeting {target!r}: '
+            f'the type of referred object {expected_type!r} '
+            f'does not match the reftype')
+    else:
+        return target, obj_type
+
+    if suggestions is not None:
+        message += domain.did_you_mean(suggestions, ref.role, target)
+    return None, message
+
+
+def scan_files(filenames, *, jobs=None):
+    """Return the srcindex.SourceScan of each file, in order."""
+    jobs = jobs or os.cpu_count() or 1
+    size = sum(os.path.getsize(fn) for fn in filenames)
+
+    if jobs < 2 or size < PARALLEL_MIN_BYTES:
+        return [srcindex.scan_file(fn) for fn in filenames]
+
+    with futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        chunksize = max(len(filenames) // (jobs * 4), 1)
+        return list(pool.map(
+            srcindex.scan_file, filenames, chunksize=chunksize))
+
+
+def check(filenames, *, jobs=None):
+    """Return (problems, index) for *filenames*.
+
+    *problems* is a sorted list of srcindex.Problem, *index* is the
+    srcindex.SourceIndex of the files.
+    """
+    index = srcindex.SourceIndex()
+    problems = []
+    for scan in scan_files(filenames, jobs=jobs):
+        index.update(scan)
+        problems.extend(scan.problems)
+
+    suggestions = suggest.SuggestionIndex(
+        (target, objtype) for target, (_, objtype) in index.objects.items())
+    for scan in index.scans.values():
+        for ref in scan.references:
+            resolved = resolve_reference(
+                index.objects, ref, suggestions=suggestions)
+            if resolved is not None and resolved[0] is None:
+                problems.append(srcindex.Problem(
+                    ref.filename, ref.lineno, resolved[1]))
+
+    problems.sort(key=lambda p: (p.filename, p.lineno))
+    return problems, index
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m edgedb.sphinxext.xrefcheck',
+        description='Find unresolvable :eql: references without a build.')
+    parser.add_argument('paths', nargs='+', help='.rst files or directories')
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=None,
+        help='number of worker processes (default: number of CPUs)')
+    parser.add_argument(
+        '-v', '--verbose', action='store_true',
+        help='print a summary of what was checked')
+    args = parser.parse_args(argv)
+
+    started = time.monotonic()
+
+    filenames = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            filenames.extend(find_sources(path))
+        else:
+            filenames.append(path)
+
+    problems, index = check(filenames, jobs=args.jobs)
+    for problem in problems:
+        print(f'{problem.filename}:{problem.lineno + 1}: {problem.message}')
+
+    if args.verbose:
+        n_refs = sum(len(scan.references) for scan in index.scans.values())
+        print(
+            f'{len(filenames)} files, {len(index.objects)} objects, '
+            f'{n_refs} references checked in '
+            f'{time.monotonic() - started:.3f}s', file=sys.stderr)
+
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
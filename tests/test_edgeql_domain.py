@@ -1,12 +1,53 @@
 import contextlib
+import io
+import json
 import os.path
+import pickle
+import re
+import shutil
 import subprocess
+import sys
+import tarfile
 import tempfile
 import textwrap
+import time
+import types
 import unittest
+import unittest.mock
+import zlib
 
+import lxml.etree
 import requests_xml
 
+from docutils import nodes as d_nodes
+
+from sphinx import application as s_app
+from sphinx import config as s_config
+from sphinx.util import docutils as s_docutils
+from sphinx.util import parallel as s_parallel
+
+from edgedb.sphinxext import cicache
+from edgedb.sphinxext import compress
+from edgedb.sphinxext import daemon
+from edgedb.sphinxext import doctreestore
+from edgedb.sphinxext import eql
+from edgedb.sphinxext import fingerprint
+from edgedb.sphinxext import inventory
+from edgedb.sphinxext import lsp
+from edgedb.sphinxext import memprofile
+from edgedb.sphinxext import metrics
+from edgedb.sphinxext import multibuild
+from edgedb.sphinxext import multiversion
+from edgedb.sphinxext import navigation
+from edgedb.sphinxext import pagewriter
+from edgedb.sphinxext import schedule
+from edgedb.sphinxext import sourcehash
+from edgedb.sphinxext import srcindex
+from edgedb.sphinxext import srclinks
+from edgedb.sphinxext import stdlib
+from edgedb.sphinxext import suggest
+from edgedb.sphinxext import xrefcheck
+
 
 class BuildFailedError(Exception):
     pass
@@ -14,11 +55,17 @@ class BuildFailedError(Exception):
 
 class BaseDomainTest:
 
-    def build(self, src, *, format='html'):
+    def build(self, src, *, format='html', extra_outputs=(), config=None,
+              outdir=None, extra_sources=None, nitpicky=True):
         src = textwrap.dedent(src)
 
         with tempfile.TemporaryDirectory() as td_in, \
-                tempfile.TemporaryDirectory() as td_out:
+                tempfile.TemporaryDirectory() as td_tmp:
+            td_out = outdir or td_tmp
+
+            for name, text in (extra_sources or {}).items():
+                with open(os.path.join(td_in, name), 'wt') as f:
+                    f.write(textwrap.dedent(text))
 
             fn = os.path.join(td_in, 'contents.rst')
             with open(fn, 'wt') as f:
@@ -29,14 +76,17 @@ class BaseDomainTest:
                 'sphinx-build',
                 '-b', format,
                 '-W',
-                '-n',
+                *(['-n'] if nitpicky else []),
                 '-C',
                 '-D', 'extensions=edgedb.sphinxext',
+                *(f'-D{name}={value}'
+                  for name, value in (config or {}).items()),
                 '-q',
                 td_in,
                 td_out,
-                fn
             ]
+            if not extra_sources:
+                args.append(fn)
 
             try:
                 subprocess.run(
@@ -63,9 +113,17 @@ class BaseDomainTest:
                 new_ex.stderr = ex.stderr.decode()
                 raise new_ex from ex
 
-            with open(os.path.join(td_out, f'contents.{format}'), 'rt') as f:
+            suffix = {'json': 'fjson'}.get(format, format)
+            with open(os.path.join(td_out, f'contents.{suffix}'), 'rt') as f:
                 out = f.read()
 
+            if extra_outputs:
+                extra = {}
+                for name in extra_outputs:
+                    with open(os.path.join(td_out, name), 'rb') as f:
+                        extra[name] = f.read()
+                return out, extra
+
             return out
 
     @contextlib.contextmanager
@@ -215,6 +273,33 @@ class TestEqlType(unittest.TestCase, BaseDomainTest):
             '''),
             ['SET OF', 'XXX'])
 
+    def test_eql_type_9(self):
+        src = '''
+        .. eql:type:: std::int64
+
+            aaa
+
+        .. eql:type:: std::int16
+
+            aaa
+
+        .. eql:type:: std::int32
+
+            aaa
+
+        .. eql:function:: std::int64(str) -> int64
+
+            aaa
+
+        Testing refs :eql:type:`in64`
+        '''
+
+        with self.assert_fails(
+                r"cannot resolve :eql:type: targeting 'type::std::in64'; "
+                r"did you mean :eql:type:`int64`, :eql:type:`int16` "
+                r"or :eql:type:`int32`\?"):
+            self.build(src)
+
 
 class TestEqlFunction(unittest.TestCase, BaseDomainTest):
 
@@ -773,6 +858,105 @@ class TestEqlStatement(unittest.TestCase, BaseDomainTest):
             ['DROP FUNCTION'])
 
 
+class TestEqlBatchXRefs(unittest.TestCase, BaseDomainTest):
+
+    OTHER = '''
+    =====
+    Other
+    =====
+
+    .. eql:type:: std::str
+
+        A string.
+
+    .. eql:keyword:: SET OF
+
+        A set.
+    '''
+
+    def build_both(self, src, **kwargs):
+        # Not nitpicky: unresolved links of typed fields are not
+        # errors.
+        return [
+            self.build(
+                src, extra_sources={'other.rst': self.OTHER},
+                config={'edgedb_eql_batch_xrefs': int(batch)},
+                nitpicky=False, **kwargs)
+            for batch in (True, False)
+        ]
+
+    def test_eql_batch_xrefs_1(self):
+        src = '''
+        .. toctree::
+
+            other
+
+        .. eql:type:: std::int64
+
+            An integer.
+
+        .. eql:operator:: PLUS: A + B
+
+            :optype A: int64 or str
+            :optype B: int64 or nope
+            :resulttype: int64
+
+            Arithmetic addition.
+
+        Refs :eql:type:`int64`, :eql:type:`std::int64`,
+        :eql:type:`an integer <int64>`, :eql:type:`str`,
+        :eql:type:`a string <std::str>`, :eql:kw:`SET OF`,
+        :eql:kw:`set <SET OF>` and :eql:op:`PLUS`; again :eql:type:`str`.
+        '''
+
+        batched, resolved = self.build_both(src)
+        self.assertEqual(batched, resolved)
+
+        batched, resolved = [
+            re.sub(r' source="[^"]*"', '', out)
+            for out in self.build_both(src, format='xml')
+        ]
+        self.assertEqual(batched, resolved)
+
+        x = lxml.etree.fromstring(batched.encode())
+        self.assertEqual(
+            [(ref.get('refid') or ref.get('refuri'), ref.xpath('string()'))
+             for ref in x.xpath('//paragraph[starts-with(., "Refs")]/*')],
+            [
+                ('type::std::int64', 'int64'),
+                ('type::std::int64', 'std::int64'),
+                ('type::std::int64', 'an integer'),
+                ('other#type::std::str', 'str'),
+                ('other#type::std::str', 'a string'),
+                ('other#keyword::SET-OF', 'SET OF'),
+                ('other#keyword::SET-OF', 'set'),
+                ('operator::PLUS', 'PLUS'),
+                ('other#type::std::str', 'str'),
+            ])
+        # Unresolved links of typed fields are left as text.
+        self.assertEqual(x.xpath('//pending_xref'), [])
+        self.assertEqual(
+            x.xpath('//field_body//*[text()="nope"]/parent::*/@refuri'), [])
+        self.assertIn('nope', x.xpath('//field_body//text()'))
+
+    def test_eql_batch_xrefs_2(self):
+        src = '''
+        .. toctree::
+
+            other
+
+        Refs :eql:type:`str` and :eql:type:`SET OF`.
+        '''
+
+        for batch in (True, False):
+            with self.assert_fails(
+                    r"cannot resolve :eql:type: targeting "
+                    r"'type::std::SET-OF'; did you mean :eql:kw:`SET OF`\?"):
+                self.build(
+                    src, extra_sources={'other.rst': self.OTHER},
+                    config={'edgedb_eql_batch_xrefs': int(batch)})
+
+
 class TestEqlInlineCode(unittest.TestCase, BaseDomainTest):
 
     def test_eql_inline_role_1(self):
@@ -841,3 +1025,2000 @@ class TestEQLMigration(unittest.TestCase, BaseDomainTest):
                 'type User:\n    property name -> str',
                 '\n$$;\nCOMMIT MIGRATION foobar;'
             ])
+
+
+class TestEqlInventory(unittest.TestCase, BaseDomainTest):
+
+    def test_eql_inventory_1(self):
+        src = '''
+        .. eql:type:: std::int64
+
+            descr
+
+        .. eql:function:: std::len(str) -> int64
+
+            :param $0: input
+            :paramtype $0: str
+
+            descr
+        '''
+
+        _, extra = self.build(src, extra_outputs=['eql.inv'])
+        inv = extra['eql.inv']
+
+        header, _, body = inv.partition(
+            b'# The remainder of this file is compressed using zlib.\n')
+        self.assertIn(b'# Sphinx inventory version 2\n', header)
+
+        self.assertEqual(
+            zlib.decompress(body).decode().splitlines(),
+            [
+                'function::std::len eql:function 1 contents.html#$ len()',
+                'type::std::int64 eql:type 1 contents.html#$ int64',
+            ])
+
+    def test_eql_inventory_2(self):
+        objects = eql.EQLObjectIndex()
+        objects['type::std::int64'] = ('contents', 'type')
+
+        class Builder:
+            def get_target_uri(self, docname):
+                raise OSError('disk full')
+
+        with tempfile.TemporaryDirectory() as td:
+            with self.assertRaisesRegex(OSError, 'disk full'):
+                inventory.write_inventory(
+                    os.path.join(td, 'eql.inv'), objects, Builder(),
+                    project='EdgeDB', version='1.0')
+
+            # A failed write leaves no temporary file behind.
+            self.assertEqual(os.listdir(td), [])
+
+
+class TestEqlReactElement(unittest.TestCase, BaseDomainTest):
+
+    def test_eql_react_manifest_1(self):
+        src = '''
+        .. eql:react-element:: DocsNavTable
+
+        .. eql:react-element:: DocsNavTable
+
+        .. eql:react-element:: Other
+        '''
+
+        _, extra = self.build(src, extra_outputs=['react-manifest.json'])
+
+        self.assertEqual(
+            json.loads(extra['react-manifest.json']),
+            {
+                'components': {
+                    'DocsNavTable': ['contents'],
+                    'Other': ['contents'],
+                },
+                'pages': {
+                    'contents': ['DocsNavTable', 'Other'],
+                },
+            })
+
+    def test_eql_react_manifest_2(self):
+        src = '''
+        .. eql:react-element:: DocsNavTable
+        '''
+
+        out = self.build(src, config={
+            'edgedb_react_module_url': '_static/{name}.js?v=1&q="x"'})
+
+        self.assertIn(
+            '<link rel="modulepreload" '
+            'href="_static/DocsNavTable.js?v=1&amp;q=&quot;x&quot;" />',
+            out)
+
+
+class TestCompress(unittest.TestCase, BaseDomainTest):
+
+    def write(self, outdir, relpath, text):
+        path = os.path.join(outdir, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wt') as f:
+            f.write(text)
+
+    def read(self, outdir, relpath):
+        with open(os.path.join(outdir, relpath), 'rt') as f:
+            return f.read()
+
+    def test_compress_1(self):
+        with tempfile.TemporaryDirectory() as td:
+            self.write(td, '_static/basic.css', 'body {}')
+            self.write(td, '_static/img/logo.svg', '<svg/>')
+
+            mapping = compress.fingerprint_static(td)
+            self.assertEqual(sorted(mapping), [
+                '_static/basic.css', '_static/img/logo.svg'])
+            fp_css = mapping['_static/basic.css']
+            self.assertRegex(fp_css, r'^_static/basic\.[0-9a-f]{10}\.css$')
+            self.assertEqual(self.read(td, fp_css), 'body {}')
+
+            # Fingerprinted copies are not fingerprinted again.
+            self.assertEqual(compress.fingerprint_static(td), mapping)
+
+            self.write(td, '_static/basic.css', 'body { margin: 0 }')
+            new_fp_css = compress.fingerprint_static(td)['_static/basic.css']
+            self.assertNotEqual(new_fp_css, fp_css)
+            # The copy of the previous version is removed.
+            self.assertFalse(os.path.exists(os.path.join(td, fp_css)))
+
+            # Copies of deleted assets are removed if the asset was
+            # known; unknown fingerprinted names are left alone.
+            fp_svg = mapping['_static/img/logo.svg']
+            os.unlink(os.path.join(td, '_static/img/logo.svg'))
+            self.write(td, '_static/jquery.0123456789.js', '')
+            compress.fingerprint_static(td, known={'_static/img/logo.svg'})
+            self.assertFalse(os.path.exists(os.path.join(td, fp_svg)))
+            self.assertTrue(os.path.exists(
+                os.path.join(td, '_static/jquery.0123456789.js')))
+
+    def test_compress_2(self):
+        mapping = {
+            '_static/basic.css': '_static/basic.0123456789.css',
+            '_static/doctools.js': '_static/doctools.abcdefabcd.js',
+        }
+
+        with tempfile.TemporaryDirectory() as td:
+            self.write(
+                td, 'a/page.html',
+                '<link href="../_static/basic.css" rel="stylesheet">'
+                '<script src="../_static/doctools.js?v=1"></script>'
+                '<img src="../_static/missing.png">'
+                '<a href="../other.html">x</a>')
+
+            filename = os.path.join(td, 'a/page.html')
+            compress.rewrite_static_refs(filename, mapping)
+            self.assertEqual(
+                self.read(td, 'a/page.html'),
+                '<link href="../_static/basic.0123456789.css" '
+                'rel="stylesheet">'
+                '<script src="../_static/doctools.abcdefabcd.js?v=1">'
+                '</script>'
+                '<img src="../_static/missing.png">'
+                '<a href="../other.html">x</a>')
+
+            # References to an older fingerprint are updated.
+            mapping['_static/basic.css'] = '_static/basic.9876543210.css'
+            compress.rewrite_static_refs(filename, mapping)
+            self.assertIn(
+                'href="../_static/basic.9876543210.css"',
+                self.read(td, 'a/page.html'))
+
+            # Nothing to rewrite: the file is not written.
+            os.utime(filename, (0, 0))
+            compress.rewrite_static_refs(filename, mapping)
+            self.assertEqual(os.path.getmtime(filename), 0)
+
+    def test_compress_3(self):
+        with tempfile.TemporaryDirectory() as td:
+            self.write(td, 'index.html', '<p>index</p>')
+            self.write(td, 'other.html', '<p>other</p>')
+            self.write(td, 'objects.inv', 'binary')
+
+            changed, removed = compress.process_output(td, jobs=1)
+            self.assertEqual(
+                sorted(changed),
+                ['index.html', 'index.html.gz', 'objects.inv',
+                 'other.html', 'other.html.gz'])
+            self.assertEqual(removed, [])
+            self.assertEqual(compress.process_output(td, jobs=1), ([], []))
+
+            self.write(td, 'other.html', '<p>changed</p>')
+            changed, removed = compress.process_output(td, jobs=1)
+            self.assertEqual(sorted(changed), ['other.html', 'other.html.gz'])
+            self.assertEqual(
+                json.loads(self.read(td, compress.CHANGES_FILENAME)),
+                {'changed': ['other.html', 'other.html.gz'], 'removed': []})
+
+            # Deleted files are listed with their compressed siblings,
+            # which are deleted too.
+            os.unlink(os.path.join(td, 'other.html'))
+            os.unlink(os.path.join(td, 'objects.inv'))
+            self.assertEqual(
+                compress.process_output(td, jobs=1),
+                ([], ['objects.inv', 'other.html', 'other.html.gz']))
+            self.assertEqual(sorted(os.listdir(td)), [
+                compress.STATE_FILENAME, compress.CHANGES_FILENAME,
+                'index.html', 'index.html.gz'])
+            self.assertEqual(
+                json.loads(self.read(td, compress.CHANGES_FILENAME)),
+                {'changed': [],
+                 'removed': ['objects.inv', 'other.html', 'other.html.gz']})
+
+    def test_compress_4(self):
+        src = '''
+        .. eql:react-element:: DocsNavTable
+
+        .. eql:type:: std::int64
+
+            An integer.
+        '''
+
+        _, extra = self.build(
+            src, config={'edgedb_precompress': 1},
+            extra_outputs=['changed-files.json', 'react-manifest.json.gz'])
+
+        # Files written by other "build-finished" handlers are included.
+        changed = json.loads(extra['changed-files.json'])['changed']
+        self.assertIn('eql.inv', changed)
+        self.assertIn('react-manifest.json', changed)
+        self.assertIn('react-manifest.json.gz', changed)
+
+    def test_compress_5(self):
+        src = '''
+        .. eql:type:: std::int64
+
+            An integer.
+        '''
+        config = {
+            'edgedb_fingerprint_static': 1,
+            'edgedb_write_if_changed': 1,
+        }
+
+        with tempfile.TemporaryDirectory() as td:
+            out = self.build(src, config=config, outdir=td)
+            self.assertRegex(out, r'_static/pygments\.[0-9a-f]{10}\.css')
+
+            out2, extra = self.build(
+                src, config=config, outdir=td,
+                extra_outputs=['.edgedb-pages.json', 'changed-files.json'])
+
+        # Rewritten references do not make unchanged pages look changed.
+        self.assertEqual(out2, out)
+        self.assertEqual(
+            json.loads(extra['.edgedb-pages.json'])['changed'], [])
+        self.assertEqual(
+            json.loads(extra['changed-files.json']),
+            {'changed': [], 'removed': []})
+
+
+class TestPageWriter(unittest.TestCase, BaseDomainTest):
+
+    SOURCE = '''
+    .. eql:type:: std::int64
+
+        An integer.
+    '''
+
+    def test_page_writer_1(self):
+        out = self.build(self.SOURCE, config={'edgedb_write_threads': 2})
+
+        self.assertIn('<dt id="type::std::int64">', out)
+        self.assertIn('An integer.', out)
+
+    def test_page_writer_2(self):
+        # Serializing builders do not render templates; their pages
+        # are written by the builder.
+        out, extra = self.build(
+            self.SOURCE, format='json',
+            config={'edgedb_write_threads': 2, 'edgedb_write_if_changed': 1},
+            extra_outputs=['genindex.fjson', '.edgedb-pages.json'])
+
+        self.assertIn('An integer.', json.loads(out)['body'])
+        self.assertIn('genindexentries', json.loads(extra['genindex.fjson']))
+        self.assertIn(
+            'contents.fjson',
+            json.loads(extra['.edgedb-pages.json'])['pages'])
+
+    def test_page_writer_3(self):
+        with tempfile.TemporaryDirectory() as td:
+            def handle_page(pagename, addctx, templatename,
+                            outfilename=None, event_arg=None):
+                with open(outfilename, 'wt') as f:
+                    f.write(addctx['body'])
+
+            builder = types.SimpleNamespace(
+                outdir=td, out_suffix='.html', handle_page=handle_page,
+                get_outfilename=lambda name: os.path.join(td, f'{name}.html'))
+            writer = pagewriter.PageWriter(builder, write_if_changed=True)
+
+            def build(*pages):
+                writer.start()
+                for name, body in pages:
+                    writer(name, {'body': body})
+                return writer.finish()
+
+            self.assertEqual(
+                build(('a', 'A'), ('b', 'B')), ['a.html', 'b.html'])
+            self.assertEqual(build(('a', 'A'), ('b', 'B')), [])
+
+            # A changed page is recorded even if its mtime looks old.
+            writer.start()
+            writer('a', {'body': 'A2'})
+            os.utime(os.path.join(td, 'a.html'), (0, 0))
+            self.assertEqual(writer.finish(), ['a.html'])
+            self.assertEqual(
+                writer.hashes['a.html'], fingerprint.hash_bytes(b'A2'))
+
+            # Pages written by parallel write processes are passed on
+            # through side files.
+            writer.start()
+            writer.pid = -1
+            writer('b', {'body': 'B2'})
+            writer.pid = os.getpid()
+            self.assertEqual(len(writer._side_files()), 1)
+            self.assertEqual(writer.finish(), ['b.html'])
+            self.assertEqual(writer._side_files(), [])
+            self.assertEqual(
+                writer.hashes['b.html'], fingerprint.hash_bytes(b'B2'))
+
+            # Pages written by other code are hashed.
+            with open(os.path.join(td, 'c.html'), 'wt') as f:
+                f.write('C')
+            self.assertEqual(build(), ['c.html'])
+            with open(os.path.join(td, pagewriter.MANIFEST_FILENAME)) as f:
+                manifest = json.load(f)
+            self.assertEqual(sorted(manifest['pages']),
+                             ['a.html', 'b.html', 'c.html'])
+
+
+class TestEqlStdlib(unittest.TestCase, BaseDomainTest):
+
+    def function(self, signature, description):
+        name = signature.partition('(')[0].split('::')[1]
+        fsig = eql.FunctionSignature('std', name, signature, (), 'int64')
+        return stdlib.StdlibObject(
+            'function', 'std', name, fsig, description, 'std.eql')
+
+    def type(self, name, description):
+        return stdlib.StdlibObject(
+            'type', 'std', name, f'std::{name}', description, 'std.eql')
+
+    def render(self, objects):
+        lines = []
+        for group in stdlib.group_objects(objects):
+            group_lines, error = stdlib.render_objects(group)
+            self.assertIsNone(error)
+            lines.extend(group_lines)
+        return '\n'.join(lines)
+
+    def test_eql_stdlib_1(self):
+        objects = [
+            self.function('std::len(str) -> int64',
+                          'Return the length. Counts characters.'),
+            self.type('str', 'A string.'),
+            self.function('std::len(bytes) -> int64',
+                          'Return the length. Counts bytes.'),
+            self.function('std::abs(int64) -> int64', 'Absolute value.'),
+        ]
+
+        groups = stdlib.group_objects(objects)
+        self.assertEqual(
+            [[(obj.kind, obj.name) for obj in group] for group in groups],
+            [
+                [('type', 'str')],
+                [('function', 'abs')],
+                [('function', 'len'), ('function', 'len')],
+            ])
+
+        # Overloads share one directive, in the order of the schema.
+        self.assertEqual(
+            stdlib.render_objects(groups[2]),
+            ([
+                '.. eql:function:: std::len(str) -> int64',
+                '                  std::len(bytes) -> int64',
+                '',
+                '    Return the length.',
+                '',
+                '    Counts characters.',
+                '',
+                '    Return the length. Counts bytes.',
+                '',
+            ], None))
+
+        self.assertEqual(
+            stdlib.render_objects(groups[0]),
+            ([
+                '.. eql:type:: std::str',
+                '',
+                '    A string.',
+                '',
+            ], None))
+
+    def test_eql_stdlib_2(self):
+        # No fields are generated: the schema has no descriptions of
+        # parameters or results, and the types are in the signatures.
+        lines, _ = stdlib.render_objects([
+            self.function('std::abs(int64) -> int64', 'Absolute value.')])
+        self.assertEqual(
+            [line for line in lines if line.strip().startswith(':')], [])
+
+        self.assertEqual(
+            stdlib.render_objects([
+                self.function('std::abs(int64) -> int64', None)]),
+            (None, 'function std::abs has no description'))
+
+        lines, error = stdlib.render_objects([self.type('str', 'A' * 80)])
+        self.assertIsNone(lines)
+        self.assertRegex(
+            error,
+            r'^type std::str has an unsuitable description: '
+            r'First paragraph is expected to be shorter than 80')
+
+    def test_eql_stdlib_3(self):
+        src = self.render([
+            self.type('int64', 'A 64-bit integer. Signed.'),
+            self.type('str', 'A string.'),
+        ])
+
+        out = self.build(src, format='xml')
+        x = requests_xml.XML(xml=out)
+
+        self.assertEqual(
+            x.xpath('//desc/@summary'), ['A 64-bit integer.', 'A string.'])
+        self.assertEqual(
+            x.xpath('//desc/desc_content/paragraph/text()'),
+            ['A 64-bit integer.', 'Signed.', 'A string.'])
+        self.assertEqual(x.xpath('//desc_content/field_list'), [])
+
+    def test_eql_stdlib_4(self):
+        src = self.render([
+            self.function('std::len(str) -> int64', 'Return the length.'),
+            self.function('std::len(bytes) -> int64', 'Return the length.'),
+        ])
+
+        out = self.build(src, format='xml')
+        x = requests_xml.XML(xml=out)
+
+        self.assertEqual(len(x.xpath('//desc')), 1)
+        self.assertEqual(
+            x.xpath('//desc_signature/@eql-signature'),
+            ['std::len(str) -> int64', 'std::len(bytes) -> int64'])
+        self.assertEqual(
+            len(x.xpath('//desc_signature[@ids="function::std::len"]')), 1)
+
+    def test_eql_stdlib_5(self):
+        with tempfile.TemporaryDirectory() as td:
+            env = types.SimpleNamespace(
+                config=types.SimpleNamespace(edgedb_stdlib_path=td),
+                doctreedir=os.path.join(td, 'doctrees'))
+
+            self.assertEqual(stdlib.load_stdlib(env), ([], []))
+            caches = os.listdir(env.doctreedir)
+            self.assertEqual(len(caches), 1)
+
+            # A change of the extension code invalidates the cache.
+            with unittest.mock.patch.object(
+                    fingerprint, 'current_extension_fingerprint',
+                    return_value='changed'):
+                stdlib.load_stdlib(env)
+            self.assertEqual(len(os.listdir(env.doctreedir)), 2)
+
+            stdlib.load_stdlib(env)
+            self.assertEqual(len(os.listdir(env.doctreedir)), 2)
+
+
+class TestCachedToctree(unittest.TestCase):
+
+    SOURCES = {
+        'conf.py': '''
+            master_doc = 'contents'
+            edgedb_cached_toctree = True
+        ''',
+        'contents.rst': '''
+            Root
+            ====
+
+            .. toctree::
+                :caption: Guide
+                :maxdepth: 3
+
+                a/index
+                b
+
+            .. toctree::
+                :hidden:
+
+                c
+        ''',
+        'a/index.rst': '''
+            A
+            =
+
+            Section A
+            ---------
+
+            .. toctree::
+
+                one
+                two
+        ''',
+        'a/one.rst': '''
+            One
+            ===
+
+            Section One
+            -----------
+
+            .. toctree::
+
+                deep
+        ''',
+        'a/two.rst': 'Two\n===\n',
+        'a/deep.rst': 'Deep\n====\n',
+        'b.rst': 'B\n=\n\nSection B\n---------\n',
+        'c.rst': 'C\n=\n',
+    }
+
+    def test_cached_toctree_1(self):
+        # Like sphinx-build, keep the docutils registrations of the
+        # application out of the other tests.
+        with tempfile.TemporaryDirectory() as td, \
+                s_docutils.docutils_namespace():
+            srcdir = os.path.join(td, 'src')
+            for name, text in self.SOURCES.items():
+                os.makedirs(
+                    os.path.dirname(os.path.join(srcdir, name)),
+                    exist_ok=True)
+                with open(os.path.join(srcdir, name), 'wt') as f:
+                    f.write(textwrap.dedent(text))
+
+            app = s_app.Sphinx(
+                srcdir, srcdir, os.path.join(td, 'out'),
+                os.path.join(td, 'doctrees'), 'html',
+                confoverrides={'extensions': ['edgedb.sphinxext']},
+                status=None, warning=None, freshenv=True)
+            app.build()
+            builder = app.builder
+
+            out = {}
+            for pagename in sorted(app.env.all_docs):
+                context = {
+                    'toctree': lambda **kw: builder._get_local_toctree(
+                        pagename, **kw),
+                }
+                default_toctree = context['toctree']
+                navigation.install_toctree(
+                    app, pagename, 'page.html', context, None)
+
+                for kwargs in [{}, {'collapse': False}, {'maxdepth': 2},
+                               {'titles_only': True},
+                               {'includehidden': True}]:
+                    with self.subTest(pagename=pagename, **kwargs):
+                        self.assertEqual(
+                            context['toctree'](**kwargs),
+                            default_toctree(**kwargs))
+
+                out[pagename] = context['toctree']()
+
+        # The entry of the page and its ancestors are current; the
+        # entries of other pages are collapsed.
+        self.assertIn(
+            '<li class="toctree-l1 current">'
+            '<a class="reference internal" href="index.html">A</a>'
+            '<ul class="current">', out['a/one'])
+        self.assertIn(
+            '<li class="toctree-l3 current">'
+            '<a class="current reference internal" href="#">One</a></li>',
+            out['a/one'])
+        self.assertIn(
+            '<li class="toctree-l1">'
+            '<a class="reference internal" href="../b.html">B</a></li>',
+            out['a/one'])
+
+        # Entries pruned by maxdepth still mark their ancestors current.
+        self.assertIn(
+            '<li class="toctree-l3 current">'
+            '<a class="reference internal" href="one.html">One</a></li>',
+            out['a/deep'])
+
+
+class TestEqlObjectIndex(unittest.TestCase):
+
+    def test_eql_objindex_1(self):
+        idx = eql.EQLObjectIndex()
+        idx['type::std::int64'] = ('a', 'type')
+        idx['type::std::str'] = ('b', 'type')
+        idx['function::std::len'] = ('b', 'function')
+
+        self.assertEqual(len(idx), 3)
+        self.assertEqual(idx.shard_names(), ['function', 'type'])
+
+        idx2 = pickle.loads(pickle.dumps(idx))
+        self.assertEqual(idx2._shards, {})
+        self.assertEqual(dict(idx2), dict(idx))
+
+        idx2.clear_doc('b')
+        self.assertEqual(dict(idx2), {'type::std::int64': ('a', 'type')})
+
+        idx3 = eql.EQLObjectIndex()
+        idx3.merge(idx, ['b'])
+        self.assertEqual(
+            dict(idx3),
+            {
+                'type::std::str': ('b', 'type'),
+                'function::std::len': ('b', 'function'),
+            })
+
+    def test_eql_objindex_2(self):
+        idx = eql.EQLObjectIndex()
+        idx['type::std::int64'] = ('a', 'type')
+        idx['function::std::len'] = ('a', 'function')
+        pickle.dumps(idx)
+
+        blob = idx._blobs['type']
+        idx['function::std::sum'] = ('a', 'function')
+        pickle.dumps(idx)
+
+        # Only the modified shard is pickled again.
+        self.assertIs(idx._blobs['type'], blob)
+        self.assertIn('function::std::sum',
+                      pickle.loads(idx._blobs['function']))
+
+    def test_eql_objindex_3(self):
+        idx = eql.EQLObjectIndex()
+        idx['type::std::int64'] = ('a', 'type')
+        idx['function::std::len'] = ('a', 'function')
+
+        idx.compact()
+        self.assertEqual(idx._shards, {})
+        self.assertEqual(idx['type::std::int64'], ('a', 'type'))
+        self.assertEqual(list(idx._shards), ['type'])
+        self.assertEqual(len(idx), 2)
+
+
+class TestEqlSourceIndex(unittest.TestCase):
+
+    SOURCE = textwrap.dedent('''
+        SELECT
+        ======
+
+        :eql-statement:
+
+        Select things from :eql:type:`SET OF array\\<int64\\>`.
+
+        .. eql:function:: std::len(str) -> int64
+
+            :param $0: input string
+            :paramtype $0: str
+            :return: string length
+            :returntype: int64
+
+            Return the length of a string, see
+            :eql:stmt:`the statement <SELECT>`.
+
+        .. code-block:: edgeql
+
+            SELECT :eql:func:`not_a_role`;
+
+        .. eql:operator:: PLUS: A + B
+
+            Arithmetic addition, unlike :eql:op:`!MINUS`.
+    ''')
+
+    def test_eql_srcindex_1(self):
+        scan = srcindex.scan_source(self.SOURCE, 'a.rst')
+
+        self.assertEqual(
+            [(d.target, d.lineno) for d in scan.declarations],
+            [
+                ('function::std::len', 8),
+                ('operator::PLUS', 22),
+                ('statement::SELECT', 1),
+            ])
+        func = scan.declarations[0]
+        self.assertEqual(
+            [name for name, *_ in func.fields],
+            ['param $0', 'paramtype $0', 'return', 'returntype'])
+        self.assertEqual(
+            func.paragraph,
+            'Return the length of a string, see '
+            ':eql:stmt:`the statement <SELECT>`.')
+        self.assertEqual(
+            srcindex.plain_text(func.paragraph),
+            'Return the length of a string, see the statement.')
+
+        self.assertEqual(
+            [(r.role, r.target, r.lineno) for r in scan.references],
+            [
+                ('type', 'SET OF array<int64>', 6),
+                ('stmt', 'SELECT', 16),
+            ])
+        self.assertEqual(scan.problems, [])
+
+    def test_eql_srcindex_2(self):
+        index = srcindex.SourceIndex()
+        index.update(srcindex.scan_source(self.SOURCE, 'a.rst'))
+        index.update(srcindex.scan_source(
+            '.. eql:type:: std::int64\n\n    A 64-bit integer.\n', 'b.rst'))
+
+        _, _, _, filename, objtype = eql.EdgeQLDomain.find_target(
+            index.objects, 'type',
+            eql.EQLTypeXRef.filter_target('SET OF array<int64>'))
+        self.assertEqual((filename, objtype), (None, None))
+
+        _, _, target, filename, objtype = eql.EdgeQLDomain.find_target(
+            index.objects, 'type', 'int64')
+        self.assertEqual(
+            (target, filename, objtype), ('type::std::int64', 'b.rst', 'type'))
+
+        # A rescanned file replaces its declarations.
+        self.assertTrue(index.update(srcindex.scan_source('', 'b.rst')))
+        self.assertNotIn('type::std::int64', index.objects)
+        self.assertIn('function::std::len', index.objects)
+
+    def test_eql_srcindex_3(self):
+        with tempfile.TemporaryDirectory() as td:
+            with open(os.path.join(td, 'a.rst'), 'wt') as f:
+                f.write(self.SOURCE)
+            with open(os.path.join(td, 'b.rst'), 'wt') as f:
+                f.write('See :eql:func:`len` and :eql:func:`std::nope`.\n')
+
+            problems, _ = xrefcheck.check(
+                sorted(xrefcheck.find_sources(td)))
+
+        self.assertEqual(
+            [(os.path.basename(p.filename), p.lineno, p.message)
+             for p in problems],
+            [
+                ('a.rst', 6,
+                 "cannot resolve :eql:type: targeting 'type::std::array'"),
+                ('b.rst', 0,
+                 "cannot resolve :eql:func: targeting "
+                 "'function::std::nope'"),
+            ])
+
+
+class TestEqlSuggestions(unittest.TestCase, BaseDomainTest):
+
+    def test_eql_suggest_1(self):
+        index = suggest.SuggestionIndex([
+            ('type::std::int16', 'type'),
+            ('type::std::int32', 'type'),
+            ('type::std::int64', 'type'),
+            ('type::std::str', 'type'),
+            ('function::std::len', 'function'),
+            ('function::std::str_lower', 'function'),
+            ('statement::SELECT', 'statement'),
+            ('keyword::SET-OF', 'keyword'),
+        ])
+
+        self.assertEqual(
+            index.suggest('type', 'std::in64'),
+            [('type::std::int64', 'type'), ('type::std::int16', 'type'),
+             ('type::std::int32', 'type')])
+        self.assertEqual(index.suggest('type', 'std::nope'), [])
+
+        # Close matches of other types follow the same type.
+        self.assertEqual(
+            index.suggest('function', 'select'),
+            [('statement::SELECT', 'statement')])
+        self.assertEqual(
+            index.suggest('type', 'set of'),
+            [('keyword::SET-OF', 'keyword')])
+
+        self.assertEqual(
+            eql.EdgeQLDomain.did_you_mean(index, 'func', 'function::lenn'),
+            '; did you mean :eql:func:`len`?')
+        self.assertEqual(
+            eql.EdgeQLDomain.did_you_mean(index, 'kw', 'keyword::SELECT'),
+            '; did you mean :eql:stmt:`SELECT`?')
+        self.assertEqual(
+            eql.EdgeQLDomain.did_you_mean(index, 'type', 'type::std::i64'),
+            '; did you mean :eql:type:`int64`?')
+
+    def test_eql_suggest_2(self):
+        src = '''
+        SELECT
+        ======
+
+        :eql-statement:
+
+        Select things.
+
+        Test
+        ====
+
+        A ref to :eql:kw:`SELECT`
+        '''
+
+        # A reference with the wrong role suggests the right one.
+        with self.assert_fails(
+                r"cannot resolve :eql:kw: targeting 'keyword::SELECT'; "
+                r"did you mean :eql:stmt:`SELECT`\?"):
+            self.build(src)
+
+    def test_eql_suggest_3(self):
+        src = '''
+        .. eql:type:: std::int16
+
+            aaa
+
+        .. eql:keyword:: SET OF
+
+            aaa
+
+        Testing refs :eql:func:`int16`
+        '''
+
+        with self.assert_fails(
+                r"cannot resolve :eql:func: targeting "
+                r"'function::std::int16'; did you mean :eql:type:`int16`\?"):
+            self.build(src)
+
+
+class TestLanguageServer(unittest.TestCase):
+
+    SOURCE = textwrap.dedent('''\
+        .. eql:function:: std::len(str) -> int64
+
+            :param $0: input string
+
+            Return the length of a string.
+
+        See :eql:type:`int64` and :eql:func:`lenn`.
+    ''')
+
+    def setUp(self):
+        td = tempfile.TemporaryDirectory()
+        self.addCleanup(td.cleanup)
+        self.docsdir = td.name
+        with open(os.path.join(self.docsdir, 'b.rst'), 'wt') as f:
+            f.write('.. eql:type:: std::int64\n\n    A 64-bit integer.\n')
+
+        self.output = io.BytesIO()
+        self.server = lsp.LanguageServer(self.docsdir, output=self.output)
+        self.server.dispatch({'id': 1, 'method': 'initialize', 'params': {}})
+        self.server.dispatch({'method': 'initialized', 'params': {}})
+        self.assertEqual(
+            self.messages()[0]['result']['capabilities']['textDocumentSync'],
+            {'openClose': True, 'change': lsp.TEXT_DOCUMENT_SYNC_INCREMENTAL})
+
+    def messages(self):
+        data = self.output.getvalue()
+        self.output.seek(0)
+        self.output.truncate()
+
+        messages = []
+        while data:
+            header, _, data = data.partition(b'\r\n\r\n')
+            length = int(header.split(b':')[1])
+            messages.append(json.loads(data[:length].decode()))
+            self.assertEqual(messages[-1].pop('jsonrpc'), '2.0')
+            data = data[length:]
+        return messages
+
+    def diagnostics(self):
+        return {
+            os.path.basename(lsp.uri_to_path(msg['params']['uri'])): [
+                (d['range']['start']['line'], d['message'])
+                for d in msg['params']['diagnostics']
+            ]
+            for msg in self.messages()
+            if msg['method'] == 'textDocument/publishDiagnostics'
+        }
+
+    def uri(self, name):
+        return lsp.path_to_uri(os.path.join(self.docsdir, name))
+
+    def open(self, name, text):
+        self.server.dispatch({
+            'method': 'textDocument/didOpen',
+            'params': {'textDocument': {
+                'uri': self.uri(name), 'text': text, 'version': 1}},
+        })
+
+    def change(self, name, *changes):
+        self.server.dispatch({
+            'method': 'textDocument/didChange',
+            'params': {
+                'textDocument': {'uri': self.uri(name), 'version': 2},
+                'contentChanges': [
+                    {
+                        'range': {
+                            'start': {'line': line, 'character': col},
+                            'end': {'line': end_line, 'character': end_col},
+                        },
+                        'text': text,
+                    }
+                    for (line, col), (end_line, end_col), text in changes
+                ],
+            },
+        })
+        return self.server.documents[self.uri(name)]
+
+    def request(self, method, name, line, col):
+        self.server.dispatch({
+            'id': 2,
+            'method': method,
+            'params': {
+                'textDocument': {'uri': self.uri(name)},
+                'position': {'line': line, 'character': col},
+            },
+        })
+        return [msg['result'] for msg in self.messages() if 'id' in msg]
+
+    def test_lsp_1(self):
+        doc = lsp.Document(self.uri('a.rst'), 'abc\ndéf\n\nghi', 1)
+
+        self.assertEqual(doc.offset({'line': 0, 'character': 0}), 0)
+        self.assertEqual(doc.offset({'line': 1, 'character': 2}), 6)
+        # Positions past the end of a line or of the text are clamped.
+        self.assertEqual(doc.offset({'line': 1, 'character': 10}), 7)
+        self.assertEqual(doc.offset({'line': 3, 'character': 3}), 12)
+
+        doc.apply_change({
+            'range': {'start': {'line': 0, 'character': 1},
+                      'end': {'line': 1, 'character': 1}},
+            'text': 'X\nY'})
+        self.assertEqual(doc.text, 'aX\nYéf\n\nghi')
+        doc.apply_change({
+            'range': {'start': {'line': 2, 'character': 0},
+                      'end': {'line': 2, 'character': 0}},
+            'text': 'new'})
+        self.assertEqual(doc.text, 'aX\nYéf\nnew\nghi')
+        doc.apply_change({
+            'range': {'start': {'line': 1, 'character': 3},
+                      'end': {'line': 3, 'character': 1}},
+            'text': ''})
+        self.assertEqual(doc.text, 'aX\nYéfhi')
+        doc.apply_change({'text': 'replaced'})
+        self.assertEqual(doc.text, 'replaced')
+
+    def test_lsp_2(self):
+        self.open('a.rst', self.SOURCE)
+        self.assertEqual(self.diagnostics(), {'a.rst': [
+            (6, "cannot resolve :eql:func: targeting 'function::std::lenn'; "
+                "did you mean :eql:func:`len`?"),
+        ]})
+
+        # Changes are applied in order and the document is rescanned
+        # once they stop arriving.
+        doc = self.change(
+            'a.rst',
+            ((6, 37), (6, 41), 'len'),
+            ((6, 15), (6, 20), 'int32'))
+        self.assertEqual(doc.lines()[6],
+                         'See :eql:type:`int32` and :eql:func:`len`.')
+        self.assertEqual(self.diagnostics(), {})
+
+        deadline = self.server.next_deadline()
+        self.assertIsNotNone(deadline)
+        self.server.rescan_due(deadline - lsp.DEBOUNCE / 2)
+        self.assertEqual(self.diagnostics(), {})
+
+        self.server.rescan_due(deadline)
+        self.assertEqual(self.diagnostics(), {'a.rst': [
+            (6, "cannot resolve :eql:type: targeting 'type::std::int32'; "
+                "did you mean :eql:type:`int64`?"),
+        ]})
+        self.assertIsNone(self.server.next_deadline())
+
+    def test_lsp_3(self):
+        self.open('a.rst', self.SOURCE)
+        self.messages()
+
+        self.assertEqual(self.request(
+            'textDocument/completion', 'a.rst', 6, 15), [{
+                'isIncomplete': False,
+                'items': [{
+                    'label': 'int64',
+                    'kind': 7,
+                    'detail': 'type std::int64',
+                    'documentation': 'A 64-bit integer.',
+                }],
+            }])
+        self.assertEqual(self.request(
+            'textDocument/completion', 'a.rst', 6, 37), [{
+                'isIncomplete': False,
+                'items': [{
+                    'label': 'len',
+                    'kind': 3,
+                    'detail': 'function std::len(str) -> int64',
+                    'documentation': 'Return the length of a string.',
+                }],
+            }])
+
+        # A pending change is scanned before completing.
+        self.change('a.rst', ((3, 0), (3, 0), '    :'))
+        self.assertEqual(self.request(
+            'textDocument/completion', 'a.rst', 3, 5), [{
+                'isIncomplete': False,
+                'items': [
+                    {'label': name, 'kind': lsp.COMPLETION_KIND_FIELD}
+                    for name in ['index', 'param', 'paramtype', 'return',
+                                 'returntype']
+                ],
+            }])
+        self.assertIsNone(self.server.next_deadline())
+
+        self.change('a.rst', ((5, 0), (5, 0), ':'))
+        self.assertEqual(self.request(
+            'textDocument/completion', 'a.rst', 5, 1), [{
+                'isIncomplete': False,
+                'items': [
+                    {'label': name, 'kind': lsp.COMPLETION_KIND_FIELD}
+                    for name in ['eql-statement', 'eql-haswith']
+                ],
+            }])
+
+        self.assertEqual(
+            self.request('textDocument/completion', 'a.rst', 0, 1),
+            [{'isIncomplete': False, 'items': []}])
+        self.assertEqual(
+            self.request('textDocument/completion', 'a.rst', 99, 0),
+            [{'isIncomplete': False, 'items': []}])
+        self.assertEqual(
+            self.request('textDocument/completion', 'closed.rst', 0, 0),
+            [{'isIncomplete': False, 'items': []}])
+
+    def test_lsp_4(self):
+        self.open('a.rst', self.SOURCE)
+        self.messages()
+
+        self.assertEqual(
+            self.request('textDocument/definition', 'a.rst', 6, 18),
+            [{
+                'uri': self.uri('b.rst'),
+                'range': {
+                    'start': {'line': 0, 'character': 0},
+                    'end': {'line': 0, 'character': 0},
+                },
+            }])
+        self.assertEqual(
+            self.request('textDocument/definition', 'a.rst', 6, 40),
+            [None])
+        self.assertEqual(
+            self.request('textDocument/definition', 'a.rst', 4, 4),
+            [None])
+
+    def test_lsp_5(self):
+        self.open('a.rst', 'See :eql:type:`int32`.\n')
+        self.assertEqual(self.diagnostics(), {'a.rst': [
+            (0, "cannot resolve :eql:type: targeting 'type::std::int32'; "
+                "did you mean :eql:type:`int64`?"),
+        ]})
+
+        # A declaration in another open file resolves the reference.
+        self.open('c.rst', '.. eql:type:: std::int32\n\n    32 bits.\n')
+        self.assertEqual(
+            self.diagnostics(), {'a.rst': [], 'c.rst': []})
+
+        # Changes that keep the declarations only republish the
+        # changed file.
+        self.change('c.rst', ((3, 0), (3, 0), '\nMore text.\n'))
+        self.server.rescan_due(self.server.next_deadline())
+        self.assertEqual(self.diagnostics(), {'c.rst': []})
+
+        self.change('c.rst', ((0, 19), (0, 24), 'int16'))
+        self.server.rescan_due(self.server.next_deadline())
+        self.assertEqual(self.diagnostics(), {
+            'a.rst': [
+                (0, "cannot resolve :eql:type: targeting "
+                    "'type::std::int32'; did you mean :eql:type:`int16` or "
+                    ":eql:type:`int64`?"),
+            ],
+            'c.rst': [],
+        })
+
+        # The closed file is indexed as it is on disk.
+        self.server.dispatch({
+            'method': 'textDocument/didClose',
+            'params': {'textDocument': {'uri': self.uri('c.rst')}},
+        })
+        self.assertEqual(self.diagnostics(), {'c.rst': []})
+        self.assertNotIn('type::std::int16', self.server.index.objects)
+
+    def test_lsp_6(self):
+        self.open('a.rst', self.SOURCE)
+        self.messages()
+
+        # A failing request gets an error response.
+        self.server.dispatch({
+            'id': 3,
+            'method': 'textDocument/definition',
+            'params': {'textDocument': {'uri': self.uri('a.rst')}},
+        })
+        [response] = self.messages()
+        self.assertEqual(response['id'], 3)
+        self.assertEqual(response['error']['code'], lsp.INTERNAL_ERROR)
+
+        # A failing notification is logged and dropped.
+        self.server.dispatch({
+            'method': 'textDocument/didChange',
+            'params': {'textDocument': {'uri': self.uri('a.rst')}},
+        })
+        [log] = self.messages()
+        self.assertEqual(log['method'], 'window/logMessage')
+        self.assertEqual(log['params']['type'], lsp.MESSAGE_TYPE_ERROR)
+        self.assertIn('textDocument/didChange', log['params']['message'])
+
+        # The server goes on serving.
+        self.assertEqual(
+            self.request('textDocument/definition', 'a.rst', 4, 4),
+            [None])
+
+    def test_lsp_7(self):
+        body = json.dumps({'id': 1, 'method': 'shutdown'}).encode()
+        message = f'Content-Length: {len(body)}\r\n\r\n'.encode() + body
+
+        rfd, wfd = os.pipe()
+        try:
+            reader = lsp.MessageReader(rfd)
+            # Header blocks without a valid Content-Length are dropped.
+            os.write(wfd, b'X-Junk: 1\r\n\r\n' + message +
+                     b'Content-Length: many\r\n\r\n' + message)
+            self.assertEqual(reader.read(0), json.loads(body))
+            self.assertEqual(reader.read(0), json.loads(body))
+            self.assertIsNone(reader.read(0))
+
+            os.close(wfd)
+            wfd = None
+            with self.assertRaises(EOFError):
+                reader.read(0)
+        finally:
+            os.close(rfd)
+            if wfd is not None:
+                os.close(wfd)
+
+
+class TestSharedStoreKeys(unittest.TestCase):
+
+    def make_env(self, srcdir, files, *, version='1.0'):
+        for name, text in files.items():
+            with open(os.path.join(srcdir, name), 'wt') as f:
+                f.write(text)
+
+        return types.SimpleNamespace(
+            srcdir=srcdir,
+            config=types.SimpleNamespace(
+                version=version, release=version, today=''),
+            dependencies={'index': {'inc.rst'}},
+            doc2path=lambda docname: os.path.join(srcdir, f'{docname}.rst'))
+
+    def test_shared_store_key_1(self):
+        files = {'index.rst': '.. include:: inc.rst\n', 'inc.rst': 'Text.\n'}
+
+        with tempfile.TemporaryDirectory() as v1, \
+                tempfile.TemporaryDirectory() as v2:
+            env1 = self.make_env(v1, files)
+            env2 = self.make_env(v2, files)
+
+            source_key = multiversion._source_key(env1, 'index', 'cfg')
+            self.assertEqual(
+                multiversion._source_key(env2, 'index', 'cfg'), source_key)
+            self.assertNotEqual(
+                multiversion._source_key(env1, 'index', 'cfg2'), source_key)
+
+            # The same document in two source trees gets the same key.
+            key = multiversion._doc_key(env1, source_key, ['inc.rst'])
+            self.assertEqual(
+                multiversion._doc_key(env2, source_key, ['inc.rst']), key)
+
+            # A change of an included file changes only the full key.
+            with open(os.path.join(v2, 'inc.rst'), 'wt') as f:
+                f.write('Other text.\n')
+            self.assertEqual(
+                multiversion._source_key(env2, 'index', 'cfg'), source_key)
+            changed_key = multiversion._doc_key(env2, source_key, ['inc.rst'])
+            self.assertNotEqual(changed_key, key)
+
+            os.unlink(os.path.join(v2, 'inc.rst'))
+            missing_key = multiversion._doc_key(env2, source_key, ['inc.rst'])
+            self.assertNotIn(missing_key, {key, changed_key})
+
+            self.assertNotEqual(
+                multiversion._doc_key(env1, source_key, []), key)
+
+    def test_shared_store_key_2(self):
+        files = {'index.rst': 'Version |version|.\n'}
+        with tempfile.TemporaryDirectory() as v1, \
+                tempfile.TemporaryDirectory() as v2:
+            env1 = self.make_env(v1, files, version='1.0')
+            env2 = self.make_env(v2, files, version='2.0')
+
+            # Substituted config values are only hashed for documents
+            # that use them.
+            self.assertNotEqual(
+                multiversion._source_key(env1, 'index', 'cfg'),
+                multiversion._source_key(env2, 'index', 'cfg'))
+
+            files = {'index.rst': 'No version.\n'}
+            env1 = self.make_env(v1, files, version='1.0')
+            env2 = self.make_env(v2, files, version='2.0')
+            self.assertEqual(
+                multiversion._source_key(env1, 'index', 'cfg'),
+                multiversion._source_key(env2, 'index', 'cfg'))
+
+    def test_shared_store_key_3(self):
+        def make_config(**values):
+            config = s_config.Config({}, {})
+            config.add('edgedb_test_value', None, 'env', ())
+            config.add('edgedb_test_html', None, 'html', ())
+            for name, value in values.items():
+                setattr(config, name, value)
+            return config
+
+        def setup(app):
+            pass
+
+        key = fingerprint.config_fingerprint(make_config(
+            edgedb_test_value={'b': [setup, {'y', 'x'}], 'a': object()}))
+
+        def setup(app):  # NoQA
+            pass
+
+        # Function and object reprs with memory addresses are stable.
+        self.assertEqual(
+            fingerprint.config_fingerprint(make_config(
+                edgedb_test_value={'a': object(), 'b': [setup, {'x', 'y'}]})),
+            key)
+        self.assertEqual(
+            fingerprint.config_fingerprint(make_config(
+                edgedb_test_value={'b': [setup, {'x', 'y'}], 'a': object()},
+                edgedb_test_html='other')),
+            key)
+        self.assertNotEqual(
+            fingerprint.config_fingerprint(make_config(
+                edgedb_test_value={'b': [setup, {'x', 'z'}], 'a': object()})),
+            key)
+
+        self.assertEqual(
+            fingerprint.stable_repr([1, ('a', None), frozenset({2, 1})]),
+            "[1, ('a', None), {1, 2}]")
+
+        # The set order of strings depends on the hash seed.
+        code = (
+            'from edgedb.sphinxext import fingerprint; '
+            'print(fingerprint.stable_repr({str(i) for i in range(20)}))')
+        outputs = {
+            subprocess.run(
+                [sys.executable, '-c', code], check=True,
+                stdout=subprocess.PIPE,
+                env={**os.environ, 'PYTHONHASHSEED': seed}).stdout
+            for seed in ('1', '2', '3')
+        }
+        self.assertEqual(len(outputs), 1)
+
+
+class TestCICache(unittest.TestCase):
+
+    FILES = {
+        'src/index.rst': 'Index\n',
+        'html/index.html': '<p>index</p>',
+        'html/index.html.gz': 'gz',
+        'html/.edgedb-pages.json': '{"pages": {}}',
+        'html/.edgedb-compress.json': '{}',
+        'html/.doctrees/environment.pickle': 'env',
+        'html/.doctrees/index.doctree': 'doctree',
+    }
+
+    def write_files(self, root):
+        for name, text in self.FILES.items():
+            filename = os.path.join(root, name)
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename, 'wt') as f:
+                f.write(text)
+
+    def read_files(self, root):
+        files = {}
+        for name in self.FILES:
+            with open(os.path.join(root, name), 'rt') as f:
+                files[name] = f.read()
+        return files
+
+    def test_cicache_1(self):
+        with tempfile.TemporaryDirectory() as td:
+            self.write_files(td)
+            cache_dir = os.path.join(td, 'cache')
+            srcdir = os.path.join(td, 'src')
+            outdir = os.path.join(td, 'html')
+            doctreedir = os.path.join(outdir, '.doctrees')
+
+            archive = cicache.export_cache(
+                cache_dir, doctreedir, srcdir, outdir=outdir)
+
+            with tarfile.open(archive) as tar:
+                names = sorted(tar.getnames())
+            self.assertEqual(names, [
+                cicache.MANIFEST_NAME,
+                'doctrees/environment.pickle',
+                'doctrees/index.doctree',
+                'outdir/.edgedb-compress.json',
+                'outdir/.edgedb-pages.json',
+                'outdir/index.html',
+                'outdir/index.html.gz',
+            ])
+
+            shutil.rmtree(outdir)
+            self.assertEqual(
+                cicache.import_cache(
+                    cache_dir, doctreedir, srcdir, outdir=outdir),
+                archive)
+
+            self.assertEqual(self.read_files(td), self.FILES)
+            # The temporary directory is removed.
+            self.assertEqual(sorted(os.listdir(td)), ['cache', 'html', 'src'])
+
+    def test_cicache_2(self):
+        with tempfile.TemporaryDirectory() as td:
+            self.write_files(td)
+            cache_dir = os.path.join(td, 'cache')
+            srcdir = os.path.join(td, 'src')
+            doctreedir = os.path.join(td, 'html', '.doctrees')
+
+            archive = cicache.export_cache(cache_dir, doctreedir, srcdir)
+
+            # A member that does not match the manifest.
+            with tarfile.open(archive, mode='r:gz') as tar:
+                members = [
+                    (m, tar.extractfile(m).read())
+                    for m in tar.getmembers()]
+            with tarfile.open(archive, mode='w:gz') as tar:
+                for member, data in members:
+                    if member.name == 'doctrees/index.doctree':
+                        data = b'tampered'
+                        member.size = len(data)
+                    tar.addfile(member, io.BytesIO(data))
+
+            with open(os.path.join(doctreedir, 'index.doctree'), 'wt') as f:
+                f.write('current')
+            with self.assertRaises(cicache.CacheVerificationError):
+                cicache.import_cache(cache_dir, doctreedir, srcdir)
+            with open(os.path.join(doctreedir, 'index.doctree'), 'rt') as f:
+                self.assertEqual(f.read(), 'current')
+
+
+class TestBuildDaemon(unittest.TestCase):
+
+    def write(self, srcdir, name, text):
+        filename = os.path.join(srcdir, name)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, 'wt') as f:
+            f.write(textwrap.dedent(text))
+        # Make sure the mtime differs from the previous build.
+        mtime = time.time() + 10
+        os.utime(filename, (mtime, mtime))
+
+    def read(self, outdir, name):
+        with open(os.path.join(outdir, name), 'rt') as f:
+            return f.read()
+
+    def cached_app(self, server):
+        (_, app, _), = server.apps.values()
+        return app
+
+    def test_build_daemon_1(self):
+        with tempfile.TemporaryDirectory() as td:
+            srcdir = os.path.join(td, 'src')
+            outdir = os.path.join(td, 'html')
+            self.write(srcdir, 'conf.py', '''
+                extensions = ['edgedb.sphinxext']
+                master_doc = 'contents'
+                templates_path = ['_templates']
+                edgedb_write_if_changed = True
+            ''')
+            self.write(srcdir, '_templates/layout.html', '''
+                {% extends "!layout.html" %}
+            ''')
+            self.write(srcdir, 'contents.rst', '''
+                Contents
+                ========
+
+                .. toctree::
+
+                    other
+            ''')
+            self.write(srcdir, 'other.rst', 'Other\n=====\n\nFirst.\n')
+
+            server = daemon.BuildServer(os.path.join(td, 'daemon.sock'))
+            try:
+                request = {
+                    'srcdir': srcdir,
+                    'outdir': outdir,
+                    'doctreedir': os.path.join(td, 'doctrees'),
+                    'builder': 'html',
+                    'warningiserror': True,
+                }
+
+                self.assertEqual(server.build(request)['status'], 0)
+                self.assertIn('First.', self.read(outdir, 'other.html'))
+                self.assertEqual(len(server.apps), 1)
+                app = self.cached_app(server)
+
+                self.write(srcdir, 'other.rst', 'Other\n=====\n\nSecond.\n')
+                self.assertEqual(server.build(request)['status'], 0)
+                self.assertIn('Second.', self.read(outdir, 'other.html'))
+                # The application is reused with a fresh page writer.
+                self.assertIs(self.cached_app(server), app)
+                self.assertEqual(
+                    json.loads(self.read(outdir, '.edgedb-pages.json'))[
+                        'changed'],
+                    ['other.html'])
+
+                # A changed template recreates the application.
+                self.write(srcdir, '_templates/layout.html', '''
+                    {% extends "!layout.html" %}
+                    {% block footer %}New footer{% endblock %}
+                ''')
+                self.assertEqual(server.build(request)['status'], 0)
+                self.assertIsNot(self.cached_app(server), app)
+                self.assertIn('New footer', self.read(outdir, 'other.html'))
+                self.assertIn(
+                    'New footer', self.read(outdir, 'contents.html'))
+            finally:
+                server.server_close()
+
+
+class TestSourceLinks(unittest.TestCase):
+
+    REV1 = '1' * 40
+    REV2 = '2' * 40
+
+    def write(self, root, name, text):
+        filename = os.path.join(root, *name.split('/'))
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, 'wt') as f:
+            f.write(text)
+
+    def test_srclinks_1(self):
+        with tempfile.TemporaryDirectory() as td:
+            self.write(td, '.git/HEAD', 'ref: refs/heads/master\n')
+            self.write(td, '.git/refs/heads/master', f'{self.REV1}\n')
+            self.write(td, 'doc/index.rst', '')
+            gitdir = os.path.join(td, '.git')
+
+            self.assertEqual(
+                srclinks.find_git_dir(os.path.join(td, 'doc')), gitdir)
+            self.assertEqual(srclinks.read_git_revision(gitdir), self.REV1)
+
+            # A packed ref.
+            os.unlink(os.path.join(gitdir, 'refs', 'heads', 'master'))
+            self.write(td, '.git/packed-refs',
+                       '# pack-refs with: peeled fully-peeled sorted\n'
+                       f'{self.REV2} refs/heads/feature\n'
+                       f'{self.REV1} refs/heads/master\n')
+            self.assertEqual(srclinks.read_git_revision(gitdir), self.REV1)
+
+            self.write(td, '.git/HEAD', 'ref: refs/heads/missing\n')
+            self.assertIsNone(srclinks.read_git_revision(gitdir))
+
+            # A detached HEAD.
+            self.write(td, '.git/HEAD', f'{self.REV2}\n')
+            self.assertEqual(srclinks.read_git_revision(gitdir), self.REV2)
+
+    def test_srclinks_2(self):
+        with tempfile.TemporaryDirectory() as td:
+            # A worktree: ".git" is a file pointing to a directory in
+            # the main repository, which holds the refs.
+            self.write(td, 'main/.git/refs/heads/feature', f'{self.REV2}\n')
+            self.write(td, 'main/.git/worktrees/wt/HEAD',
+                       'ref: refs/heads/feature\n')
+            self.write(td, 'main/.git/worktrees/wt/commondir', '../..\n')
+            self.write(td, 'wt/.git',
+                       'gitdir: ../main/.git/worktrees/wt\n')
+
+            gitdir = srclinks.find_git_dir(os.path.join(td, 'wt'))
+            self.assertEqual(
+                gitdir, os.path.join(td, 'main', '.git', 'worktrees', 'wt'))
+            self.assertEqual(srclinks.read_git_revision(gitdir), self.REV2)
+
+    def test_srclinks_3(self):
+        with tempfile.TemporaryDirectory() as td:
+            self.write(td, '.git/HEAD', f'{self.REV1}\n')
+
+            srclinks.get_repo_context.cache_clear()
+            ctx = srclinks.get_repo_context(
+                td, 'https://github.com/edgedb/edgedb/', 'master')
+
+        self.assertEqual(ctx, {
+            'srclink_src_url': 'https://github.com/edgedb/edgedb',
+            'srclink_src_clone_cmd': 'git clone',
+            'srclink_src_https_url': 'https://github.com/edgedb/edgedb.git',
+            'srclink_src_ssh_url': 'git@github.com:edgedb/edgedb.git',
+            'srclink_src_native_url': 'git://github.com/edgedb/edgedb.git',
+            'srclink_src_rev': self.REV1[:10],
+            'srclink_src_rev_url':
+                f'https://github.com/edgedb/edgedb/commit/{self.REV1}',
+        })
+
+
+class TestMultiBuild(unittest.TestCase):
+
+    def read_tree(self, root):
+        files = {}
+        for dirpath, dirnames, filenames in os.walk(root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                with open(path, 'rb') as f:
+                    files[os.path.relpath(path, root)] = f.read()
+        return files
+
+    def test_multibuild_1(self):
+        opts = ['-C', '-D', 'extensions=edgedb.sphinxext', '-q']
+        with tempfile.TemporaryDirectory() as td:
+            srcdir = os.path.join(td, 'src')
+            os.mkdir(srcdir)
+            for name, text in [
+                    ('index.rst', 'Index\n=====\n\n.. toctree::\n\n'
+                                  '    page\n'),
+                    ('page.rst', 'Page\n====\n\n.. eql:type:: std::int64'
+                                 '\n\n    An integer.\n\n'
+                                 'See :eql:type:`int64`.\n')]:
+                with open(os.path.join(srcdir, name), 'wt') as f:
+                    f.write(text)
+
+            out = os.path.join(td, 'multi')
+            stdout = io.StringIO()
+            with contextlib.redirect_stdout(stdout):
+                returncode = multibuild.main([
+                    srcdir, 'html', 'text', '-o', out, '-j', '2',
+                    *(f'--sphinx-opt={opt}' for opt in opts)])
+            self.assertEqual(returncode, 0, stdout.getvalue())
+
+            # Every builder gets a copy of the doctrees of the read.
+            for builder in ['html', 'text']:
+                self.assertTrue(os.path.exists(os.path.join(
+                    out, f'doctrees.{builder}', 'environment.pickle')))
+
+            for builder in ['html', 'text']:
+                seq = os.path.join(td, 'seq', builder)
+                subprocess.run(
+                    [sys.executable, '-m', 'sphinx', '-b', builder,
+                     '-d', os.path.join(td, 'seq', f'doctrees.{builder}'),
+                     *opts, srcdir, seq],
+                    check=True, stdout=subprocess.PIPE)
+
+                multi = self.read_tree(os.path.join(out, builder))
+                sequential = self.read_tree(seq)
+                self.assertEqual(sorted(multi), sorted(sequential))
+                for name in multi:
+                    if name.endswith(('.html', '.txt')):
+                        self.assertEqual(multi[name], sequential[name], name)
+
+
+class TestSourceHash(unittest.TestCase):
+
+    def write(self, srcdir, name, text):
+        with open(os.path.join(srcdir, name), 'wt') as f:
+            f.write(text)
+
+    def make_app(self, srcdir, *, hash_sources=True):
+        self.write(srcdir, 'index.rst', '.. include:: inc.rst\n')
+        self.write(srcdir, 'inc.rst', 'Text.\n')
+        self.write(srcdir, 'other.rst', 'Version |version|.\n')
+
+        config = types.SimpleNamespace(
+            values={}, version='1.0', release='1.0', today='',
+            edgedb_hash_sources=hash_sources)
+        env = types.SimpleNamespace(
+            srcdir=srcdir,
+            config=config,
+            dependencies={'index': {'inc.rst'}},
+            all_docs={'index': 0, 'other': 0},
+            doc2path=lambda docname: os.path.join(
+                srcdir, f'{docname}.rst'))
+        app = types.SimpleNamespace(env=env, config=config)
+
+        for docname in env.all_docs:
+            env.docname = docname
+            sourcehash.record_hash(app, None)
+        return app
+
+    def test_source_hash_1(self):
+        with tempfile.TemporaryDirectory() as td:
+            env = self.make_app(td).env
+
+            hashes = dict(env.edgedb_source_hashes)
+            self.assertEqual(sorted(hashes), ['index', 'other'])
+            self.assertEqual(
+                sourcehash.source_hash(env, 'index', 'cfg'),
+                sourcehash.source_hash(env, 'index', 'cfg'))
+            self.assertNotEqual(
+                sourcehash.source_hash(env, 'index', 'cfg'),
+                sourcehash.source_hash(env, 'index', 'cfg2'))
+
+            # A changed dependency changes the hash of the document.
+            index_hash = sourcehash.source_hash(env, 'index', 'cfg')
+            self.write(td, 'inc.rst', 'Other text.\n')
+            self.assertNotEqual(
+                sourcehash.source_hash(env, 'index', 'cfg'), index_hash)
+
+            # Substitution values count only for documents using them.
+            index_hash = sourcehash.source_hash(env, 'index', 'cfg')
+            other_hash = sourcehash.source_hash(env, 'other', 'cfg')
+            env.config.version = '2.0'
+            self.assertEqual(
+                sourcehash.source_hash(env, 'index', 'cfg'), index_hash)
+            self.assertNotEqual(
+                sourcehash.source_hash(env, 'other', 'cfg'), other_hash)
+
+    def test_source_hash_2(self):
+        with tempfile.TemporaryDirectory() as td:
+            app = self.make_app(td)
+            env = app.env
+
+            # Only the content of "other" changes; "new" has no hash.
+            self.write(td, 'other.rst', 'Changed.\n')
+            changed = {'index', 'other', 'new'}
+            self.assertEqual(
+                sourcehash.filter_outdated(app, env, set(), changed, set()),
+                [])
+            self.assertEqual(changed, {'other', 'new'})
+            self.assertGreater(env.all_docs['index'], 0)
+            self.assertEqual(env.all_docs['other'], 0)
+
+            changed = {'index'}
+            app.config.edgedb_hash_sources = False
+            sourcehash.filter_outdated(app, env, set(), changed, set())
+            self.assertEqual(changed, {'index'})
+
+    def test_source_hash_3(self):
+        with tempfile.TemporaryDirectory() as td:
+            app = self.make_app(td)
+            other = types.SimpleNamespace()
+            sourcehash.merge_hashes(app, other, ['index'], app.env)
+            self.assertEqual(
+                other.edgedb_source_hashes,
+                {'index': app.env.edgedb_source_hashes['index']})
+
+            sourcehash.purge_hash(app, app.env, 'index')
+            self.assertEqual(
+                sorted(app.env.edgedb_source_hashes), ['other'])
+
+    def test_source_hash_4(self):
+        connected = []
+        app = types.SimpleNamespace(
+            config=types.SimpleNamespace(edgedb_hash_sources=False),
+            connect=lambda event, handler: connected.append(event))
+        sourcehash.connect_hashing(app)
+        self.assertEqual(connected, [])
+        app.config.edgedb_hash_sources = True
+        sourcehash.connect_hashing(app)
+        self.assertEqual(connected, ['doctree-read'])
+
+    def test_source_hash_5(self):
+        # The config hash is computed once per build.
+        with tempfile.TemporaryDirectory() as td:
+            with unittest.mock.patch.object(
+                    fingerprint, 'config_fingerprint',
+                    return_value='cfg') as config_fingerprint:
+                app = self.make_app(td)
+                env = app.env
+                self.assertEqual(config_fingerprint.call_count, 1)
+
+                for build in range(2):
+                    sourcehash.filter_outdated(
+                        app, env, set(), {'index', 'other'}, set())
+                    for docname in env.all_docs:
+                        env.docname = docname
+                        sourcehash.record_hash(app, None)
+                self.assertEqual(config_fingerprint.call_count, 3)
+
+
+class TestReadSchedule(unittest.TestCase):
+
+    def test_schedule_1(self):
+        # Heavy documents next to each other land in one chunk when
+        # the documents are read in their original order.
+        docnames = [f'heavy{i}' for i in range(4)]
+        docnames += [f'light{i:02}' for i in range(26)]
+        costs = {d: 10.0 if d.startswith('heavy') else 1.0
+                 for d in docnames}
+
+        scheduled = list(schedule.schedule(docnames, costs, 4))
+        self.assertEqual(sorted(scheduled), sorted(docnames))
+
+        chunks = s_parallel.make_chunks(scheduled, 4)
+        self.assertEqual(
+            [len(chunk) for chunk in chunks],
+            [len(chunk) for chunk in s_parallel.make_chunks(docnames, 4)])
+
+        totals = [sum(costs[d] for d in chunk) for chunk in chunks]
+        self.assertEqual(
+            [sum(d.startswith('heavy') for d in chunk) for chunk in chunks],
+            [1, 1, 1, 1, 0])
+        # Chunks of the same size are balanced, the most expensive
+        # chunks come first.
+        self.assertLessEqual(max(totals[:4]) - min(totals[:4]), 1.0)
+        self.assertEqual(totals[:4], sorted(totals[:4], reverse=True))
+        self.assertLess(
+            max(totals),
+            max(sum(costs[d] for d in chunk)
+                for chunk in s_parallel.make_chunks(docnames, 4)))
+
+    def test_schedule_2(self):
+        with tempfile.TemporaryDirectory() as td:
+            for docname, size in [('a', 100), ('b', 100), ('c', 300)]:
+                with open(os.path.join(td, f'{docname}.rst'), 'wt') as f:
+                    f.write('x' * size)
+
+            env = types.SimpleNamespace(
+                found_docs={'a', 'b', 'c'},
+                edgedb_read_costs={'a': 2.0, 'gone': 1.0},
+                doc2path=lambda docname: os.path.join(td, f'{docname}.rst'))
+
+            # Documents without a recorded cost are estimated from
+            # their size.
+            self.assertEqual(
+                schedule.estimate_costs(env, ['a', 'b', 'c']),
+                {'a': 2.0, 'b': 2.0, 'c': 6.0})
+            self.assertEqual(env.edgedb_read_costs, {'a': 2.0})
+
+
+class TestMetrics(unittest.TestCase):
+
+    # OpenMetrics text format, for the metric types and values
+    # produced by format_metrics().
+    name_re = r'[a-zA-Z_:][a-zA-Z0-9_:]*'
+    label_re = r'[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\\n]|\\["\\n])*"'
+    sample_re = re.compile(
+        rf'({name_re})(?:\{{{label_re}(?:,{label_re})*\}})? '
+        r'-?[0-9]+(?:\.[0-9]+)?')
+    type_re = re.compile(rf'# TYPE ({name_re}) (?:gauge|counter|unknown)')
+    help_re = re.compile(rf'# HELP ({name_re}) (?:[^\\\n]|\\[\\n])*')
+
+    def assert_openmetrics(self, text):
+        self.assertTrue(text.endswith('\n# EOF\n'))
+        lines = text.split('\n')[:-2]
+
+        families = set()
+        family = None
+        for line in lines:
+            m = self.type_re.fullmatch(line)
+            if m:
+                self.assertNotIn(m.group(1), families)
+                family = m.group(1)
+                families.add(family)
+                continue
+            m = self.help_re.fullmatch(line) or self.sample_re.fullmatch(line)
+            self.assertIsNotNone(m, f'invalid line: {line!r}')
+            self.assertEqual(m.group(1), family)
+
+    def test_metrics_1(self):
+        text = metrics.format_metrics([
+            ('build_success', 'gauge', 'Whether the build succeeded.',
+             [({}, 1)]),
+            ('build_duration_seconds', 'gauge', 'Build duration by phase.',
+             [({'phase': 'total'}, 2.5), ({'phase': 'read'}, 1.25)]),
+            ('eql_objects', 'gauge', 'eql objects by type.', []),
+        ], {'builder': 'html'})
+
+        self.assert_openmetrics(text)
+        self.assertEqual(text.splitlines(), [
+            '# TYPE edgedb_docs_build_success gauge',
+            '# HELP edgedb_docs_build_success Whether the build succeeded.',
+            'edgedb_docs_build_success{builder="html"} 1',
+            '# TYPE edgedb_docs_build_duration_seconds gauge',
+            '# HELP edgedb_docs_build_duration_seconds '
+            'Build duration by phase.',
+            'edgedb_docs_build_duration_seconds'
+            '{builder="html",phase="total"} 2.500000',
+            'edgedb_docs_build_duration_seconds'
+            '{builder="html",phase="read"} 1.250000',
+            '# TYPE edgedb_docs_eql_objects gauge',
+            '# HELP edgedb_docs_eql_objects eql objects by type.',
+            '# EOF',
+        ])
+
+    def test_metrics_2(self):
+        text = metrics.format_metrics([
+            ('documents', 'gauge', 'Documents "read"\nand \\ written.',
+             [({}, 0), ({'state': 'a "b"\\c\nd'}, 3)]),
+        ], {})
+
+        self.assert_openmetrics(text)
+        self.assertEqual(text.splitlines(), [
+            '# TYPE edgedb_docs_documents gauge',
+            r'# HELP edgedb_docs_documents Documents "read"\nand \\ written.',
+            'edgedb_docs_documents 0',
+            r'edgedb_docs_documents{state="a \"b\"\\c\nd"} 3',
+            '# EOF',
+        ])
+
+
+class TestDoctreeStore(unittest.TestCase, BaseDomainTest):
+
+    def make_doctree(self):
+        doctree = d_nodes.document(None, None)
+        section = d_nodes.section(ids=['intro'], names=['intro'])
+        section += d_nodes.title('', 'Intro')
+        section += d_nodes.paragraph(
+            '', '', d_nodes.Text('plain '),
+            d_nodes.emphasis('', 'ünïcode'),
+            d_nodes.literal('', 'SELECT "x"\n'))
+        section += d_nodes.target(refid='x', extra=('a', 1), empty=[])
+        doctree += section
+        doctree += d_nodes.section(
+            '', d_nodes.title('', 'Intro'), ids=['again'],
+            summary='Intro')
+        return doctree
+
+    def test_doctreestore_1(self):
+        doctree = self.make_doctree()
+        data = doctreestore.encode_doctree(doctree)
+
+        with tempfile.TemporaryDirectory() as td:
+            filename = os.path.join(td, 'doc.edt')
+            with open(filename, 'wb') as f:
+                f.write(data)
+
+            with doctreestore.DoctreeFile(filename) as f:
+                self.assertEqual(list(f.metadata()), [
+                    ('section', 'intro', 'Intro', None, 1),
+                    ('section', 'again', 'Intro', 'Intro', 11),
+                ])
+                # Every distinct string is stored once.
+                self.assertEqual(
+                    [f.string(i) for i in range(f._n_strings)].count(
+                        'Intro'), 1)
+
+                # Tuples are decoded as lists.
+                doctree[0][2]['extra'] = ['a', 1]
+                self.assertEqual(f.load().pformat(), doctree.pformat())
+                self.assertEqual(f.load(11).pformat(), doctree[1].pformat())
+                self.assertEqual(f.load(6).pformat(),
+                                 doctree[0][1][1].pformat())
+
+    def test_doctreestore_2(self):
+        with tempfile.TemporaryDirectory() as td:
+            filename = os.path.join(td, 'doc.edt')
+            with open(filename, 'wb') as f:
+                f.write(b'EDT0' + bytes(24))
+
+            with self.assertRaises(doctreestore.DoctreeFormatError):
+                doctreestore.DoctreeFile(filename)
+
+            with open(filename, 'wb') as f:
+                f.write(doctreestore.encode_doctree(
+                    d_nodes.document(None, None)))
+
+            with doctreestore.DoctreeFile(filename) as f:
+                self.assertEqual(list(f.metadata()), [])
+                self.assertEqual(f.load().pformat(), '<document>\n')
+
+    def test_doctreestore_3(self):
+        src = '''
+        =====
+        Title
+        =====
+
+        .. eql:keyword:: SET OF
+
+            blah
+
+        some *text* and ``code``
+
+        :eql:kw:`XXX <SET OF>`
+        '''
+
+        with tempfile.TemporaryDirectory() as td:
+            self.build(src, outdir=td,
+                       config={'edgedb_binary_doctrees': 1})
+
+            doctreedir = os.path.join(td, '.doctrees')
+            with open(os.path.join(doctreedir, 'contents.doctree'),
+                      'rb') as f:
+                doctree = pickle.load(f)
+
+            self.assertEqual(
+                [(docname, record.kind, record.name, record.summary)
+                 for docname, record
+                 in doctreestore.iter_metadata(doctreedir)],
+                [('contents', 'section', 'title', None),
+                 ('contents', 'keyword', 'SET OF', 'blah')])
+
+            filename = doctreestore.doctree_filename(doctreedir, 'contents')
+            with doctreestore.DoctreeFile(filename) as f:
+                self.assertEqual(f.load().pformat(), doctree.pformat())
+
+
+class TestMemoryProfile(unittest.TestCase, BaseDomainTest):
+
+    def test_memprofile_1(self):
+        src = '''
+        =====
+        Title
+        =====
+
+        .. eql:keyword:: SET OF
+
+            blah
+        '''
+
+        with tempfile.TemporaryDirectory() as td:
+            self.build(src, outdir=td,
+                       config={'edgedb_memory_profile': 'prof/mem.txt'})
+
+            with open(os.path.join(td, 'prof', 'mem.txt')) as f:
+                report = f.read()
+
+        self.assertIn('== after read: ', report)
+        self.assertIn('== after resolve (contents): ', report)
+        self.assertIn('== after write: ', report)
+        self.assertIn('growth since the previous snapshot:', report)
+        self.assertRegex(
+            report,
+            r'\n  StatementTransform: [0-9.]+ KiB in total, '
+            r'[0-9.]+ KiB at most \(in contents\)\n')
+        self.assertRegex(report, r'\n  contents: [0-9.]+ KiB\n')
+
+    def test_memprofile_2(self):
+        apply = eql.StatementTransform.apply
+        with tempfile.TemporaryDirectory() as td:
+            app = types.SimpleNamespace(
+                config=types.SimpleNamespace(
+                    edgedb_memory_profile='mem.txt'),
+                registry=types.SimpleNamespace(
+                    get_transforms=lambda: [eql.StatementTransform],
+                    get_post_transforms=lambda: [
+                        eql.XRefBatchTransform, eql.StatementTransform]),
+                outdir=td)
+
+            memprofile.start_profile(app)
+            self.assertIsNot(eql.StatementTransform.apply, apply)
+            # A build that did not finish is cleaned up by the next one,
+            # and apply() is never wrapped twice.
+            memprofile.start_profile(app)
+            self.assertEqual(
+                [cls for cls, _ in app.edgedb_memory_profile.wrapped],
+                [eql.StatementTransform, eql.XRefBatchTransform])
+            wrapped = eql.StatementTransform.apply
+            self.assertIs(wrapped.__wrapped__, apply)
+
+            memprofile.write_report(app, None)
+            self.assertIs(eql.StatementTransform.apply, apply)
+            self.assertNotIn('apply', eql.XRefBatchTransform.__dict__)
+            self.assertTrue(os.path.exists(os.path.join(td, 'mem.txt')))
+
+
+class TestLowMemory(unittest.TestCase, BaseDomainTest):
+
+    SOURCES = {
+        'types.rst': '''
+        =====
+        Types
+        =====
+
+        .. eql:type:: std::str
+
+            A string.
+
+        .. eql:type:: std::int64
+
+            An integer; see :eql:kw:`SET OF` and :ref:`ref_keywords`.
+        ''',
+        'keywords.rst': '''
+        .. _ref_keywords:
+
+        ========
+        Keywords
+        ========
+
+        .. eql:keyword:: SET OF
+
+            A set of :eql:type:`str` or :eql:type:`std::int64`.
+        ''',
+    }
+
+    def build_pages(self, low_memory):
+        src = '''
+        .. toctree::
+
+            types
+            keywords
+
+        See :eql:type:`str`, :eql:kw:`SET OF` and :ref:`ref_keywords`.
+        '''
+
+        with tempfile.TemporaryDirectory() as td:
+            self.build(src, outdir=td, extra_sources=self.SOURCES,
+                       config={'edgedb_low_memory': int(low_memory)})
+            pages = {}
+            for name in os.listdir(td):
+                if name.endswith(('.html', '.js')):
+                    with open(os.path.join(td, name), 'rt') as f:
+                        pages[name] = f.read()
+            return pages
+
+    def test_lowmem_1(self):
+        low_memory = self.build_pages(True)
+        self.assertEqual(low_memory, self.build_pages(False))
+        self.assertIn('keywords.html', low_memory)
+        self.assertIn('href="keywords.html#keyword::SET-OF"',
+                      low_memory['types.html'])
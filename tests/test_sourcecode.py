@@ -7,30 +7,164 @@
 
 
 import collections
+import concurrent.futures
+import contextlib
+import hashlib
 import json
 import os
 import subprocess
 import sys
+import tempfile
 import textwrap
 import unittest
 
 try:
     import docutils.nodes
     import docutils.parsers
+    import docutils.parsers.rst
     import docutils.utils
     import docutils.frontend
 except ImportError:
     docutils = None
 
+from edgedb.lang.edgeql import ast as ql_ast
+from edgedb.lang.edgeql import compiler as ql_compiler
 from edgedb.lang.edgeql import parser as edgeql_parser
 from edgedb.lang.graphql import parser as graphql_parser
+from edgedb.lang.schema import declarative as s_decl
 from edgedb.lang.schema import parser as schema_parser
+from edgedb.lang.schema import std as s_std
 
 
 def find_edgedb_root():
     return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 
+if docutils is not None:
+    class MigrationDirective(docutils.parsers.rst.Directive):
+        """A stand-in for the "eql:migration" directive of the extension."""
+
+        has_content = True
+        required_arguments = 1
+
+        def run(self):
+            code = '\n'.join(self.content)
+            node = docutils.nodes.literal_block(code, code)
+            node['classes'] = ['code', 'eql-migration']
+            node.line = self.lineno
+            return [node]
+
+
+@contextlib.contextmanager
+def migration_directive():
+    """Register the "eql:migration" stand-in while checking schemas.
+
+    TestDocSnippets.test_doc_snippets skips unknown directives, so the
+    directive is not registered for it.
+    """
+    registry = docutils.parsers.rst.directives._directives
+    saved = registry.get('eql:migration')
+    docutils.parsers.rst.directives.register_directive(
+        'eql:migration', MigrationDirective)
+    try:
+        yield
+    finally:
+        if saved is None:
+            registry.pop('eql:migration', None)
+        else:
+            registry['eql:migration'] = saved
+
+
+# schema source hash -> (compiled schema, error)
+_schema_cache = {}
+
+
+def compile_schema(source):
+    key = hashlib.sha256(source.encode()).hexdigest()
+    try:
+        return _schema_cache[key]
+    except KeyError:
+        pass
+
+    try:
+        schema = s_std.load_std_schema()
+        s_decl.load_module_declarations(
+            schema, [('default', schema_parser.parse(source))])
+    except Exception as ex:
+        result = None, ex
+    else:
+        result = schema, None
+
+    _schema_cache[key] = result
+    return result
+
+
+def check_document_schema(filename):
+    """Type-check EdgeQL snippets against the schema declared in a file.
+
+    The schema in effect for a snippet is defined by the last preceding
+    "eql:migration" block or, in documents without migrations, by all
+    preceding "eschema" blocks.  Only queries are checked; DDL snippets
+    are syntax-checked by TestDocSnippets.test_doc_snippets.
+    """
+    with open(filename, 'rt') as f:
+        source = f.read()
+
+    try:
+        with migration_directive():
+            blocks = TestDocSnippets().extract_code_blocks(source, filename)
+    except TestDocSnippets.RestructuredTextStyleError:
+        # Reported by TestDocSnippets.test_doc_snippets.
+        return []
+
+    errors = []
+    schema_src = ''
+    has_migrations = False
+
+    for block in blocks:
+        if block.lang == 'eql-migration':
+            has_migrations = True
+            schema_src = block.code
+            schema, ex = compile_schema(schema_src)
+            if ex is not None:
+                errors.append(
+                    f'could not compile the migration schema in '
+                    f'{block.filename}, around line {block.lineno}: {ex}')
+
+        elif block.lang == 'eschema' and not has_migrations:
+            schema_src += f'\n{block.code}\n'
+
+        elif block.lang == 'edgeql' and schema_src:
+            schema, ex = compile_schema(schema_src)
+            if ex is not None:
+                # Schema fragments in documents without migrations
+                # are not required to form a complete schema.
+                continue
+
+            try:
+                stmts = edgeql_parser.parse_block(block.code)
+            except Exception as ex:
+                errors.append(
+                    f'unable to parse edgeql code block in '
+                    f'{block.filename}, around line {block.lineno}: {ex}')
+                continue
+
+            for stmt in stmts:
+                if (not isinstance(stmt, ql_ast.Statement) or
+                        isinstance(stmt, ql_ast.DDL)):
+                    continue
+                try:
+                    ql_compiler.compile_ast_to_ir(
+                        stmt, schema, modaliases={None: 'default'})
+                except Exception as ex:
+                    errors.append(
+                        f'edgeql code block in {block.filename}, around '
+                        f'line {block.lineno} does not compile against '
+                        f'the declared schema: {ex}')
+
+    return errors
+
+
 class TestFlake8(unittest.TestCase):
 
     def test_flake8(self):
@@ -218,6 +352,22 @@ class TestDocSnippets(unittest.TestCase):
             for block in blocks:
                 self.run_block_test(block)
 
+    @unittest.skipIf(docutils is None, 'docutils is missing')
+    def test_doc_snippets_schema(self):
+        edgepath = find_edgedb_root()
+        docspath = os.path.join(edgepath, 'doc')
+
+        errors = []
+        with concurrent.futures.ProcessPoolExecutor() as pool:
+            for doc_errors in pool.map(check_document_schema,
+                                       self.find_rest_files(docspath)):
+                errors.extend(doc_errors)
+
+        if errors:
+            raise AssertionError(
+                'EdgeQL snippets do not match the declared schema:\n\n' +
+                '\n\n'.join(errors))
+
     @unittest.skipIf(docutils is None, 'docutils is missing')
     def test_doc_test_broken_code_block(self):
         source = '''
@@ -249,6 +399,67 @@ class TestDocSnippets(unittest.TestCase):
         with self.assertRaisesRegex(AssertionError, 'unable to parse edgeql'):
             self.run_block_test(blocks[1])
 
+    @unittest.skipIf(docutils is None, 'docutils is missing')
+    def test_doc_test_schema_mismatch(self):
+        source = textwrap.dedent('''
+            .. eql:migration:: m1
+
+                type User:
+                    property name -> str
+
+            .. code-block:: edgeql
+
+                SELECT User { name };
+
+            .. code-block:: edgeql
+
+                SELECT User { login };
+        ''')
+
+        with tempfile.NamedTemporaryFile('wt', suffix='.rst') as f:
+            f.write(source)
+            f.flush()
+            errors = check_document_schema(f.name)
+
+        self.assertEqual(len(errors), 1)
+        self.assertIn('does not compile against the declared schema',
+                      errors[0])
+
+    @unittest.skipIf(docutils is None, 'docutils is missing')
+    def test_doc_test_schema_broken_code_block(self):
+        source = textwrap.dedent('''
+            .. eql:migration:: m1
+
+                type User:
+                    property name -> str
+
+            .. code-block:: edgeql
+
+                SELECT User { name
+
+            .. code-block:: edgeql
+
+                SELECT User { login };
+        ''')
+
+        with tempfile.NamedTemporaryFile('wt', suffix='.rst') as f:
+            f.write(source)
+            f.flush()
+            errors = check_document_schema(f.name)
+
+            # A block that does not parse does not hide the others.
+            self.assertEqual(len(errors), 2)
+            self.assertIn(
+                f'unable to parse edgeql code block in {f.name}, '
+                f'around line 10', errors[0])
+            self.assertIn('does not compile against the declared schema',
+                          errors[1])
+
+        # The stand-in directive is only registered while checking.
+        blocks = self.extract_code_blocks(source, '<test>')
+        self.assertEqual([block.lang for block in blocks],
+                         ['edgeql', 'edgeql'])
+
     @unittest.skipIf(docutils is None, 'docutils is missing')
     def test_doc_test_broken_long_lines(self):
         source = f'''